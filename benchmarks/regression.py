@@ -0,0 +1,148 @@
+"""
+Performance regression checks for Refiner.transform.
+
+Fixed synthetic datasets are refined end to end (uploads go to the local
+storage stub), each in a fresh interpreter, and the measured throughput and
+peak RSS are checked against the limits and the recorded baseline in
+baseline.json.
+
+Run with: python -m benchmarks.regression [--update]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+from benchmarks.run import run_isolated
+from benchmarks.synthetic import WorkloadSpec
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Dict[str, Any]:
+    """Read the datasets, limits and recorded measurements of a baseline file."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def run_dataset(dataset: Dict[str, Any], runs: int = 1) -> Dict[str, Any]:
+    """
+    Refine a baseline dataset and measure it.
+
+    Args:
+        dataset: Entry of the baseline's "datasets"
+        runs: Number of runs; the best throughput and the lowest peak RSS are kept,
+            which takes out most of the noise of a busy machine
+
+    Returns:
+        The measurements of benchmarks.run.run_point, with the best values over all runs
+    """
+    spec = WorkloadSpec(**dataset["spec"])
+    points = [run_isolated(spec, settings_overrides=dataset.get("settings")) for _ in range(runs)]
+    point = dict(points[0])
+    point["resources_per_second"] = max(p["resources_per_second"] for p in points)
+    point["peak_rss_mb"] = min(p["peak_rss_mb"] for p in points)
+    return point
+
+
+def check_point(point: Dict[str, Any], dataset: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compare the measurements of a dataset with its limits and baseline.
+
+    Args:
+        point: Measurements from run_dataset
+        dataset: Entry of the baseline's "datasets"
+        tolerance: Allowed fraction by which throughput may fall below, and
+            peak RSS rise above, the recorded baseline
+
+    Returns:
+        A description of every regression, empty if there is none
+    """
+    problems = []
+    throughput = point["resources_per_second"]
+    peak_rss = point["peak_rss_mb"]
+
+    if throughput < dataset["min_resources_per_second"]:
+        problems.append(
+            f"throughput {throughput:.1f} res/s is below the floor of {dataset['min_resources_per_second']} res/s"
+        )
+    if peak_rss > dataset["max_peak_rss_mb"]:
+        problems.append(f"peak RSS {peak_rss:.1f} MiB is above the ceiling of {dataset['max_peak_rss_mb']} MiB")
+
+    baseline = dataset.get("baseline")
+    if baseline:
+        if throughput < baseline["resources_per_second"] * (1 - tolerance):
+            problems.append(
+                f"throughput {throughput:.1f} res/s regressed more than {tolerance:.0%} "
+                f"from the baseline of {baseline['resources_per_second']} res/s"
+            )
+        if peak_rss > baseline["peak_rss_mb"] * (1 + tolerance):
+            problems.append(
+                f"peak RSS {peak_rss:.1f} MiB regressed more than {tolerance:.0%} "
+                f"from the baseline of {baseline['peak_rss_mb']} MiB"
+            )
+    return problems
+
+
+def update_baseline(path: str = BASELINE_PATH, runs: int = 3, names: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Measure datasets on this machine and record the results as their baseline.
+
+    Args:
+        path: Baseline file to update
+        runs: Runs per dataset (see run_dataset)
+        names: Datasets to measure (all by default)
+
+    Returns:
+        The updated baseline
+    """
+    baseline = load_baseline(path)
+    for name, dataset in baseline["datasets"].items():
+        if names and name not in names:
+            continue
+        point = run_dataset(dataset, runs)
+        dataset["baseline"] = {
+            "resources_per_second": point["resources_per_second"],
+            "peak_rss_mb": point["peak_rss_mb"]
+        }
+        logging.info(
+            "%s: %.1f res/s, peak RSS %.1f MiB", name, point["resources_per_second"], point["peak_rss_mb"]
+        )
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+        f.write("\n")
+    return baseline
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check Refiner.transform against the performance baseline")
+    parser.add_argument("datasets", nargs="*", help="Datasets to run (all by default)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=None, help="Overrides the baseline's tolerance")
+    parser.add_argument("--update", action="store_true", help="Record the measurements as the new baseline")
+    args = parser.parse_args()
+
+    os.environ.setdefault("REFINEMENT_ENCRYPTION_KEY", "benchmark")
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.update:
+        update_baseline(args.baseline, args.runs, args.datasets)
+        sys.exit(0)
+
+    baseline = load_baseline(args.baseline)
+    tolerance = args.tolerance if args.tolerance is not None else baseline["tolerance"]
+    failed = False
+    for name, dataset in baseline["datasets"].items():
+        if args.datasets and name not in args.datasets:
+            continue
+        point = run_dataset(dataset, args.runs)
+        problems = check_point(point, dataset, tolerance)
+        logging.info(
+            "%-20s %10.1f res/s  peak RSS %8.1f MiB  %s",
+            name, point["resources_per_second"], point["peak_rss_mb"], "; ".join(problems) or "ok"
+        )
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,187 @@
+"""
+Scaling benchmark for Refiner.transform.
+
+Each scale point runs in a fresh interpreter: a synthetic workload is written
+to a temporary directory, refined end to end (IPFS uploads go to a local
+storage stub) and the wall time, throughput and peak RSS are recorded.
+
+Run with: python -m benchmarks.run --scales 1000 10000 100000
+"""
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
+
+from benchmarks.synthetic import WorkloadSpec, write_workload
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KiB on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_point(
+    spec: WorkloadSpec,
+    log_level: str = "WARNING",
+    settings_overrides: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Generate one workload and refine it in the current process.
+
+    Args:
+        spec: Workload to generate
+        log_level: Logging level used while refining
+        settings_overrides: Settings to change for the refinement, e.g. {"MEMORY_BUDGET_BYTES": ...}
+
+    Returns:
+        Measurements for this scale point
+    """
+    os.environ.setdefault("REFINEMENT_ENCRYPTION_KEY", "benchmark")
+    logging.basicConfig(level=log_level, format='%(message)s')
+
+    from benchmarks.storage import local_storage
+    from refiner.config import settings
+    from refiner.jobs import extract_input
+    from refiner.refine import Refiner
+
+    work_dir = tempfile.mkdtemp(prefix="refiner-bench-")
+    try:
+        input_dir = os.path.join(work_dir, "input")
+        output_dir = os.path.join(work_dir, "output")
+        os.makedirs(output_dir)
+
+        started = time.perf_counter()
+        workload = write_workload(spec, input_dir)
+        generate_seconds = time.perf_counter() - started
+
+        settings.INPUT_DIR = input_dir
+        settings.OUTPUT_DIR = output_dir
+        for name, value in (settings_overrides or {}).items():
+            setattr(settings, name, value)
+        baseline_rss = _peak_rss_mb()
+
+        with local_storage(os.path.join(work_dir, "ipfs")):
+            started = time.perf_counter()
+            extract_input(input_dir)
+            Refiner().transform()
+            transform_seconds = time.perf_counter() - started
+
+        return {
+            "resources": spec.resources,
+            "duplicate_ratio": spec.duplicate_ratio,
+            "zipped": spec.zipped,
+            "files": workload["files"],
+            "input_bytes": workload["bytes"],
+            "db_bytes": os.path.getsize(os.path.join(output_dir, "db.libsql")),
+            "generate_seconds": round(generate_seconds, 4),
+            "transform_seconds": round(transform_seconds, 4),
+            "resources_per_second": round(spec.resources / transform_seconds, 1),
+            "baseline_rss_mb": round(baseline_rss, 1),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_isolated(
+    spec: WorkloadSpec,
+    log_level: str = "WARNING",
+    settings_overrides: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Run a scale point in a fresh interpreter so peak RSS is not shared between points."""
+    # Not multiprocessing.Pool: its daemonic workers could not start TRANSFORM_WORKERS processes
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_point, spec, log_level, settings_overrides).result()
+
+
+def scaling_exponents(points: List[Dict[str, Any]], metric: str) -> List[float]:
+    """
+    Log-log slope of metric against resource count between consecutive points.
+
+    A slope of 1.0 means linear scaling; larger values mean super-linear growth.
+    """
+    slopes = []
+    for previous, current in zip(points, points[1:]):
+        if previous[metric] <= 0 or current[metric] <= 0:
+            slopes.append(float("nan"))
+            continue
+        slopes.append(round(
+            math.log(current[metric] / previous[metric]) / math.log(current["resources"] / previous["resources"]),
+            3
+        ))
+    return slopes
+
+
+def run_benchmarks(scales: List[int], base_spec: WorkloadSpec, log_level: str = "WARNING") -> Dict[str, Any]:
+    """
+    Run the benchmark over several scales.
+
+    Args:
+        scales: Resource counts to benchmark, e.g. [10**3, 10**4, 10**5]
+        base_spec: Workload parameters shared by every point; resources is overridden
+        log_level: Logging level used while refining
+
+    Returns:
+        Report with one entry per scale and the time / memory scaling exponents
+    """
+    points = []
+    for scale in sorted(scales):
+        spec = base_spec.model_copy(update={"resources": scale})
+        point = run_isolated(spec, log_level)
+        logging.info(
+            "%9d resources: %8.2fs  %10.1f res/s  peak RSS %8.1f MiB",
+            point["resources"], point["transform_seconds"], point["resources_per_second"], point["peak_rss_mb"]
+        )
+        points.append(point)
+
+    return {
+        "spec": base_spec.model_dump(exclude={"resources"}),
+        "points": points,
+        "time_scaling": scaling_exponents(points, "transform_seconds"),
+        "memory_scaling": scaling_exponents(points, "peak_rss_mb"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Refiner.transform on synthetic FHIR workloads")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10 ** 3, 10 ** 4, 10 ** 5])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1)
+    parser.add_argument("--file-sizes", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--file-size-weights", type=float, nargs="+", default=[0.1, 0.6, 0.3])
+    parser.add_argument("--zip", action="store_true")
+    parser.add_argument("--log-level", default="WARNING", help="Logging level inside the refiner")
+    parser.add_argument("--report", default=None, help="Write the JSON report to this path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    report = run_benchmarks(
+        args.scales,
+        WorkloadSpec(
+            seed=args.seed,
+            duplicate_ratio=args.duplicate_ratio,
+            file_sizes=args.file_sizes,
+            file_size_weights=args.file_size_weights,
+            zipped=args.zip
+        ),
+        args.log_level
+    )
+
+    logging.info("Time scaling (log-log slope): %s", report["time_scaling"])
+    logging.info("Memory scaling (log-log slope): %s", report["memory_scaling"])
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        logging.info("Report written to %s", args.report)
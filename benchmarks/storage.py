@@ -0,0 +1,74 @@
+"""
+Local stand-in for the Pinata IPFS uploads used by Refiner.
+
+Uploaded files and JSON documents are copied into a local directory and
+addressed by their SHA-256 digest, so a refinement can run end to end
+without network access or credentials.
+"""
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Iterator
+from unittest import mock
+
+
+class LocalStorage:
+    """Content-addressed directory that mimics the IPFS upload helpers."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def upload_file(self, file_path: str = None) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        cid = digest.hexdigest()
+        shutil.copyfile(file_path, os.path.join(self.root, cid))
+        return cid
+
+    def upload_json(self, data) -> str:
+        payload = json.dumps(data, sort_keys=True).encode()
+        cid = hashlib.sha256(payload).hexdigest()
+        with open(os.path.join(self.root, cid), 'wb') as f:
+            f.write(payload)
+        return cid
+
+
+@contextmanager
+def local_storage(root: str) -> Iterator[LocalStorage]:
+    """
+    Route the refiner's IPFS uploads to a LocalStorage for the duration of the block.
+
+    Args:
+        root: Directory the uploaded content is written to
+
+    Returns:
+        The LocalStorage receiving the uploads
+    """
+    storage = LocalStorage(root)
+    with mock.patch("refiner.refine.upload_file_to_ipfs", storage.upload_file), \
+            mock.patch("refiner.refine.upload_json_to_ipfs", storage.upload_json):
+        yield storage
+
+
+def install_local_storage(root: str) -> LocalStorage:
+    """
+    Route the refiner's IPFS uploads to a LocalStorage for the rest of the process.
+
+    Meant as a process pool initializer (see refiner.batch.run_batch), since
+    the patches of local_storage do not reach worker processes.
+
+    Args:
+        root: Directory the uploaded content is written to
+
+    Returns:
+        The LocalStorage receiving the uploads
+    """
+    storage = LocalStorage(root)
+    mock.patch("refiner.refine.upload_file_to_ipfs", storage.upload_file).start()
+    mock.patch("refiner.refine.upload_json_to_ipfs", storage.upload_json).start()
+    return storage
@@ -0,0 +1,236 @@
+"""
+Seeded synthetic FHIR workload generator.
+
+Writes Patients, MedicationStatements, MedicationKnowledge resources and
+Bundles into an input directory, one file at a time so that even very large
+workloads (10^7 resources) never have to be held in memory.
+
+Run with: python -m benchmarks.synthetic --resources 10000 --output input
+"""
+import argparse
+import json
+import os
+import random
+import zipfile
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, List, Tuple
+
+from pydantic import BaseModel, Field
+
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+
+MEDICATIONS = [
+    ("1049502", "Acetaminophen 325 MG Oral Tablet"),
+    ("197319", "Amoxicillin 500 MG Oral Capsule"),
+    ("197318", "Ibuprofen 200 MG Oral Tablet"),
+    ("310965", "Lisinopril 10 MG Oral Tablet"),
+    ("314076", "Simvastatin 20 MG Oral Tablet"),
+    ("860975", "Metformin 500 MG Oral Tablet"),
+    ("617314", "Atorvastatin 10 MG Oral Tablet"),
+    ("197361", "Amlodipine 5 MG Oral Tablet"),
+]
+
+FAMILY_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis"]
+GIVEN_NAMES = ["John", "Sarah", "Michael", "Emma", "David", "Olivia", "James", "Sophia"]
+
+# How many recently emitted resources are kept around to be re-emitted as duplicates
+DUPLICATE_POOL_SIZE = 1024
+
+
+class WorkloadSpec(BaseModel):
+    """Parameters of a synthetic workload."""
+    resources: int = Field(1000, description="Total number of resources to emit, duplicates included")
+    seed: int = Field(0, description="Seed for the random generator")
+    duplicate_ratio: float = Field(0.0, description="Fraction of emitted resources that repeat an earlier one")
+    medications_per_patient: int = Field(4, description="Average number of medication resources per patient")
+    knowledge_ratio: float = Field(0.2, description="Fraction of medications emitted as MedicationKnowledge")
+    file_sizes: List[int] = Field(
+        default_factory=lambda: [1, 100, 1000],
+        description="Resources per file; files of size 1 hold a bare resource, larger ones a Bundle"
+    )
+    file_size_weights: List[float] = Field(
+        default_factory=lambda: [0.1, 0.6, 0.3],
+        description="Relative weight of each entry in file_sizes"
+    )
+    zipped: bool = Field(False, description="Write all files into a single input.zip")
+
+
+def _patient(rng: random.Random, patient_id: str) -> Dict[str, Any]:
+    family = rng.choice(FAMILY_NAMES)
+    given = rng.choice(GIVEN_NAMES)
+    return {
+        "resourceType": "Patient",
+        "id": patient_id,
+        "name": [{"use": "official", "family": family, "given": [given]}],
+        "telecom": [
+            {"system": "phone", "value": f"555-{rng.randint(0, 9999):04d}"},
+            {"system": "email", "value": f"{given.lower()}.{family.lower()}.{patient_id}@example.com"}
+        ],
+        "gender": rng.choice(["male", "female"]),
+        "birthDate": f"{rng.randint(1930, 2010)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    }
+
+
+def _medication_statement(rng: random.Random, medication_id: str, patient_id: str) -> Dict[str, Any]:
+    code, display = rng.choice(MEDICATIONS)
+    asserted = datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 365))
+    return {
+        "resourceType": "MedicationStatement",
+        "id": medication_id,
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "status": "active",
+        "medicationCodeableConcept": {
+            "coding": [{"system": RXNORM_SYSTEM, "code": code, "display": display}],
+            "text": display
+        },
+        "effectiveDateTime": (asserted - timedelta(days=rng.randint(0, 30))).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "dateAsserted": asserted.strftime("%Y-%m-%dT%H:%M:%SZ")
+    }
+
+
+def _medication_knowledge(rng: random.Random, medication_id: str, patient_id: str) -> Dict[str, Any]:
+    code, display = rng.choice(MEDICATIONS)
+    return {
+        "resourceType": "MedicationKnowledge",
+        "id": medication_id,
+        "patientId": patient_id,
+        "code": {
+            "coding": [{"system": RXNORM_SYSTEM, "code": code, "display": display}],
+            "text": display
+        }
+    }
+
+
+def generate_resources(spec: WorkloadSpec) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily generate the resources of a workload.
+
+    Args:
+        spec: Workload parameters
+
+    Returns:
+        Iterator over exactly spec.resources FHIR resource dicts
+    """
+    rng = random.Random(spec.seed)
+    recent = deque(maxlen=DUPLICATE_POOL_SIZE)
+    patient_index = 0
+    medication_index = 0
+    current_patient = None
+    remaining_medications = 0
+
+    for _ in range(spec.resources):
+        if recent and rng.random() < spec.duplicate_ratio:
+            yield rng.choice(recent)
+            continue
+
+        if current_patient is None or remaining_medications <= 0:
+            patient_index += 1
+            current_patient = f"patient-{patient_index}"
+            remaining_medications = rng.randint(0, 2 * spec.medications_per_patient)
+            resource = _patient(rng, current_patient)
+        else:
+            medication_index += 1
+            remaining_medications -= 1
+            medication_id = f"med-{medication_index}"
+            if rng.random() < spec.knowledge_ratio:
+                resource = _medication_knowledge(rng, medication_id, current_patient)
+            else:
+                resource = _medication_statement(rng, medication_id, current_patient)
+
+        recent.append(resource)
+        yield resource
+
+
+def _files(spec: WorkloadSpec) -> Iterator[Tuple[str, Dict[str, Any], int]]:
+    """Group generated resources into (filename, document, resource count) tuples."""
+    rng = random.Random(spec.seed + 1)
+    resources = generate_resources(spec)
+    file_index = 0
+    exhausted = False
+
+    while not exhausted:
+        size = rng.choices(spec.file_sizes, weights=spec.file_size_weights)[0]
+        batch = []
+        for resource in resources:
+            batch.append(resource)
+            if len(batch) >= size:
+                break
+        else:
+            exhausted = True
+
+        if not batch:
+            break
+
+        file_index += 1
+        if size == 1:
+            yield f"resource-{file_index:07d}.json", batch[0], 1
+        else:
+            bundle = {
+                "resourceType": "Bundle",
+                "type": "collection",
+                "entry": [{"resource": resource} for resource in batch]
+            }
+            yield f"bundle-{file_index:07d}.json", bundle, len(batch)
+
+
+def write_workload(spec: WorkloadSpec, input_dir: str) -> Dict[str, Any]:
+    """
+    Write a synthetic workload into input_dir.
+
+    Args:
+        spec: Workload parameters
+        input_dir: Directory to write the input files to
+
+    Returns:
+        Summary with the number of files, resources and bytes written
+    """
+    os.makedirs(input_dir, exist_ok=True)
+    summary = {"files": 0, "resources": 0, "bytes": 0, "zipped": spec.zipped}
+
+    archive = None
+    if spec.zipped:
+        archive = zipfile.ZipFile(os.path.join(input_dir, "input.zip"), "w", zipfile.ZIP_DEFLATED)
+
+    try:
+        for filename, document, count in _files(spec):
+            payload = json.dumps(document).encode()
+            if archive is not None:
+                archive.writestr(filename, payload)
+            else:
+                with open(os.path.join(input_dir, filename), "wb") as f:
+                    f.write(payload)
+
+            summary["files"] += 1
+            summary["resources"] += count
+            summary["bytes"] += len(payload)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic FHIR workload")
+    parser.add_argument("--resources", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0)
+    parser.add_argument("--file-sizes", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--file-size-weights", type=float, nargs="+", default=[0.1, 0.6, 0.3])
+    parser.add_argument("--zip", action="store_true")
+    parser.add_argument("--output", default="input")
+    args = parser.parse_args()
+
+    summary = write_workload(
+        WorkloadSpec(
+            resources=args.resources,
+            seed=args.seed,
+            duplicate_ratio=args.duplicate_ratio,
+            file_sizes=args.file_sizes,
+            file_size_weights=args.file_size_weights,
+            zipped=args.zip
+        ),
+        args.output
+    )
+    print(f"Wrote workload to {args.output}: {summary}")
@@ -0,0 +1,53 @@
+"""
+Micro-benchmark of refiner.utils.date against the original parse_timestamp.
+
+Run with: python -m benchmarks.timestamps --values 1000000
+"""
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta
+
+from refiner.utils.date import parse_timestamp, parse_timestamps
+
+
+def parse_timestamp_reference(timestamp):
+    """The original implementation, kept as the baseline."""
+    if isinstance(timestamp, int):
+        return datetime.fromtimestamp(timestamp / 1000.0)
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def fhir_like_values(count: int, distinct: int, seed: int = 0):
+    """Timestamps shaped like FHIR dateAsserted / effectiveDateTime values, with repeats."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    pool = []
+    for _ in range(distinct):
+        moment = start + timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+        pool.append(rng.choice([
+            moment.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            moment.strftime("%Y-%m-%d"),
+            moment.strftime("%Y-%m-%dT%H:%M:%S.%f+02:00"),
+        ]))
+    return [rng.choice(pool) for _ in range(count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark timestamp parsing")
+    parser.add_argument("--values", type=int, default=1_000_000)
+    parser.add_argument("--distinct", type=int, default=10_000)
+    args = parser.parse_args()
+
+    values = fhir_like_values(args.values, args.distinct)
+    candidates = {
+        "reference": lambda: [parse_timestamp_reference(value) for value in values],
+        "parse_timestamp (uncached)": lambda: [parse_timestamp.__wrapped__(value) for value in values],
+        "parse_timestamp": lambda: [parse_timestamp(value) for value in values],
+        "parse_timestamps": lambda: parse_timestamps(values),
+    }
+
+    for name, run in candidates.items():
+        parse_timestamp.cache_clear()
+        seconds = min(timeit.repeat(run, number=1, repeat=3))
+        print(f"{name:28s} {seconds:8.3f}s  {args.values / seconds:12.0f} values/s")
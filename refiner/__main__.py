@@ -1,32 +1,18 @@
-import json
 import logging
-import os
 import sys
 import traceback
-import zipfile
 
-from refiner.refine import Refiner
 from refiner.config import settings
+from refiner.jobs import run_job, write_error_output
+from refiner.jobs import extract_input as _extract_input
 
-logging.basicConfig(level=logging.INFO, format='%(message)s')
+logging.basicConfig(level=settings.LOG_LEVEL, format='%(message)s')
 
 
 def run() -> None:
     """Transform all input files into the database."""
-    input_files_exist = os.path.isdir(settings.INPUT_DIR) and bool(os.listdir(settings.INPUT_DIR))
     print("--> > ", settings.INPUT_DIR)
-    if not input_files_exist:
-        raise FileNotFoundError(f"No input files found in {settings.INPUT_DIR}")
-    extract_input()
-
-    refiner = Refiner()
-    output = refiner.transform()
-    
-    output_path = os.path.join(settings.OUTPUT_DIR, "output.json")
-    print("-->> ", output_path)
-    with open(output_path, 'w') as f:
-        json.dump(output.model_dump(), f, indent=2)    
-    logging.info(f"Data transformation complete: {output}")
+    run_job(settings)
 
 
 def extract_input() -> None:
@@ -34,12 +20,7 @@ def extract_input() -> None:
     If the input directory contains any zip files, extract them
     :return:
     """
-    for input_filename in os.listdir(settings.INPUT_DIR):
-        input_file = os.path.join(settings.INPUT_DIR, input_filename)
-
-        if zipfile.is_zipfile(input_file):
-            with zipfile.ZipFile(input_file, 'r') as zip_ref:
-                zip_ref.extractall(settings.INPUT_DIR)
+    _extract_input(settings.INPUT_DIR)
 
 
 if __name__ == "__main__":
@@ -49,7 +30,5 @@ if __name__ == "__main__":
         logging.error(f"Error during data transformation: {e}")
         traceback.print_exc()
         # Escribe un output.json vacío o con error para que el test no falle por ausencia de archivo
-        output_path = os.path.join(settings.OUTPUT_DIR, "output.json")
-        with open(output_path, 'w') as f:
-            json.dump({"error": str(e)}, f, indent=2)
+        write_error_output(settings.OUTPUT_DIR, e)
         sys.exit(1)
@@ -0,0 +1,165 @@
+"""
+Batch refinement of many contributions.
+
+Takes a manifest of jobs (input path, encryption key, output path) and
+refines them in parallel across a process pool. Every job produces its own
+db.libsql and output.json in its output directory; a summary report of the
+whole batch is written at the end.
+
+The manifest is either a JSON array of jobs or JSON lines, one job per line,
+using the same fields as the worker:
+
+    {"id": "c-1", "input_dir": "/data/c-1.zip", "output_dir": "/out/c-1", "encryption_key": "0x..."}
+
+input_dir may point to a directory or to a zip file.
+
+Run with: python -m refiner.batch manifest.json --workers 8 --report batch_report.json
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from refiner.config import settings
+from refiner.jobs import run_job, write_error_output
+from refiner.worker import Job, job_settings, warm_up
+
+
+def load_manifest(path: str) -> List[Job]:
+    """
+    Read a batch manifest.
+
+    Args:
+        path: Path to a JSON array or JSON lines manifest
+
+    Returns:
+        List of jobs, in manifest order
+    """
+    with open(path, 'r') as f:
+        content = f.read()
+
+    if content.lstrip().startswith('['):
+        entries = json.loads(content)
+    else:
+        entries = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    jobs = []
+    for index, entry in enumerate(entries):
+        job = Job.model_validate(entry)
+        if job.id is None:
+            job.id = str(index)
+        jobs.append(job)
+    return jobs
+
+
+def refine_one(job: Job) -> Dict[str, Any]:
+    """
+    Refine a single batch job; never raises.
+
+    Args:
+        job: Job to run
+
+    Returns:
+        Per-job entry of the batch report
+    """
+    started = time.perf_counter()
+    staging_dir = None
+    try:
+        if zipfile.is_zipfile(job.input_dir):
+            # Zipped contributions are unpacked into a private directory
+            staging_dir = tempfile.mkdtemp(prefix=f"refiner-{job.id}-")
+            shutil.copy(job.input_dir, staging_dir)
+            job = job.model_copy(update={"input_dir": staging_dir})
+
+        output = run_job(job_settings(job))
+        return {
+            "id": job.id,
+            "status": "ok",
+            "output_dir": job.output_dir,
+            "refinement_url": output.refinement_url,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+    except Exception as e:
+        logging.error(f"Error refining batch job {job.id}: {e}")
+        write_error_output(job.output_dir, e)
+        return {
+            "id": job.id,
+            "status": "error",
+            "output_dir": job.output_dir,
+            "error": str(e),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+    finally:
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def _init_worker(initializer: Optional[Callable[..., Any]], initargs: Tuple) -> None:
+    """Pool initializer: warm the worker up, then run the caller's initializer."""
+    warm_up()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def run_batch(
+    jobs: List[Job],
+    workers: Optional[int] = None,
+    initializer: Optional[Callable[..., Any]] = None,
+    initargs: Tuple = ()
+) -> Dict[str, Any]:
+    """
+    Refine jobs in parallel.
+
+    Args:
+        jobs: Jobs to run
+        workers: Number of worker processes (defaults to the CPU count)
+        initializer: Called with initargs in every worker process after the
+            warm-up, e.g. to install a storage stub (not called when workers is 1)
+        initargs: Arguments of initializer
+
+    Returns:
+        Summary report with one entry per job, in manifest order
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        results = [refine_one(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(initializer, initargs)
+        ) as pool:
+            results = list(pool.map(refine_one, jobs))
+
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    return {
+        "jobs": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "workers": workers,
+        "seconds": round(time.perf_counter() - started, 3),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refine many contributions in parallel")
+    parser.add_argument("manifest", help="JSON array or JSON lines file of jobs")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (defaults to the CPU count)")
+    parser.add_argument("--report", default="batch_report.json", help="Where to write the summary report")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=settings.LOG_LEVEL, format='%(message)s')
+    report = run_batch(load_manifest(args.manifest), args.workers)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Batch complete: {report['succeeded']}/{report['jobs']} succeeded, report written to {args.report}")
+    sys.exit(0 if report["failed"] == 0 else 1)
@@ -56,6 +56,134 @@ class Settings(BaseSettings):
         description="IPFS gateway URL for accessing uploaded files. Recommended to use own dedicated gateway to avoid congestion and rate limiting. Example: 'https://ipfs.my-dao.org/ipfs' (Note: won't work for third-party files)"
     )
     
+    DB_BUILD_IN_MEMORY: bool = Field(
+        default=False,
+        description="Build the refinement database in memory and write it to the output directory in one sequential backup"
+    )
+
+    DB_MEMORY_MAX_BYTES: int = Field(
+        default=512 * 1024 * 1024,
+        description="Size above which the in-memory build falls back to building on disk"
+    )
+
+    DETERMINISTIC_OUTPUT: bool = Field(
+        default=False,
+        description="Produce byte-identical db.libsql files for identical inputs (sorted rows, canonical JSON, compacted file)"
+    )
+
+    OUTPUT_SHARDS: int = Field(
+        default=1,
+        description="Split the refinement into this many databases, partitioned by a hash of the patient ID. "
+                    "Each shard is encrypted and uploaded separately and listed in output.json"
+    )
+
+    TRANSFORM_WORKERS: int = Field(
+        default=1,
+        description="Worker processes that transform and write resources into their own SQLite files, "
+                    "merged into the refinement database at the end"
+    )
+
+    MATERIALIZE_AGGREGATES: bool = Field(
+        default=False,
+        description="Materialise medication_code_counts and patient_medication_counts summary tables in the refinement"
+    )
+
+    MEDICATION_FTS: bool = Field(
+        default=False,
+        description="Build an FTS5 full-text index (medication_fts) over medication display and text, "
+                    "joined back with medication.id = medication_fts.id"
+    )
+
+    MASK_PII: bool = Field(
+        default=False,
+        description="Mask patient names and telecom values (emails keep their domain) with a keyed hash"
+    )
+
+    PII_MASK_SALT: Optional[str] = Field(
+        default=None,
+        description="Secret used to key the PII hash; never derive it from REFINEMENT_ENCRYPTION_KEY. "
+                    "Defaults to a random salt per refinement, which gives up byte-identical output of "
+                    "DETERMINISTIC_OUTPUT. Required with CHECKPOINT"
+    )
+
+    TERMINOLOGY_INDEX_PATH: Optional[str] = Field(
+        default=None,
+        description="Terminology index (SQLite, see refiner.utils.terminology) or tab-separated code/display/ingredient "
+                    "file used to fill in missing medication displays and ingredients"
+    )
+
+    TERMINOLOGY_SYSTEM: str = Field(
+        default="http://www.nlm.nih.gov/research/umls/rxnorm",
+        description="Code system of the terminology index; medication codings of other systems are not enriched"
+    )
+
+    CHECKPOINT: bool = Field(
+        default=False,
+        description="Record progress in checkpoint.json in the output directory and resume an interrupted "
+                    "refinement of the same input at its first incomplete stage"
+    )
+
+    MEMORY_BUDGET_BYTES: Optional[int] = Field(
+        default=None,
+        description="RSS budget of reading and transforming the input. When set, Bundles are streamed into a "
+                    "temporary SQLite spool instead of held in memory and transformed in batches that shrink as "
+                    "memory use nears the budget. Encryption still holds the finished database in memory"
+    )
+
+    SPILL_DIR: Optional[str] = Field(
+        default=None,
+        description="Directory of the temporary spool used under MEMORY_BUDGET_BYTES (defaults to the system temp dir)"
+    )
+
+    JSON_BACKEND: str = Field(
+        default="auto",
+        description="JSON implementation for input parsing, JSON columns and output files: "
+                    "'auto' (orjson if installed, else the json module), 'orjson' or 'json'"
+    )
+
+    DIGEST_BLAKE2: bool = Field(
+        default=False,
+        description="Record BLAKE2b digests of the database and its encrypted file in output.json, "
+                    "in addition to SHA-256"
+    )
+
+    PROFILE_CPU: bool = Field(
+        default=False,
+        description="Write a cProfile dump (.pstats) and a text summary per refinement stage into OUTPUT_DIR/profile"
+    )
+
+    PROFILE_MEMORY: bool = Field(
+        default=False,
+        description="Trace allocations with tracemalloc and write the top allocation sites at the end of every stage "
+                    "into OUTPUT_DIR/profile"
+    )
+
+    PROFILE_TOP: int = Field(
+        default=25,
+        description="Number of functions / allocation sites listed in the profile text reports"
+    )
+
+    PROFILE_SAMPLE_EVERY: int = Field(
+        default=0,
+        description="Time every N-th resource of each type in the transformer and write the timings to "
+                    "OUTPUT_DIR/profile/transform_resource.json (0 disables sampling)"
+    )
+
+    LOG_LEVEL: str = Field(
+        default="INFO",
+        description="Logging level of the refinement run"
+    )
+
+    LOG_PROGRESS_INTERVAL: float = Field(
+        default=10.0,
+        description="Minimum number of seconds between two progress summaries on the transform hot path"
+    )
+
+    LOG_SAMPLE_EVERY: int = Field(
+        default=0,
+        description="Log every N-th transformed/skipped resource at DEBUG level (0 disables sampling)"
+    )
+
     class Config:
         env_file = ".env"
         case_sensitive = True
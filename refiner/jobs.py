@@ -0,0 +1,53 @@
+import logging
+import os
+import zipfile
+
+from refiner.config import Settings
+from refiner.models.output import Output
+from refiner.refine import Refiner
+from refiner.utils import json_codec
+
+
+def extract_input(input_dir: str) -> None:
+    """
+    If the input directory contains any zip files, extract them
+    :param input_dir: Directory to scan for zip files
+    :return:
+    """
+    for input_filename in os.listdir(input_dir):
+        input_file = os.path.join(input_dir, input_filename)
+
+        if zipfile.is_zipfile(input_file):
+            with zipfile.ZipFile(input_file, 'r') as zip_ref:
+                zip_ref.extractall(input_dir)
+
+
+def run_job(config: Settings) -> Output:
+    """
+    Refine one contribution described by config and write its output.json.
+
+    Args:
+        config: Settings of this job (input/output directories, encryption key, ...)
+
+    Returns:
+        Output of the refinement
+    """
+    input_files_exist = os.path.isdir(config.INPUT_DIR) and bool(os.listdir(config.INPUT_DIR))
+    if not input_files_exist:
+        raise FileNotFoundError(f"No input files found in {config.INPUT_DIR}")
+    extract_input(config.INPUT_DIR)
+
+    refiner = Refiner(config)
+    output = refiner.transform()
+
+    output_path = os.path.join(config.OUTPUT_DIR, "output.json")
+    json_codec.dump(output.model_dump(exclude_none=True), output_path, indent=2)
+    logging.info(f"Data transformation complete: {output}")
+    return output
+
+
+def write_error_output(output_dir: str, error: Exception) -> None:
+    """Write an output.json describing a failed job, so callers never find it missing."""
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, "output.json")
+    json_codec.dump({"error": str(error)}, output_path, indent=2)
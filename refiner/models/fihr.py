@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, JSON
+from sqlalchemy import Column, String, ForeignKey, Integer, DateTime, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from pydantic import BaseModel
@@ -32,11 +32,78 @@ class MedicationDB(Base):
     display = Column(String, nullable=False)
     system = Column(String, nullable=False)
     text = Column(String, nullable=False)
+    effective_date_time = Column(DateTime, nullable=True) # MedicationStatement.effectiveDateTime, in UTC
+    date_asserted = Column(DateTime, nullable=True) # MedicationStatement.dateAsserted, in UTC
+    ingredient = Column(String, nullable=True) # From the terminology index, when one is configured
 
     # Relationship with PatientDB
     patient = relationship("PatientDB", back_populates="medications")
 
 
+# === ROW RECORDS ===
+# Lightweight stand-ins for PatientDB / MedicationDB produced by the transformer.
+# They carry only the column values (no ORM instance state), and are turned
+# into INSERT parameters when they are written.
+
+class Row:
+    """A row of a table: one slot per column, defaults for columns left out."""
+    __slots__ = ()
+    __tablename__ = None
+    __table__ = None
+    defaults = {}
+
+    def __init__(self, **values):
+        for column in self.__slots__:
+            setattr(self, column, values.get(column, self.defaults.get(column)))
+
+    def params(self) -> dict:
+        """Column values keyed by column name, as passed to an INSERT."""
+        return {column: getattr(self, column) for column in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(id={getattr(self, 'id', None)!r})"
+
+
+class PatientRow(Row):
+    __slots__ = tuple(column.name for column in PatientDB.__table__.columns)
+    __tablename__ = PatientDB.__tablename__
+    __table__ = PatientDB.__table__
+    defaults = {"resource_type": "Patient"}
+
+
+class MedicationRow(Row):
+    __slots__ = tuple(column.name for column in MedicationDB.__table__.columns)
+    __tablename__ = MedicationDB.__tablename__
+    __table__ = MedicationDB.__table__
+    defaults = {"resource_type": "MedicationKnowledge"}
+
+
+# === AGGREGATE MODELS ===
+# Optional pre-aggregated rollups, kept on their own Base so they are only
+# created when the transformer is asked to materialise them.
+
+AggregateBase = declarative_base()
+
+
+class MedicationCodeCountDB(AggregateBase):
+    __tablename__ = "medication_code_counts"
+    __table_args__ = {"comment": "Number of medications and distinct patients per medication code"}
+
+    system = Column(String, primary_key=True)
+    code = Column(String, primary_key=True)
+    display = Column(String, nullable=False)
+    medication_count = Column(Integer, nullable=False)
+    patient_count = Column(Integer, nullable=False)
+
+
+class PatientMedicationCountDB(AggregateBase):
+    __tablename__ = "patient_medication_counts"
+    __table_args__ = {"comment": "Number of medications per patient"}
+
+    patient_id = Column(String, primary_key=True)
+    medication_count = Column(Integer, nullable=False)
+
+
 # === PYDANTIC MODELS ===
 
 class HumanName(BaseModel):
@@ -1,11 +1,31 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field, ConfigDict
 
 from refiner.models.offchain_schema import OffChainSchema
 
 
+class FileDigest(BaseModel):
+    size: int  # Bytes
+    sha256: str
+    blake2b: Optional[str] = None  # Only set when DIGEST_BLAKE2 is enabled
+
+
+class RefinementDigests(BaseModel):
+    plaintext: FileDigest  # The database file
+    encrypted: FileDigest  # The encrypted file that is uploaded
+
+
+class ShardManifest(BaseModel):
+    index: int
+    refinement_url: str
+    resource_count: int
+    digests: Optional[RefinementDigests] = None
+
+
 class Output(BaseModel):
     model_config = ConfigDict(validate_by_name=True)
     
     refinement_url: Optional[str] = None
     schema_content: Optional[OffChainSchema] = Field(None, alias="schema")  # Use aliases to avoid conflicts
+    shards: Optional[List[ShardManifest]] = None  # Only set when the output is split into shards
+    digests: Optional[RefinementDigests] = None  # Only set when the output is a single database
@@ -1,121 +1,638 @@
-import json
 import logging
 import os
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
 
 from refiner.models.offchain_schema import OffChainSchema
-from refiner.models.output import Output
-from refiner.transformer.fhir_transformer import FHIRTransformer
-from refiner.config import settings
-from refiner.utils.encrypt import encrypt_file
+from refiner.models.output import Output, RefinementDigests, ShardManifest
+from refiner.config import Settings, settings
+from refiner.utils.checkpoint import Checkpoint, input_fingerprint
+from refiner.utils.encrypt import encrypt_file_with_digests
+from refiner.utils import json_codec
 from refiner.utils.ipfs import upload_file_to_ipfs, upload_json_to_ipfs
+from refiner.utils.memory import MemoryGovernor
+from refiner.utils.pii import PIIMasker
+from refiner.utils.profiling import Profiler
+from refiner.utils.progress import ProgressLog
+from refiner.utils.reference import ReferenceIndex
+from refiner.utils.sniff import iter_bundle_entries, load_resources
+from refiner.utils.spool import ResourceSpool
+from refiner.utils.shard import shard_index
+from refiner.utils.terminology import TerminologyIndex
+
+logger = logging.getLogger(__name__)
+
+# Settings that do not change the refinement, so changing them does not invalidate a checkpoint.
+# A retry after an OOM kill typically sets or raises MEMORY_BUDGET_BYTES, and keeps its progress.
+_CHECKPOINT_IGNORED_SETTINGS = {
+    "INPUT_DIR", "OUTPUT_DIR", "PINATA_API_KEY", "PINATA_API_SECRET",
+    "LOG_LEVEL", "LOG_PROGRESS_INTERVAL", "LOG_SAMPLE_EVERY",
+    "PROFILE_CPU", "PROFILE_MEMORY", "PROFILE_TOP", "PROFILE_SAMPLE_EVERY",
+    "MEMORY_BUDGET_BYTES", "SPILL_DIR", "DB_BUILD_IN_MEMORY", "DB_MEMORY_MAX_BYTES", "JSON_BACKEND"
+}
 
 
 class Refiner:
-    def __init__(self):
-        self.db_path = os.path.join(settings.OUTPUT_DIR, 'db.libsql')
+    def __init__(self, config: Optional[Settings] = None):
+        """
+        Args:
+            config: Settings for this refinement (defaults to the global settings).
+                Passing a dedicated copy keeps directories and keys of one job
+                isolated from any other job run in the same process.
+        """
+        self.settings = config or settings
+        self.db_path = os.path.join(self.settings.OUTPUT_DIR, 'db.libsql')
+        self.checkpoint_path = os.path.join(self.settings.OUTPUT_DIR, 'checkpoint.json')
+        self.checkpoint: Optional[Checkpoint] = None
 
-    def transform(self) -> Output:
-        """Transform all input files into the database."""
-        logging.info("Starting data transformation")
+        # fullUrls of every Bundle read, shared with the transformers to resolve urn:uuid references
+        self.references = ReferenceIndex()
 
-        # Initialize transformer
-        transformer = FHIRTransformer(self.db_path)
-        all_resources = []
+        # Memory-bounded mode: resources and fullUrls wait in an on-disk spool instead of in memory
+        self.memory_bounded = self.settings.MEMORY_BUDGET_BYTES is not None
+        self._spool: Optional[ResourceSpool] = None
+        self._spooled = False
 
-        # Create output directory if it does not exist
-        os.makedirs(settings.OUTPUT_DIR, exist_ok=True)
+        # One masker per refinement, shared by every transformer (and shard) of it
+        self._pii_masker = None
+        if self.settings.MASK_PII:
+            if self.settings.CHECKPOINT and not self.settings.PII_MASK_SALT:
+                # A random salt would change between the interrupted run and its resumption
+                raise ValueError("MASK_PII with CHECKPOINT requires PII_MASK_SALT")
+            self._pii_masker = PIIMasker.for_refinement(self.settings.PII_MASK_SALT or None)
+
+        # Opened for the duration of a transform() when TERMINOLOGY_INDEX_PATH is set
+        self._terminology: Optional[TerminologyIndex] = None
+
+        # Per-stage CPU / memory profiles, written to OUTPUT_DIR/profile when enabled
+        self.profiler = Profiler(
+            os.path.join(self.settings.OUTPUT_DIR, 'profile'),
+            cpu=self.settings.PROFILE_CPU,
+            memory=self.settings.PROFILE_MEMORY,
+            top=self.settings.PROFILE_TOP,
+            sample_every=self.settings.PROFILE_SAMPLE_EVERY
+        )
+
+    def _input_files(self) -> List[str]:
+        """Names of the input files, sorted."""
+        return sorted(
+            entry.name for entry in os.scandir(self.settings.INPUT_DIR)
+            if entry.is_file() and entry.name.endswith('.json')
+        )
+
+    def _build_in_memory(self) -> bool:
+        """
+        Whether the database should be built in memory.
+
+        Inputs larger than the memory budget start on disk right away; the
+        database is normally smaller than the JSON it comes from, so anything
+        below it is tried in memory and only moved to disk if it outgrows it.
+        Checkpointed builds always run on disk, where committed batches survive
+        the process, and so do memory-bounded ones.
+        """
+        if not self.settings.DB_BUILD_IN_MEMORY or self.checkpoint is not None or self.memory_bounded:
+            return False
+        input_bytes = sum(
+            os.path.getsize(os.path.join(self.settings.INPUT_DIR, filename))
+            for filename in self._input_files()
+        )
+        return input_bytes <= self.settings.DB_MEMORY_MAX_BYTES
+
+    def _load_checkpoint(self) -> Checkpoint:
+        """Load the checkpoint of an earlier run of the same inputs and settings, if any."""
+        ignored = set(_CHECKPOINT_IGNORED_SETTINGS)
+        if not self.settings.DETERMINISTIC_OUTPUT:
+            # Only deterministic builds promise the same bytes for any number of workers
+            ignored.add("TRANSFORM_WORKERS")
+        options = self.settings.model_dump(exclude=ignored)
+        fingerprint = input_fingerprint(self.settings.INPUT_DIR, self._input_files(), options)
+        return Checkpoint.load(self.checkpoint_path, fingerprint)
+
+    def _stage(self, name: str, action: Callable[[], Any]) -> Any:
+        """
+        Run one stage of the refinement, unless the checkpoint records it as complete.
+
+        The stage is profiled on its own when profiling is enabled.
+
+        Args:
+            name: Stage name in the checkpoint
+            action: Runs the stage and returns a JSON-serialisable result
+
+        Returns:
+            The result of the stage, recorded in the checkpoint when it was skipped
+        """
+        if self.checkpoint is not None and self.checkpoint.is_complete(name):
+            logger.info("Stage %s already complete, skipping", name)
+            return self.checkpoint.result(name)
+        with self.profiler.stage(name):
+            result = action()
+        if self.checkpoint is not None:
+            self.checkpoint.complete(name, result)
+        return result
+
+    def _create_transformer(self, db_path: str, resume: bool = False):
+        """
+        Create a FHIR transformer writing to db_path, configured from the settings.
+
+        Args:
+            db_path: Database file
+            resume: Continue writing into an existing database at db_path
+        """
+        # SQLAlchemy is imported here rather than at module level to keep cold start short
+        from refiner.transformer.fhir_transformer import FHIRTransformer
+
+        return FHIRTransformer(
+            db_path,
+            resume=resume,
+            in_memory=self._build_in_memory(),
+            max_memory_bytes=self.settings.DB_MEMORY_MAX_BYTES,
+            deterministic=self.settings.DETERMINISTIC_OUTPUT,
+            aggregates=self.settings.MATERIALIZE_AGGREGATES,
+            medication_fts=self.settings.MEDICATION_FTS,
+            pii_masker=self._pii_masker,
+            references=self.references,
+            terminology=self._terminology,
+            resource_sampler=self.profiler.resource_sampler,
+            progress_interval=self.settings.LOG_PROGRESS_INTERVAL,
+            log_sample_every=self.settings.LOG_SAMPLE_EVERY
+        )
+
+    def _collect_resources(self) -> List[Dict[str, Any]]:
+        """Read every input file and return the unique resources they contain."""
+        return [resource for _, resources in self._collect_resources_by_file() for resource in resources]
+
+    def _collect_resources_by_file(self) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Read every input file and return the unique resources they contain.
+
+        Returns:
+            (filename, resources) pairs in file order; a resource seen in an
+            earlier file is not repeated in a later one
+        """
+        resources_by_file = []
 
         # Set to track IDs of already processed resources
         processed_resource_ids = set()
 
+        def accept(filename: str, resource_id: str, resource: Dict[str, Any]) -> bool:
+            # Skip if we've already processed this resource
+            if resource_id in processed_resource_ids:
+                return False
+            processed_resource_ids.add(resource_id)
+            if not resources_by_file or resources_by_file[-1][0] != filename:
+                resources_by_file.append((filename, []))
+            resources_by_file[-1][1].append(resource)
+            return True
+
+        self._read_input(accept)
+        return resources_by_file
+
+    def _open_spool(self) -> None:
+        """Create the spool of a memory-bounded refinement; its fullUrl index replaces the in-memory one."""
+        self._spool = ResourceSpool(self.settings.SPILL_DIR)
+        self._spooled = False
+        self.references = self._spool.references
+
+    def _spool_resources(self) -> None:
+        """
+        Read every input file into the spool, deduplicating on disk.
+
+        Bundles are streamed entry by entry, so only the entry being read is
+        held in memory; a file that fails to read is taken out of the spool
+        again as a whole. After each file the spool is flushed if memory use
+        is near the budget.
+        """
+        spool = self._spool
+        governor = MemoryGovernor(self.settings.MEMORY_BUDGET_BYTES, 1)
+        ordinals = Counter()
+
+        def accept(filename: str, resource_id: str, resource: Dict[str, Any]) -> bool:
+            if not spool.add(resource_id, filename, ordinals[filename], resource):
+                return False
+            ordinals[filename] += 1
+            return True
+
+        @contextmanager
+        def input_file(filename: str) -> Iterator[None]:
+            try:
+                with spool.input_file():
+                    yield
+            except Exception:
+                ordinals[filename] = 0
+                raise
+            finally:
+                if governor.under_pressure():
+                    spool.flush()
+
+        self._read_input(accept, input_file)
+        spool.flush()
+        self._spooled = True
+        logger.info("Spooled %d resources to %s", spool.count, spool.path)
+
+    def _read_input(
+        self,
+        accept: Callable[[str, str, Dict[str, Any]], bool],
+        input_file: Optional[Callable[[str], ContextManager]] = None
+    ) -> None:
+        """
+        Read every input file and hand each resource to accept().
+
+        In memory-bounded mode Bundles are streamed: their entries are handed
+        to accept() while the file is being read.
+
+        Args:
+            accept: Called with the filename, "ResourceType/id" key and resource;
+                returns False if the resource is a duplicate
+            input_file: Context manager around the reading of each file, given its name
+        """
+        from refiner.transformer.fhir_transformer import FHIRTransformer
+
+        progress = ProgressLog(
+            logger, "read", self.settings.LOG_PROGRESS_INTERVAL, self.settings.LOG_SAMPLE_EVERY
+        )
+
         # Process all files in the input directory
-        for filename in os.listdir(settings.INPUT_DIR):
-            if filename.endswith('.json'):
-                file_path = os.path.join(settings.INPUT_DIR, filename)
-                logging.info(f"Processing file: {file_path}")
-
-                try:
-                    with open(file_path, 'r') as f:
-                        data = json.load(f)
-
-                    # Handle both single resources and bundles
-                    if isinstance(data, dict):
-                        if data.get('resourceType') == 'Bundle':
-                            # Process each entry in the bundle
-                            for entry in data.get('entry', []):
-                                if 'resource' in entry and isinstance(entry['resource'], dict):
-                                    resource = entry['resource']
-                                    resource_id = f"{resource.get('resourceType')}/{resource.get('id')}"
-
-                                    # Skip if we've already processed this resource
-                                    if resource_id in processed_resource_ids:
-                                        logging.info(f"Skipping duplicate resource: {resource_id}")
-                                        continue
-
-                                    all_resources.append(resource)
-                                    processed_resource_ids.add(resource_id)
+        # Sorted, so that which copy of a duplicate resource is kept does not depend on the filesystem
+        for filename in self._input_files():
+            file_path = os.path.join(self.settings.INPUT_DIR, filename)
+            logger.debug("Processing file: %s", file_path)
+            progress.record("file", "read", filename)
+
+            try:
+                with (input_file(filename) if input_file is not None else nullcontext()), \
+                        open(file_path, 'r') as f:
+                    # Resources of types that are never stored are skipped without being decoded
+                    on_skip = lambda resource_type: progress.record(resource_type, "skipped")
+                    entries = None
+                    if self.memory_bounded:
+                        entries = iter_bundle_entries(f, FHIRTransformer.supported_resource_types, on_skip)
+
+                    resources = []
+                    if entries is not None:
+                        # Each entry is indexed and handed on as it is read
+                        resources = self.references.index_entries(entries)
+                    else:
+                        data = load_resources(f.read(), FHIRTransformer.supported_resource_types, on_skip)
+                        # Handle both single resources and bundles
+                        if isinstance(data, dict):
+                            if data.get('resourceType') == 'Bundle':
+                                # Process each entry in the bundle, indexing its fullUrls on the way
+                                resources = self.references.index_bundle(data)
+                            else:
+                                resources = [data]
+                        data = None
+
+                    for resource in resources:
+                        resource_id = f"{resource.get('resourceType')}/{resource.get('id')}"
+                        if accept(filename, resource_id, resource):
+                            progress.record(resource.get('resourceType'), "collected", resource_id)
                         else:
-                            # Single resource
-                            resource_id = f"{data.get('resourceType')}/{data.get('id')}"
-
-                            # Skip if we've already processed this resource
-                            if resource_id in processed_resource_ids:
-                                logging.info(f"Skipping duplicate resource: {resource_id}")
-                                continue
-
-                            all_resources.append(data)
-                            processed_resource_ids.add(resource_id)
-                except Exception as e:
-                    logging.error(f"Error processing file {file_path}: {e}")
+                            progress.record(resource.get('resourceType'), "duplicate", resource_id)
+                    resources = None
+            except Exception as e:
+                logger.error("Error processing file %s: %s", file_path, e)
+                continue
+
+        progress.log_summary(final=True)
+
+    def _resource_batches(
+        self,
+        next_batch_size: Callable[[], int],
+        skip_committed: bool = False,
+        shard: Optional[int] = None
+    ) -> Iterator[Tuple[str, int, List[Dict[str, Any]]]]:
+        """
+        The input resources in batches, each from a single input file.
+
+        Resources come from the spool in memory-bounded mode, otherwise they
+        are read into memory.
+
+        Args:
+            next_batch_size: Returns the size of the next batch
+            skip_committed: Leave out resources below the checkpoint's watermarks
+            shard: Only yield the resources of this shard
+
+        Returns:
+            (filename, resources of the file committed once this batch is, batch)
+        """
+        from refiner.transformer.fhir_transformer import FHIRTransformer
+
+        if self.memory_bounded:
+            if not self._spooled:
+                self._spool_resources()
+            source = iter(self._spool)
+        else:
+            source = (
+                (filename, ordinal, resource)
+                for filename, resources in self._collect_resources_by_file()
+                for ordinal, resource in enumerate(resources)
+            )
+
+        batch, batch_file, batch_end = [], None, 0
+        limit = next_batch_size()
+        for filename, ordinal, resource in source:
+            if skip_committed and ordinal < self.checkpoint.watermark(filename):
+                continue
+            if shard is not None:
+                patient_id = FHIRTransformer.patient_id_of(resource, self.references) or ""
+                if shard_index(patient_id, self.settings.OUTPUT_SHARDS) != shard:
                     continue
+            if batch and (filename != batch_file or len(batch) >= limit):
+                yield batch_file, batch_end, batch
+                batch = []
+                limit = next_batch_size()
+            batch.append(resource)
+            batch_file, batch_end = filename, ordinal + 1
+        if batch:
+            yield batch_file, batch_end, batch
+
+    def _process_resources(self, transformer, resources: List[Dict[str, Any]]) -> None:
+        """Transform resources and write them into the transformer's database."""
+        if self.settings.TRANSFORM_WORKERS > 1:
+            transformer.process_parallel(resources, self.settings.TRANSFORM_WORKERS)
+        else:
+            transformer.process(resources)
 
+    def _build_database(self, transformer, resources: List[Dict[str, Any]]) -> int:
+        """
+        Write resources into the transformer's database and finalize it.
+
+        Returns:
+            Number of resources
+        """
         # Process all collected resources
-        if all_resources:
-            transformer.process(all_resources)
-            logging.info(f"Transformed {len(all_resources)} resources")
+        if resources:
+            self._process_resources(transformer, resources)
+            logger.info("Transformed %d resources", len(resources))
+        else:
+            logger.warning("No valid FHIR resources found to process")
+
+        # Write the database to the output directory if it was built in memory
+        transformer.finalize()
+        return len(resources)
+
+    def _build_database_batched(self, transformer, shard: Optional[int] = None) -> int:
+        """
+        Write the input into the transformer's database batch by batch and finalize it.
+
+        With a checkpoint, the watermark of the input file is moved forward
+        after every committed batch, so a rerun skips what is already in the
+        database. A batch that was committed but not yet recorded is written
+        again; rows already in the database are skipped, so that is harmless.
+        In memory-bounded mode the batch size follows the memory budget.
+
+        Args:
+            transformer: Transformer of the database
+            shard: Only write the resources of this shard (no watermarks are kept)
+
+        Returns:
+            Number of resources written
+        """
+        batch_size = transformer.commit_batch_size
+        next_batch_size = lambda: batch_size
+        if self.memory_bounded:
+            governor = MemoryGovernor(self.settings.MEMORY_BUDGET_BYTES, batch_size)
+            next_batch_size = governor.next_batch_size
+
+        watermarks = self.checkpoint is not None and shard is None
+        if watermarks:
+            for filename, committed in sorted(self.checkpoint.watermarks.items()):
+                logger.info("Skipping %d already committed resources of %s", committed, filename)
+
+        total = 0
+        # Batches share one pool of workers rather than starting one each
+        with transformer.worker_pool(self.settings.TRANSFORM_WORKERS):
+            for filename, committed, batch in self._resource_batches(next_batch_size, watermarks, shard):
+                self._process_resources(transformer, batch)
+                total += len(batch)
+                if watermarks:
+                    self.checkpoint.set_watermark(filename, committed)
+
+        if total:
+            logger.info("Transformed %d resources", total)
         else:
-            logging.warning("No valid FHIR resources found to process")
+            logger.warning("No valid FHIR resources found to process")
+        transformer.finalize()
+        return total
+
+    def _close_spool(self) -> None:
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def _close_terminology(self) -> None:
+        if self._terminology is not None:
+            self._terminology.close()
+            self._terminology = None
 
+    def _build_schema(self, transformer) -> OffChainSchema:
+        """Build the off-chain schema and save it to schema.json."""
         # Get the database schema
-        schema_data = transformer.get_schema()
+        with self.profiler.stage("schema"):
+            schema_data = transformer.get_schema()
 
         # Create schema based on FHIR schema
         schema = OffChainSchema(
-            name=settings.SCHEMA_NAME,
-            version=settings.SCHEMA_VERSION,
-            description=settings.SCHEMA_DESCRIPTION,
-            dialect=settings.SCHEMA_DIALECT,
+            name=self.settings.SCHEMA_NAME,
+            version=self.settings.SCHEMA_VERSION,
+            description=self.settings.SCHEMA_DESCRIPTION,
+            dialect=self.settings.SCHEMA_DIALECT,
             tables=schema_data["tables"],
             relationships=schema_data["relationships"]
         )
 
         # Save schematic to file
-        schema_file = os.path.join(settings.OUTPUT_DIR, 'schema.json')
-        with open(schema_file, 'w') as f:
-            json.dump(schema.model_dump(), f, indent=4)
+        schema_file = os.path.join(self.settings.OUTPUT_DIR, 'schema.json')
+        json_codec.dump(schema.model_dump(), schema_file, indent=4)
+
+        return schema
+
+    def _publish_database(self, db_path: str, stage_suffix: str = "") -> Tuple[str, RefinementDigests]:
+        """
+        Encrypt a database file, upload it to IPFS and return its gateway URL.
+
+        Args:
+            db_path: Database file
+            stage_suffix: Distinguishes the checkpoint stages of several databases (shards)
+
+        Returns:
+            Gateway URL, and the sizes and digests of the database and its encrypted file
+        """
+        def encrypt() -> Dict[str, Any]:
+            encrypted_path, digests = encrypt_file_with_digests(
+                self.settings.REFINEMENT_ENCRYPTION_KEY, db_path, blake2=self.settings.DIGEST_BLAKE2
+            )
+            return {"path": encrypted_path, "digests": digests.model_dump()}
+
+        pin_stage = f"db_pinned{stage_suffix}"
+
+        encrypted = self._stage(f"encrypted{stage_suffix}", encrypt)
+        if not os.path.exists(encrypted["path"]) and not (self.checkpoint and self.checkpoint.is_complete(pin_stage)):
+            # The encrypted file of an earlier run is gone, but still needs to be uploaded
+            encrypted = encrypt()
+        ipfs_hash = self._stage(pin_stage, lambda: upload_file_to_ipfs(encrypted["path"]))
+        return f"{self.settings.IPFS_GATEWAY_URL}/{ipfs_hash}", RefinementDigests(**encrypted["digests"])
+
+    def _shard_path(self, index: int) -> str:
+        return os.path.join(self.settings.OUTPUT_DIR, f"db.shard-{index:03d}.libsql")
+
+    def _build_shards(self, resources: Optional[List[Dict[str, Any]]]):
+        """
+        Partition resources by a hash of their patient ID and build one database per shard.
+
+        Args:
+            resources: All resources, or None in memory-bounded mode, where
+                each shard is built in batches from the spool
+
+        Returns:
+            The transformer of the first shard (used for the schema) and the
+            number of resources of every shard
+        """
+        from refiner.transformer.fhir_transformer import FHIRTransformer
+
+        shard_count = self.settings.OUTPUT_SHARDS
+        shard_resources = [None] * shard_count
+        if resources is not None:
+            shard_resources = [[] for _ in range(shard_count)]
+            for resource in resources:
+                patient_id = FHIRTransformer.patient_id_of(resource, self.references) or ""
+                shard_resources[shard_index(patient_id, shard_count)].append(resource)
+
+        first_transformer = None
+        resource_counts = []
+        for index, partition in enumerate(shard_resources):
+            # A shard is checkpointed as a whole; an incomplete one is rebuilt
+            stage = f"transformed:shard-{index:03d}"
+            resume = self.checkpoint is not None and self.checkpoint.is_complete(stage)
+            transformer = self._create_transformer(self._shard_path(index), resume=resume)
+            if partition is None:
+                build = lambda: self._build_database_batched(transformer, shard=index)
+            else:
+                build = lambda: self._build_database(transformer, partition)
+            resource_counts.append(self._stage(stage, build))
+            first_transformer = first_transformer or transformer
+
+        return first_transformer, resource_counts
+
+    def _build_single(self):
+        """
+        Build the refinement database at db_path.
+
+        Returns:
+            The transformer of the database
+        """
+        if self.checkpoint is None:
+            transformer = self._create_transformer(self.db_path)
+            if self.memory_bounded:
+                self._stage("transformed", lambda: self._build_database_batched(transformer))
+            else:
+                self._stage("transformed", lambda: self._build_database(transformer, self._collect_resources()))
+            return transformer
+
+        if self.checkpoint.started and not os.path.exists(self.db_path):
+            logger.info("Database of checkpoint %s is missing, starting over", self.checkpoint_path)
+            self.checkpoint = Checkpoint(self.checkpoint_path, self.checkpoint.fingerprint)
+
+        transformer = self._create_transformer(self.db_path, resume=self.checkpoint.started)
+        self._stage("transformed", lambda: self._build_database_batched(transformer))
+        return transformer
+
+    def transform(self) -> Output:
+        """Transform all input files into the database."""
+        self.profiler.start()
+        try:
+            return self._transform()
+        finally:
+            # Written also when the refinement fails, which is often when they are needed
+            self.profiler.finish()
+
+    def _transform(self) -> Output:
+        logger.info("Starting data transformation")
+
+        # Create output directory if it does not exist
+        os.makedirs(self.settings.OUTPUT_DIR, exist_ok=True)
+
+        if self.settings.CHECKPOINT:
+            self.checkpoint = self._load_checkpoint()
+
+        shards = None
+        digests = None
+
+        if self.settings.TERMINOLOGY_INDEX_PATH:
+            self._terminology = TerminologyIndex(
+                self.settings.TERMINOLOGY_INDEX_PATH, self.settings.TERMINOLOGY_SYSTEM
+            )
+
+        if self.memory_bounded:
+            # Opened before any transformer, which all share its fullUrl index
+            self._open_spool()
+
+        if self.settings.OUTPUT_SHARDS > 1:
+            try:
+                resources = None
+                if not self.memory_bounded:
+                    with self.profiler.stage("read_input"):
+                        resources = self._collect_resources()
+                transformer, resource_counts = self._build_shards(resources)
+            finally:
+                self._close_spool()
+                self._close_terminology()
+            schema = self._build_schema(transformer)
+
+            # Each shard is encrypted and uploaded on its own
+            shards = []
+            for index, resource_count in enumerate(resource_counts):
+                shard_url, shard_digests = self._publish_database(self._shard_path(index), f":shard-{index:03d}")
+                shards.append(ShardManifest(
+                    index=index,
+                    refinement_url=shard_url,
+                    resource_count=resource_count,
+                    digests=shard_digests
+                ))
+        else:
+            try:
+                transformer = self._build_single()
+            finally:
+                self._close_spool()
+                self._close_terminology()
+            schema = self._build_schema(transformer)
 
         # Upload schema to IPFS
-        schema_ipfs_hash = upload_json_to_ipfs(schema.model_dump())
-        logging.info(f"Schema uploaded to IPFS with hash: {schema_ipfs_hash}")
+        schema_ipfs_hash = self._stage("schema_pinned", lambda: upload_json_to_ipfs(schema.model_dump()))
+        logger.info("Schema uploaded to IPFS with hash: %s", schema_ipfs_hash)
 
-        # Encrypt and upload database to IPFS
-        encrypted_path = encrypt_file(settings.REFINEMENT_ENCRYPTION_KEY, self.db_path)
-        ipfs_hash = upload_file_to_ipfs(encrypted_path)
-        refinement_url = f"{settings.IPFS_GATEWAY_URL}/{ipfs_hash}"
+        if shards is None:
+            # Encrypt and upload database to IPFS
+            refinement_url, digests = self._publish_database(self.db_path)
+        else:
+            # The refinement points at the shard manifest, which lists every shard
+            manifest_ipfs_hash = self._stage("manifest_pinned", lambda: upload_json_to_ipfs({
+                "schema": schema_ipfs_hash,
+                "shards": [shard.model_dump() for shard in shards]
+            }))
+            refinement_url = f"{self.settings.IPFS_GATEWAY_URL}/{manifest_ipfs_hash}"
 
         # Create output object
         output = Output(
             refinement_url=refinement_url,
-            schema=schema
+            schema=schema,
+            shards=shards,
+            digests=digests
         )
 
         # Create output.json file
-        output_file = os.path.join(settings.OUTPUT_DIR, 'output.json')
-        with open(output_file, 'w') as f:
-            json.dump({
-                "refinement_url": refinement_url,
-                "schema": schema.model_dump()
-            }, f, indent=4)
-
-        logging.info("Data transformation completed successfully")
+        output_data = {
+            "refinement_url": refinement_url,
+            "schema": schema.model_dump()
+        }
+        if shards is not None:
+            output_data["shards"] = [shard.model_dump() for shard in shards]
+        if digests is not None:
+            output_data["digests"] = digests.model_dump()
+
+        output_file = os.path.join(self.settings.OUTPUT_DIR, 'output.json')
+        json_codec.dump(output_data, output_file, indent=4)
+
+        logger.info("Data transformation completed successfully")
         return output
@@ -1,34 +1,189 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from refiner.models.refined import Base
+from refiner.utils import json_codec
+from refiner.utils.schema import cached_schema
 import sqlite3
 import os
 import logging
 
+def canonical_json(value: Any) -> str:
+    """Serialize JSON columns with sorted keys and no insignificant whitespace."""
+    return json_codec.canonical(value)
+
+
 class DataTransformer:
     """
     Base class for transforming JSON data into SQLAlchemy models.
     Users should extend this class and override the transform method
     to customize the transformation process for their specific data.
     """
+
+    # Declarative bases of the tables this transformer writes
+    model_bases = (Base,)
     
-    def __init__(self, db_path: str):
-        """Initialize the transformer with a database path."""
+    def __init__(
+        self,
+        db_path: str,
+        in_memory: bool = False,
+        max_memory_bytes: Optional[int] = None,
+        deterministic: bool = False,
+        resume: bool = False
+    ):
+        """
+        Initialize the transformer with a database path.
+
+        Args:
+            db_path: Where the database file is written
+            in_memory: Build the database in an in-memory SQLite connection and
+                write it to db_path in one go when finalize() is called
+            max_memory_bytes: Size above which an in-memory build is moved to
+                db_path and continues on disk (no limit when None)
+            deterministic: Produce byte-identical databases for identical inputs:
+                canonical JSON columns, sorted rows and a compacted final file
+            resume: Keep an existing database at db_path and continue writing
+                into it instead of starting from an empty one
+        """
         self.db_path = db_path
+        self.in_memory = in_memory
+        self.max_memory_bytes = max_memory_bytes
+        self.deterministic = deterministic
+        self.resume = resume
         self._initialize_database()
     
     def _initialize_database(self) -> None:
         """
         Initialize or recreate the database and its tables.
         """
-        if os.path.exists(self.db_path):
+        if os.path.exists(self.db_path) and not self.resume:
             os.remove(self.db_path)
             logging.info(f"Deleted existing database at {self.db_path}")
         
-        self.engine = create_engine(f'sqlite:///{self.db_path}')
+        self.engine = self._create_engine()
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
+
+    def _create_engine(self) -> Engine:
+        """Create the engine the database is built with: in memory or at db_path."""
+        # JSON columns are encoded and decoded with the fastest available backend
+        options = {"json_serializer": json_codec.dumps, "json_deserializer": json_codec.loads}
+        if self.deterministic:
+            options["json_serializer"] = canonical_json
+
+        if self.in_memory:
+            # A single shared connection, otherwise every checkout would see a new empty database
+            return create_engine('sqlite://', poolclass=StaticPool, **options)
+        return create_engine(f'sqlite:///{self.db_path}', **options)
+
+    def _database_size(self) -> int:
+        """Current size of the database in bytes."""
+        with self.engine.connect() as connection:
+            page_count = connection.exec_driver_sql("PRAGMA page_count").scalar()
+            page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+        return page_count * page_size
+
+    def _move_to_disk(self, compact: bool = False) -> None:
+        """
+        Write the in-memory database to db_path and continue working against the file.
+
+        Args:
+            compact: Write a freshly packed copy with VACUUM INTO instead of a
+                page-for-page copy with the SQLite backup API
+        """
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
+
+        raw_connection = self.engine.raw_connection()
+        try:
+            if compact:
+                raw_connection.driver_connection.execute("VACUUM INTO ?", (self.db_path,))
+            else:
+                target = sqlite3.connect(self.db_path)
+                try:
+                    raw_connection.driver_connection.backup(target)
+                finally:
+                    target.close()
+        finally:
+            raw_connection.close()
+
+        self.engine.dispose()
+        self.in_memory = False
+        self.engine = self._create_engine()
+        self.Session.configure(bind=self.engine)
+
+    def _check_memory_budget(self) -> None:
+        """Fall back to an on-disk build once the in-memory database outgrows its budget."""
+        if not self.in_memory or self.max_memory_bytes is None:
+            return
+        size = self._database_size()
+        if size > self.max_memory_bytes:
+            logging.info(
+                "In-memory database reached %d bytes (limit %d), continuing on disk at %s",
+                size, self.max_memory_bytes, self.db_path
+            )
+            self._move_to_disk()
+
+    def _sort_rows(self) -> None:
+        """
+        Rewrite every table of model_bases in primary key order.
+
+        Rows are written batch by batch, and where batches start depends on
+        the run (memory pressure, checkpoints, workers); once sorted, the row
+        order no longer does.
+        """
+        raw_connection = self.engine.raw_connection()
+        connection = raw_connection.driver_connection
+        try:
+            for base in self.model_bases:
+                for table in base.metadata.sorted_tables:
+                    key = ", ".join(column.name for column in table.primary_key.columns)
+                    if not key:
+                        continue
+                    columns = ", ".join(column.name for column in table.columns)
+                    connection.execute(
+                        f"CREATE TEMP TABLE sorted_rows AS SELECT {columns} FROM main.{table.name} ORDER BY {key}"
+                    )
+                    connection.execute(f"DELETE FROM main.{table.name}")
+                    connection.execute(
+                        f"INSERT INTO main.{table.name} ({columns}) SELECT {columns} FROM temp.sorted_rows ORDER BY rowid"
+                    )
+                    connection.execute("DROP TABLE temp.sorted_rows")
+            connection.commit()
+        finally:
+            raw_connection.close()
+
+    def finalize(self) -> None:
+        """
+        Make sure the database is complete at db_path.
+
+        For in-memory builds this persists the database with a single sequential
+        write. Deterministic builds are sorted by primary key and compacted, so
+        neither the row order nor the page layout depends on how the rows were
+        batched or the order transactions happened in.
+        """
+        if self.deterministic:
+            self._sort_rows()
+        if self.in_memory:
+            self._move_to_disk(compact=self.deterministic)
+            logging.info(f"Persisted in-memory database to {self.db_path}")
+        elif self.deterministic:
+            # VACUUM INTO a fresh file rather than VACUUM in place: the header of a
+            # file that went through many commits keeps its change counters
+            compacted_path = f"{self.db_path}.compact"
+            if os.path.exists(compacted_path):
+                os.remove(compacted_path)
+            raw_connection = self.engine.raw_connection()
+            try:
+                raw_connection.driver_connection.execute("VACUUM INTO ?", (compacted_path,))
+            finally:
+                raw_connection.close()
+            self.engine.dispose()
+            os.replace(compacted_path, self.db_path)
+            self.engine = self._create_engine()
+            self.Session.configure(bind=self.engine)
     
     def transform(self, data: Dict[str, Any]) -> List[Base]:
         """
@@ -42,25 +197,19 @@ class DataTransformer:
         """
         raise NotImplementedError("Subclasses must implement transform method")
     
-    def get_schema(self):
+    def get_schema(self) -> Dict[str, Any]:
         """
         Get the database schema as a dictionary.
-        
+
+        The schema is generated from the SQLAlchemy models of model_bases
+        (columns, types, foreign keys, indexes and relationships), so it
+        cannot drift from the tables that are actually created. It is
+        computed once per set of model definitions and then served from cache.
+
         Returns:
             Dictionary containing the schema definition with tables and relationships
         """
-        # This is the default implementation that returns SQL schema as string
-        # Subclasses should override this method to return a proper dictionary
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get all table definitions in order
-        schema = []
-        for table in cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' ORDER BY name"):
-            schema.append(table[0] + ";")
-        
-        conn.close()
-        return "\n\n".join(schema)
+        return cached_schema(self.model_bases)
 
     def process(self, data: Dict[str, Any]) -> None:
         """
@@ -77,6 +226,7 @@ class DataTransformer:
             for model in models:
                 session.add(model)
             session.commit()
+            self._check_memory_budget()
         except Exception as e:
             session.rollback()
             raise e
@@ -1,44 +1,167 @@
 import os
 import logging
-from typing import Dict, Any, List, Union
+import multiprocessing.util
+import shutil
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 
-from sqlalchemy import create_engine
+from sqlalchemy import select, text
 from sqlalchemy.orm import sessionmaker
 
-from refiner.models.fihr import Base, PatientDB, MedicationDB
+from refiner.models.fihr import Base, PatientRow, MedicationRow
+from refiner.models.fihr import AggregateBase, MedicationCodeCountDB, PatientMedicationCountDB
 from refiner.models.fihr import Patient, MedicationKnowledge
 from refiner.transformer.base_transformer import DataTransformer
+from refiner.utils.date import parse_timestamp, to_utc_naive
+from refiner.utils.pii import PIIMasker
+from refiner.utils.profiling import ResourceSampler
+from refiner.utils.progress import ProgressLog
+from refiner.utils.reference import ReferenceIndex, parse_literal_reference
+from refiner.utils.schema import cached_schema
+from refiner.utils.terminology import TerminologyIndex
 
 logger = logging.getLogger(__name__)
 
+# FTS5 index over medication.display / medication.text
+MEDICATION_FTS_TABLE = "medication_fts"
+
+
+# Transformer options of a process_parallel worker, set once per worker process by _init_worker
+_worker_options: Dict[str, Any] = {}
+
+
+def _init_worker(options: Dict[str, Any], terminology: Optional[Tuple[str, str]] = None) -> None:
+    """
+    Worker process initializer: receive the options (and the shared reference index) once.
+
+    Args:
+        options: FHIRTransformer keyword arguments
+        terminology: (index path, code system) of the terminology index; the
+            worker maps the file with a connection of its own, closed when
+            the worker exits
+    """
+    global _worker_options
+    _worker_options = dict(options)
+    _worker_options["references"] = options["references"].for_worker()
+    if terminology is not None:
+        index = TerminologyIndex(*terminology)
+        multiprocessing.util.Finalize(None, index.close, exitpriority=10)
+        _worker_options["terminology"] = index
+
+
+def _process_chunk(db_path: str, resources: List[Dict[str, Any]]):
+    """
+    Worker process entry point: write one chunk of resources into its own database.
+
+    Returns:
+        The database path, the (medication id, reference) pairs left
+        unresolved, and the Bundle fullUrls the chunk added to the reference index
+    """
+    transformer = FHIRTransformer(db_path, **_worker_options)
+    indexed = len(transformer.references)
+    transformer.process(resources)
+    transformer.engine.dispose()
+    return db_path, transformer._unresolved_references, transformer.references.entries(indexed)
+
 
 class FHIRTransformer(DataTransformer):
     """
     Transformer for FHIR resources (Patient, MedicationKnowledge).
     """
 
+    # Declarative bases of the tables this transformer writes
+    model_bases = (Base,)
+
+    # Number of new rows written per transaction in process()
+    commit_batch_size = 10000
+
+    # Below this many resources per worker, process_parallel() runs in-process instead
+    parallel_min_chunk = 1000
+
+    # Resource types stored by _transform_resource; the Refiner does not decode any others
+    supported_resource_types = frozenset({"Patient", "MedicationKnowledge", "MedicationStatement"})
+
+    def __init__(
+        self,
+        db_path: str,
+        in_memory: bool = False,
+        max_memory_bytes: Optional[int] = None,
+        deterministic: bool = False,
+        aggregates: bool = False,
+        medication_fts: bool = False,
+        pii_masker: Optional[PIIMasker] = None,
+        references: Optional[ReferenceIndex] = None,
+        terminology: Optional[TerminologyIndex] = None,
+        resource_sampler: Optional[ResourceSampler] = None,
+        progress_interval: float = 10.0,
+        log_sample_every: int = 0,
+        resume: bool = False
+    ):
+        """
+        Args:
+            aggregates: Also materialise the medication_code_counts and
+                patient_medication_counts rollup tables when finalizing
+            medication_fts: Also build an FTS5 index over medication display/text
+            pii_masker: Masks patient names and telecom values when set
+            references: Index of Bundle fullUrls to resolve references with;
+                Bundles passed to transform() are added to it
+            terminology: Fills in medication displays and ingredients when set
+            resource_sampler: Times a sample of the resources transformed in
+                this process (not in the workers of process_parallel)
+            progress_interval: Minimum seconds between two progress summaries
+            log_sample_every: Log every N-th transformed/saved resource at DEBUG level (0 for none)
+            See DataTransformer for the other arguments.
+        """
+        self.aggregates = aggregates
+        self.medication_fts = medication_fts
+        self.pii_masker = pii_masker
+        self.references = references if references is not None else ReferenceIndex()
+        self.terminology = terminology
+        self.resource_sampler = resource_sampler
+        # Pool of process_parallel() kept open by worker_pool(), and its size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_workers: Optional[int] = None
+        # (medication id, reference) pairs whose patient was not indexed yet, resolved in finalize().
+        # Kept in memory; when the Refiner spools, every top-level fullUrl is indexed before the
+        # first resource is transformed, so only references that never resolve end up here.
+        self._unresolved_references: List[Tuple[str, str]] = []
+        super().__init__(
+            db_path,
+            in_memory=in_memory,
+            max_memory_bytes=max_memory_bytes,
+            deterministic=deterministic,
+            resume=resume
+        )
+        # Per-resource-type counters replace one log line per resource
+        self.progress = ProgressLog(logger, "transform", progress_interval, log_sample_every)
+        self.save_progress = ProgressLog(logger, "save", progress_interval, log_sample_every)
+
     def _initialize_database(self) -> None:
         """
         Initialize or recreate the database and its tables.
         Override to use FHIR models.
         """
-        if os.path.exists(self.db_path):
+        if os.path.exists(self.db_path) and not self.resume:
             os.remove(self.db_path)
             logging.info(f"Deleted existing database at {self.db_path}")
 
-        self.engine = create_engine(f'sqlite:///{self.db_path}')
+        self.engine = self._create_engine()
         Base.metadata.create_all(self.engine)  # Usa Base de fihr.py
         self.Session = sessionmaker(bind=self.engine)
 
     def transform(self, data: Union[Dict[str, Any], List[Dict[str, Any]]]) -> List:
         """
-        Transform FHIR resource(s) into SQLAlchemy model instances.
+        Transform FHIR resource(s) into row records.
     
         Args:
             data: Raw FHIR resource data (single resource dict or list of resource dicts)
     
         Returns:
-            List of SQLAlchemy model instances
+            List of PatientRow / MedicationRow records
         """
         models = []
 
@@ -51,43 +174,104 @@ class FHIRTransformer(DataTransformer):
             # Process a single resource
             models.extend(self._transform_resource(data))
         else:
-            logger.warning(f"Unsupported data type: {type(data)}")
+            logger.warning("Unsupported data type: %s", type(data))
 
+        if self.pii_masker:
+            # Masked column by column over the whole batch, so repeated values are hashed once
+            self.pii_masker.mask_patients([model for model in models if isinstance(model, PatientRow)])
+
+        if self.terminology:
+            # One lookup for the codes of the whole batch
+            self.terminology.enrich([model for model in models if isinstance(model, MedicationRow)])
+
+        self.progress.log_summary(final=True)
         return models
 
+    @staticmethod
+    def patient_reference_of(resource: Dict[str, Any]) -> Optional[str]:
+        """The reference of a resource's subject or patient element, if any."""
+        for field in ("subject", "patient"):
+            reference = resource.get(field)
+            if isinstance(reference, dict) and reference.get("reference"):
+                return reference["reference"]
+        return None
+
+    @staticmethod
+    def patient_id_of(resource: Dict[str, Any], references: Optional[ReferenceIndex] = None) -> Optional[str]:
+        """
+        The ID of the patient a resource belongs to, as stored in the database.
+
+        Args:
+            resource: Raw FHIR resource data
+            references: Index to resolve urn:uuid and other Bundle fullUrl references with
+
+        Returns:
+            The patient ID, or None if the resource does not reference a patient
+            or the reference cannot be resolved
+        """
+        resource_type = resource.get("resourceType")
+        if resource_type == "Patient":
+            return resource.get("id")
+        if resource_type == "MedicationKnowledge":
+            return resource.get("patientId")
+
+        reference = FHIRTransformer.patient_reference_of(resource)
+        if not reference:
+            return None
+        target = references.resolve(reference) if references is not None else parse_literal_reference(reference)
+        return target[1] if target else None
+
+    def _optional_timestamp(self, resource: Dict[str, Any], field: str):
+        """
+        Parse an optional FHIR date/dateTime field; malformed values are stored as NULL.
+
+        Values with a timezone offset are converted to UTC, so they compare
+        correctly in the naive DATETIME columns.
+        """
+        value = resource.get(field)
+        if not value:
+            return None
+        try:
+            return to_utc_naive(parse_timestamp(value))
+        except (TypeError, ValueError):
+            self.progress.record(resource.get("resourceType"), f"invalid {field}", resource.get("id"))
+            return None
+
     def _transform_resource(self, resource: Dict[str, Any]) -> List:
         """
-        Transform a single FHIR resource dict into SQLAlchemy model instances.
+        Transform a single FHIR resource dict into row records.
 
         Args:
             resource: Raw FHIR resource data
 
         Returns:
-            List of SQLAlchemy model instances
+            List of PatientRow / MedicationRow records
         """
         if not resource or not isinstance(resource, dict):
-            logger.warning(f"Invalid resource: {resource}")
+            self.progress.record(type(resource).__name__, "invalid")
             return []
 
         resource_type = resource.get("resourceType")
         if not resource_type:
-            logger.warning(f"Resource missing resourceType: {resource}")
+            self.progress.record("<missing resourceType>", "invalid", resource.get("id"))
             return []
 
         models = []
 
         # Handle Bundle resources by extracting and processing each entry
         if resource_type == "Bundle":
-            for entry in resource.get("entry", []):
-                if "resource" in entry and isinstance(entry["resource"], dict):
-                    entry_models = self._transform_resource(entry["resource"])
-                    models.extend(entry_models)
+            for entry_resource in self.references.index_bundle(resource):
+                models.extend(self._transform_resource(entry_resource))
             return models
 
+        sampled = self.resource_sampler is not None and self.resource_sampler.sample(resource_type)
+        if sampled:
+            started = time.perf_counter()
+
         if resource_type == "Patient":
             try:
                 patient = Patient(**resource)
-                patient_db = PatientDB(
+                patient_db = PatientRow(
                     id=patient.id,
                     resource_type=patient.resourceType,
                     family_name=patient.name[0].family if patient.name else "",
@@ -95,9 +279,9 @@ class FHIRTransformer(DataTransformer):
                     contact_info=[cp.model_dump() for cp in (patient.telecom or [])] if patient.telecom else []
                 )
                 models.append(patient_db)
-                logger.info(f"Transformed Patient with ID: {patient.id}")
+                self.progress.record(resource_type, "transformed", patient.id)
             except Exception as e:
-                logger.error(f"Error transforming Patient: {e}")
+                self.progress.record_error(resource_type, e, resource.get("id"))
                 # Continue processing other resources
 
         elif resource_type == "MedicationKnowledge":
@@ -106,7 +290,7 @@ class FHIRTransformer(DataTransformer):
                 primary_coding = medication.code.coding[0] if medication.code.coding else None
                 if not primary_coding:
                     raise ValueError("Medication must have at least one coding")
-                medication_db = MedicationDB(
+                medication_db = MedicationRow(
                     id=medication.id,
                     patient_id=medication.patientId or "unknown",
                     resource_type=medication.resourceType,
@@ -116,9 +300,9 @@ class FHIRTransformer(DataTransformer):
                     text=medication.code.text
                 )
                 models.append(medication_db)
-                logger.info(f"Transformed MedicationKnowledge with ID: {medication.id}")
+                self.progress.record(resource_type, "transformed", medication.id)
             except Exception as e:
-                logger.error(f"Error transforming MedicationKnowledge: {e}")
+                self.progress.record_error(resource_type, e, resource.get("id"))
                 # Continue processing other resources
 
         elif resource_type == "MedicationStatement":
@@ -129,75 +313,139 @@ class FHIRTransformer(DataTransformer):
                 coding = med_concept.get("coding", [{}])[0] if med_concept.get("coding") else {}
 
                 # Extract patient reference
-                subject_ref = resource.get("subject", {}).get("reference", "")
-                patient_id = subject_ref.split("/")[-1] if subject_ref else "unknown"
+                patient_id = self.patient_id_of(resource, self.references)
+                if patient_id is None:
+                    reference = self.patient_reference_of(resource)
+                    if reference:
+                        # Its Bundle entry may still come; joined in finalize()
+                        self._unresolved_references.append((resource.get("id", ""), reference))
+                    patient_id = "unknown"
 
                 # Create medication database model
-                medication_db = MedicationDB(
+                medication_db = MedicationRow(
                     id=resource.get("id", ""),
                     patient_id=patient_id,
                     resource_type="MedicationKnowledge",  # Map to our model type
                     code=coding.get("code", ""),
                     display=coding.get("display", ""),
                     system=coding.get("system", ""),
-                    text=med_concept.get("text", "")
+                    text=med_concept.get("text", ""),
+                    effective_date_time=self._optional_timestamp(resource, "effectiveDateTime"),
+                    date_asserted=self._optional_timestamp(resource, "dateAsserted")
                 )
                 models.append(medication_db)
-                logger.info(f"Transformed MedicationStatement with ID: {resource.get('id')}")
+                self.progress.record(resource_type, "transformed", resource.get("id"))
             except Exception as e:
-                logger.error(f"Error transforming MedicationStatement: {e}")
+                self.progress.record_error(resource_type, e, resource.get("id"))
                 # Continue processing other resources
         else:
-            logger.warning(f"Unsupported resource type: {resource_type}")
+            self.progress.record(resource_type, "unsupported", resource.get("id"))
 
+        if sampled:
+            self.resource_sampler.record(resource_type, time.perf_counter() - started)
         return models
 
     def get_schema(self) -> Dict[str, Any]:
         """
-        Override the base get_schema method to return a dictionary instead of a string.
-        
+        The schema of the FHIR tables, generated from their SQLAlchemy models.
+
         Returns:
             Dictionary containing the schema definition
         """
-        # Define schema as a Python dictionary
-        schema_dict = {
-            "tables": [
-                {
-                    "name": "patient",
-                    "columns": [
-                        {"name": "id", "type": "TEXT", "primary_key": True, "nullable": False},
-                        {"name": "resource_type", "type": "TEXT", "nullable": False},
-                        {"name": "family_name", "type": "TEXT", "nullable": False},
-                        {"name": "given_names", "type": "JSON", "nullable": False},
-                        {"name": "contact_info", "type": "JSON", "nullable": True}
-                    ]
-                },
-                {
-                    "name": "medication",
-                    "columns": [
-                        {"name": "id", "type": "TEXT", "primary_key": True, "nullable": False},
-                        {"name": "patient_id", "type": "TEXT", "nullable": False, "foreign_key": "patient.id"},
-                        {"name": "resource_type", "type": "TEXT", "nullable": False},
-                        {"name": "code", "type": "TEXT", "nullable": False},
-                        {"name": "display", "type": "TEXT", "nullable": False},
-                        {"name": "system", "type": "TEXT", "nullable": False},
-                        {"name": "text", "type": "TEXT", "nullable": False}
-                    ]
-                }
-            ],
-            "relationships": [
-                {
-                    "name": "patient_medications",
-                    "source_table": "patient",
-                    "target_table": "medication",
-                    "source_column": "id",
-                    "target_column": "patient_id",
-                    "type": "one-to-many"
-                }
-            ]
-        }
+        bases = list(self.model_bases)
+        if self.aggregates:
+            bases.append(AggregateBase)
+
+        extra_tables = []
+        if self.medication_fts:
+            # A virtual table, so it has no model
+            extra_tables.append({
+                "name": MEDICATION_FTS_TABLE,
+                "description": "FTS5 full-text index over medication.display and medication.text. "
+                               "Search with MATCH and join back with medication.id = medication_fts.id",
+                "columns": [
+                    {"name": "id", "type": "TEXT", "nullable": False},
+                    {"name": "display", "type": "TEXT", "nullable": True},
+                    {"name": "text", "type": "TEXT", "nullable": True}
+                ]
+            })
+
+        return cached_schema(bases, extra_tables)
+
+    def _build_medication_fts(self) -> None:
+        """
+        Create and fill the FTS5 index over the medication table.
+
+        The index keeps its own copy of medication.id, the stable key to join
+        back on: medication has no INTEGER PRIMARY KEY, so a VACUUM may renumber
+        its rowids. It is filled once the table is final, in a single statement.
+        """
+        # The trigram tokenizer also serves substring searches; it needs SQLite 3.34+
+        tokenizer = "trigram" if sqlite3.sqlite_version_info >= (3, 34, 0) else "unicode61"
+        with self.engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS {MEDICATION_FTS_TABLE}"))
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE {MEDICATION_FTS_TABLE} USING fts5("
+                f"id UNINDEXED, display, text, tokenize='{tokenizer}')"
+            ))
+            connection.execute(text(
+                f"INSERT INTO {MEDICATION_FTS_TABLE}(id, display, text) SELECT id, display, text FROM medication"
+            ))
+        logger.info("Built %s full-text index", MEDICATION_FTS_TABLE)
+
+    def _materialize_aggregates(self) -> None:
+        """
+        (Re)compute the rollup tables from the medication table in a single transaction.
+        """
+        AggregateBase.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(MedicationCodeCountDB.__table__.delete())
+            connection.execute(PatientMedicationCountDB.__table__.delete())
+            connection.execute(text(
+                "INSERT INTO medication_code_counts (system, code, display, medication_count, patient_count) "
+                "SELECT system, code, MIN(display), COUNT(*), COUNT(DISTINCT patient_id) "
+                "FROM medication GROUP BY system, code ORDER BY system, code"
+            ))
+            connection.execute(text(
+                "INSERT INTO patient_medication_counts (patient_id, medication_count) "
+                "SELECT patient_id, COUNT(*) FROM medication GROUP BY patient_id ORDER BY patient_id"
+            ))
+        logger.info("Materialised aggregate tables")
+
+    def _resolve_pending_references(self) -> None:
+        """
+        Fill in the patient of medications whose reference could not be resolved when transformed.
 
-        return schema_dict
+        Resolves all of them against the complete reference index and updates
+        the rows with one executemany; references that still do not resolve
+        keep patient_id "unknown".
+        """
+        updates = []
+        for medication_id, reference in self._unresolved_references:
+            target = self.references.resolve(reference)
+            if target is None:
+                self.progress.record("MedicationStatement", "unresolved reference", medication_id)
+                continue
+            updates.append({"medication_id": medication_id, "patient_id": target[1]})
+        self._unresolved_references = []
+
+        if updates:
+            with self.engine.begin() as connection:
+                connection.execute(text(
+                    "UPDATE medication SET patient_id = :patient_id "
+                    "WHERE id = :medication_id AND patient_id = 'unknown'"
+                ), updates)
+            logger.info("Resolved %d deferred patient references", len(updates))
+        self.progress.log_summary(final=True)
+
+    def finalize(self) -> None:
+        """Join deferred references, build the optional rollups and full-text index, then finalize the database."""
+        self._resolve_pending_references()
+        if self.aggregates:
+            self._materialize_aggregates()
+        super().finalize()
+        if self.medication_fts:
+            self._build_medication_fts()
 
     def process(self, data: Union[Dict[str, Any], List[Dict[str, Any]]]) -> None:
         """
@@ -206,38 +454,209 @@ class FHIRTransformer(DataTransformer):
         Args:
             data: Raw FHIR resource data (single resource dict or list of resource dicts)
         """
-        models = self.transform(data)
-        session = self.Session()
-    
+        rows = self.transform(data)
+        if self.deterministic:
+            # Parents before children, then by primary key; the sort is stable so the
+            # first occurrence of a duplicate ID is still the one that is kept
+            table_order = {table.name: index for index, table in enumerate(Base.metadata.sorted_tables)}
+            rows.sort(key=lambda row: (table_order[row.__tablename__], row.id))
+
         try:
             # Use a set to track already processed IDs
             processed_ids = set()
-    
-            for model in models:
-                # Check if this model already exists in the database or in the current batch
-                if hasattr(model, 'id'):
-                    # If the ID has already been processed in this batch, skip it.
-                    if model.id in processed_ids:
-                        logger.info(f"Skipping duplicate model with ID: {model.id}")
-                        continue
-    
-                    # Check if it already exists in the database
-                    existing = session.query(model.__class__).filter_by(id=model.id).first()
-                    if existing:
-                        logger.info(f"Skipping existing model with ID: {model.id}")
-                        continue
-    
-                        # Mark this ID as processed
-                    processed_ids.add(model.id)
-    
-                # Add the model to the session
-                session.add(model)
-    
-            session.commit()
-            logger.info(f"Saved {len(processed_ids)} models to database")
+            pending = []
+
+            for row in rows:
+                # If the ID has already been processed in this batch, skip it.
+                if row.id in processed_ids:
+                    self.save_progress.record(row.__tablename__, "duplicate", row.id)
+                    continue
+                processed_ids.add(row.id)
+                pending.append(row)
+
+                if len(pending) >= self.commit_batch_size:
+                    self._write_rows(pending)
+                    # May move an in-memory build to disk, so the next batch opens a new connection
+                    self._check_memory_budget()
+                    pending = []
+
+            self._write_rows(pending)
+            self._check_memory_budget()
+            self.save_progress.log_summary(final=True)
+            logger.info("Saved %d models to database", len(processed_ids))
         except Exception as e:
-            session.rollback()
-            logger.error(f"Error saving to database: {e}")
+            logger.error("Error saving to database: %s", e)
             raise
+
+    def _write_rows(self, rows: List) -> None:
+        """
+        Insert a batch of row records in one transaction, one executemany per table.
+
+        Rows whose primary key already exists in the database are skipped.
+
+        Args:
+            rows: PatientRow / MedicationRow records with unique IDs
+        """
+        if not rows:
+            return
+
+        with self.engine.begin() as connection:
+            # Parents before children; rows of a table keep their order
+            for table in Base.metadata.sorted_tables:
+                table_rows = [row for row in rows if row.__tablename__ == table.name]
+                if not table_rows:
+                    continue
+
+                # Check which IDs already exist, in chunks below SQLite's bound-parameter limit
+                existing = set()
+                ids = [row.id for row in table_rows]
+                for start in range(0, len(ids), 500):
+                    query = select(table.c.id).where(table.c.id.in_(ids[start:start + 500]))
+                    existing.update(connection.execute(query).scalars())
+
+                params = []
+                for row in table_rows:
+                    if row.id in existing:
+                        self.save_progress.record(table.name, "existing", row.id)
+                        continue
+                    params.append(row.params())
+                if params:
+                    connection.execute(table.insert(), params)
+
+    @contextmanager
+    def worker_pool(self, workers: int) -> Iterator[None]:
+        """
+        Keep one pool of worker processes for every process_parallel() call in the block.
+
+        The pool is started by the first call that uses it, so the options and
+        the reference index are sent to each worker once, as they are then.
+
+        Args:
+            workers: Number of worker processes
+        """
+        self._pool_workers = workers
+        try:
+            yield
         finally:
-            session.close()
\ No newline at end of file
+            self._pool_workers = None
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _worker_pool(self, workers: int) -> ProcessPoolExecutor:
+        """A pool of worker processes, set up with this transformer's row-level options."""
+        # Row-level options only; aggregates and indexes are built on the merged database.
+        # They go to each worker once, through the initializer; tasks only carry their chunk.
+        options = {
+            "deterministic": self.deterministic,
+            "pii_masker": self.pii_masker,
+            "references": self.references,
+            "progress_interval": self.progress.interval,
+            "log_sample_every": self.progress.sample_every
+        }
+        terminology = (self.terminology.path, self.terminology.system) if self.terminology else None
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options, terminology))
+
+    def process_parallel(self, data: List[Dict[str, Any]], workers: int) -> None:
+        """
+        Transform and save FHIR resources using several worker processes.
+
+        The resources are split into contiguous chunks; each worker transforms
+        its chunk and writes it into its own temporary SQLite file, so parsing
+        and writing both use every core. The files are then merged into this
+        transformer's database in chunk order (see merge()). References the
+        workers could not resolve, and the Bundle fullUrls they indexed, are
+        handed back, so finalize() resolves references across chunks.
+
+        Inside worker_pool() every call shares its pool; otherwise a pool is
+        started for this call only.
+
+        Args:
+            data: Raw FHIR resource dicts
+            workers: Number of worker processes
+        """
+        if self._pool_workers is not None:
+            workers = self._pool_workers
+        if self.deterministic:
+            # The ordered merge attaches every part at once, and SQLite caps attached databases
+            max_attached = sqlite3.connect(":memory:").getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+            workers = min(workers, max_attached)
+
+        chunk_size = -(-len(data) // workers)
+        if workers <= 1 or chunk_size < self.parallel_min_chunk:
+            self.process(data)
+            return
+
+        chunks = [data[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+        work_dir = tempfile.mkdtemp(prefix="refiner-parts-")
+        try:
+            part_paths = [os.path.join(work_dir, f"part-{index:03d}.sqlite") for index in range(len(chunks))]
+            pool = self._pool
+            if pool is None:
+                pool = self._worker_pool(workers if self._pool_workers is not None else len(chunks))
+                if self._pool_workers is not None:
+                    self._pool = pool
+            try:
+                for _, unresolved, indexed in pool.map(_process_chunk, part_paths, chunks):
+                    # A reference may point at a Bundle entry of another chunk: both are
+                    # collected here and resolved against the complete index in finalize()
+                    self._unresolved_references.extend(unresolved)
+                    self.references.update(indexed)
+            finally:
+                # A pool of this call only is shut down before the caller can delete a temporary index
+                if pool is not self._pool:
+                    pool.shutdown()
+            logger.info("Wrote %d resources into %d worker databases", len(data), len(part_paths))
+            self.merge(part_paths)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def merge(self, part_paths: List[str]) -> None:
+        """
+        Merge databases with this transformer's tables into its database.
+
+        Uses ATTACH + INSERT OR IGNORE ... SELECT, so a primary key that is
+        already present (in the database or in an earlier part) is skipped,
+        the same rule process() applies to duplicate and existing rows. In
+        deterministic mode all parts are merged in one statement per table
+        ordered by primary key, giving the same row order as process().
+
+        Args:
+            part_paths: Databases to merge, earliest first
+        """
+        raw_connection = self.engine.raw_connection()
+        connection = raw_connection.driver_connection
+        try:
+            if self.deterministic:
+                aliases = [f"part{index}" for index in range(len(part_paths))]
+                for alias, path in zip(aliases, part_paths):
+                    connection.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+                for table in Base.metadata.sorted_tables:
+                    columns = ", ".join(column.name for column in table.columns)
+                    key = ", ".join(column.name for column in table.primary_key.columns)
+                    union = " UNION ALL ".join(
+                        f"SELECT {columns}, {index} AS part FROM {alias}.{table.name}"
+                        for index, alias in enumerate(aliases)
+                    )
+                    connection.execute(
+                        f"INSERT OR IGNORE INTO main.{table.name} ({columns}) "
+                        f"SELECT {columns} FROM ({union}) ORDER BY {key}, part"
+                    )
+                connection.commit()
+                for alias in aliases:
+                    connection.execute(f"DETACH DATABASE {alias}")
+            else:
+                for path in part_paths:
+                    connection.execute("ATTACH DATABASE ? AS part", (path,))
+                    for table in Base.metadata.sorted_tables:
+                        columns = ", ".join(column.name for column in table.columns)
+                        connection.execute(
+                            f"INSERT OR IGNORE INTO main.{table.name} ({columns}) "
+                            f"SELECT {columns} FROM part.{table.name}"
+                        )
+                    connection.commit()
+                    connection.execute("DETACH DATABASE part")
+        finally:
+            raw_connection.close()
+
+        self._check_memory_budget()
@@ -1,11 +1,17 @@
 from typing import Dict, Any, List
+from pydantic import TypeAdapter
+from sqlalchemy import func, select
 from refiner.models.refined import Base
 from refiner.transformer.base_transformer import DataTransformer
 from refiner.models.refined import UserRefined, StorageMetric, AuthSource
 from refiner.models.unrefined import User
-from refiner.utils.date import parse_timestamp
+from refiner.utils.date import parse_timestamp, parse_timestamps
 from refiner.utils.pii import mask_email
 
+# Validates a whole list of users in one call
+_users_adapter = TypeAdapter(List[User])
+
+
 class UserTransformer(DataTransformer):
     """
     Transformer for user data as defined in the example.
@@ -54,4 +60,79 @@ class UserTransformer(DataTransformer):
             )
             models.append(auth_source)
         
-        return models
\ No newline at end of file
+        return models
+
+    def transform_batch(self, data: List[Dict[str, Any]]) -> Dict[str, Dict[str, List[Any]]]:
+        """
+        Transform a list of raw users into column-oriented row buffers.
+
+        Produces the same rows as calling transform() per user, without
+        creating ORM instances. Autoincrement keys are left out and assigned
+        in bulk by process_batch().
+
+        Args:
+            data: List of dictionaries containing user data
+
+        Returns:
+            Mapping of table name to {column name: list of values}
+        """
+        users = _users_adapter.validate_python(data)
+        created_at = parse_timestamps(user.timestamp for user in users)
+
+        columns = {
+            UserRefined.__tablename__: {
+                "user_id": [user.userId for user in users],
+                "email": [mask_email(user.email) for user in users],  # Apply any PII masking (optional)
+                "name": [user.profile.name for user in users],
+                "locale": [user.profile.locale for user in users],
+                "created_at": created_at,
+            },
+            StorageMetric.__tablename__: {"user_id": [], "percent_used": [], "recorded_at": []},
+            AuthSource.__tablename__: {"user_id": [], "source": [], "collection_date": [], "data_type": []},
+        }
+
+        storage_metrics = columns[StorageMetric.__tablename__]
+        auth_sources = columns[AuthSource.__tablename__]
+        for user, user_created_at in zip(users, created_at):
+            if user.storage:
+                storage_metrics["user_id"].append(user.userId)
+                storage_metrics["percent_used"].append(user.storage.percentUsed)
+                storage_metrics["recorded_at"].append(user_created_at)
+            if user.metadata:
+                auth_sources["user_id"].append(user.userId)
+                auth_sources["source"].append(user.metadata.source)
+                auth_sources["collection_date"].append(user.metadata.collectionDate)
+                auth_sources["data_type"].append(user.metadata.dataType)
+
+        auth_sources["collection_date"] = parse_timestamps(auth_sources["collection_date"])
+        return columns
+
+    def process_batch(self, data: List[Dict[str, Any]]) -> None:
+        """
+        Transform a list of users and insert them with one executemany per table.
+
+        Args:
+            data: List of dictionaries containing user data
+        """
+        columns = self.transform_batch(data)
+        tables = {table.name: table for table in Base.metadata.sorted_tables}
+        autoincrement_keys = {
+            StorageMetric.__tablename__: StorageMetric.metric_id,
+            AuthSource.__tablename__: AuthSource.auth_id,
+        }
+
+        with self.engine.begin() as connection:
+            for table_name, table_columns in columns.items():
+                row_count = len(next(iter(table_columns.values())))
+                if not row_count:
+                    continue
+
+                key = autoincrement_keys.get(table_name)
+                if key is not None:
+                    # Reserve a contiguous block of keys instead of one per INSERT
+                    first_key = connection.execute(select(func.coalesce(func.max(key), 0))).scalar() + 1
+                    table_columns = {key.key: list(range(first_key, first_key + row_count)), **table_columns}
+
+                names = list(table_columns)
+                rows = [dict(zip(names, values)) for values in zip(*table_columns.values())]
+                connection.execute(tables[table_name].insert(), rows)
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks input files are hashed in
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def input_fingerprint(input_dir: str, filenames: Iterable[str], options: Dict[str, Any]) -> str:
+    """
+    Fingerprint of the inputs and settings a refinement is built from.
+
+    A checkpoint is only resumed if the fingerprint still matches, so a run
+    never continues from the state of a different contribution or
+    configuration. File contents are hashed rather than modification times,
+    because zip inputs are extracted again (with new mtimes) on every run.
+
+    Args:
+        input_dir: Directory of the input files
+        filenames: Input files that are refined
+        options: Settings that influence the refinement output
+
+    Returns:
+        Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+    for filename in sorted(filenames):
+        digest.update(filename.encode() + b"\0")
+        with open(os.path.join(input_dir, filename), "rb") as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """
+    Progress of a refinement, persisted in a JSON file in the output directory.
+
+    Records two kinds of progress:
+    - stage markers: a stage (transformed, encrypted, schema pinned, database
+      pinned, ...) is complete, together with its result (e.g. an IPFS hash)
+    - watermarks: how many resources of an input file are committed to the
+      database
+
+    Every update is written to a temporary file and renamed over the
+    checkpoint, so a process killed at any moment leaves either the old or
+    the new state behind.
+    """
+
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.stages: Dict[str, Any] = {}
+        self.watermarks: Dict[str, int] = {}
+
+    @classmethod
+    def load(cls, path: str, fingerprint: str) -> "Checkpoint":
+        """
+        Load the checkpoint at path, or start a new one.
+
+        A checkpoint of different inputs or settings is discarded.
+
+        Args:
+            path: Checkpoint file
+            fingerprint: Fingerprint of the current inputs (see input_fingerprint)
+
+        Returns:
+            The checkpoint to continue from
+        """
+        checkpoint = cls(path, fingerprint)
+        if not os.path.exists(path):
+            return checkpoint
+
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable checkpoint %s: %s", path, e)
+            return checkpoint
+
+        if state.get("fingerprint") != fingerprint:
+            logger.info("Inputs or settings changed since checkpoint %s, starting over", path)
+            return checkpoint
+
+        checkpoint.stages = state.get("stages", {})
+        checkpoint.watermarks = state.get("watermarks", {})
+        logger.info(
+            "Resuming from checkpoint: stages %s complete, %d resources committed",
+            sorted(checkpoint.stages) or "none", sum(checkpoint.watermarks.values())
+        )
+        return checkpoint
+
+    @property
+    def started(self) -> bool:
+        """Whether anything was recorded (and so a partial database may exist)."""
+        return bool(self.stages or self.watermarks)
+
+    def is_complete(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def result(self, stage: str) -> Optional[Any]:
+        """The result recorded when stage completed."""
+        return self.stages.get(stage)
+
+    def complete(self, stage: str, result: Optional[Any] = None) -> None:
+        """Mark stage as complete, with a JSON-serialisable result."""
+        self.stages[stage] = result
+        self.save()
+
+    def watermark(self, filename: str) -> int:
+        """Number of resources of filename already committed."""
+        return self.watermarks.get(filename, 0)
+
+    def set_watermark(self, filename: str, committed: int) -> None:
+        """Record that the first `committed` resources of filename are in the database."""
+        self.watermarks[filename] = committed
+        self.save()
+
+    def save(self) -> None:
+        state = {"fingerprint": self.fingerprint, "stages": self.stages, "watermarks": self.watermarks}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_path, self.path)
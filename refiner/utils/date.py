@@ -1,8 +1,63 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Iterable, List, Optional, Union
 
 
-def parse_timestamp(timestamp):
-    """Parse a timestamp to a datetime object."""
+def _parse_timestamp_string(timestamp: str) -> datetime:
+    """
+    Parse the string forms FHIR uses (date, dateTime, instant).
+
+    datetime.fromisoformat (Python 3.11+) reads full dates, date-times and a
+    trailing "Z" directly, so the common case needs no string rewriting; only
+    FHIR partial dates (YYYY, YYYY-MM) and older interpreters take the slow path.
+    """
+    try:
+        return datetime.fromisoformat(timestamp)
+    except ValueError:
+        if len(timestamp) == 4 and timestamp.isdigit():
+            return datetime(int(timestamp), 1, 1)
+        if len(timestamp) == 7 and timestamp[4] == '-':
+            return datetime(int(timestamp[0:4]), int(timestamp[5:7]), 1)
+        if timestamp.endswith("Z"):
+            return datetime.fromisoformat(timestamp[:-1] + "+00:00")
+        raise
+
+
+@lru_cache(maxsize=65536)
+def parse_timestamp(timestamp: Union[int, str]) -> datetime:
+    """
+    Parse a timestamp to a datetime object.
+
+    Integers are epoch milliseconds; strings are ISO 8601 / FHIR date,
+    dateTime or instant values. Results are cached, since the same
+    timestamps repeat across many resources (datetime objects are immutable,
+    so sharing them is safe).
+    """
     if isinstance(timestamp, int):
         return datetime.fromtimestamp(timestamp / 1000.0)
-    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
\ No newline at end of file
+    return _parse_timestamp_string(timestamp)
+
+
+def parse_timestamps(timestamps: Iterable[Optional[Union[int, str]]]) -> List[Optional[datetime]]:
+    """
+    Parse a column of timestamps in one pass.
+
+    Args:
+        timestamps: Values accepted by parse_timestamp, or None
+
+    Returns:
+        Parsed datetimes, in the same order; missing values stay None
+    """
+    parse = parse_timestamp
+    return [parse(value) if value is not None else None for value in timestamps]
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    """
+    Convert an offset-aware datetime to naive UTC, for naive DATETIME columns.
+
+    Naive values (dates and date-times without an offset) are returned as they are.
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
@@ -1,34 +1,79 @@
+import hashlib
+import os
 import warnings
+from typing import Tuple
 
-from cryptography.utils import CryptographyDeprecationWarning
+from refiner.config import settings
+from refiner.models.output import FileDigest, RefinementDigests
 
-# Suppress CryptographyDeprecationWarning from pgpy internals
-warnings.filterwarnings("ignore", category=CryptographyDeprecationWarning)
 
-import pgpy
-from pgpy.constants import CompressionAlgorithm, HashAlgorithm, SymmetricKeyAlgorithm
-import os
-from refiner.config import settings
+def _load_pgpy():
+    """
+    Import pgpy on first use.
 
+    pgpy pulls in the cryptography backends, which is a large share of the
+    container's cold start, so it is only loaded once something is actually
+    encrypted or decrypted.
+    """
+    from cryptography.utils import CryptographyDeprecationWarning
+
+    # Suppress CryptographyDeprecationWarning from pgpy internals
+    warnings.filterwarnings("ignore", category=CryptographyDeprecationWarning)
+
+    import pgpy
+    return pgpy
+
+
+def file_digest(data: bytes, blake2: bool = False) -> FileDigest:
+    """
+    Size and digests of a file's contents.
+
+    Args:
+        data: Contents of the file
+        blake2: Also compute a BLAKE2b digest
+
+    Returns:
+        FileDigest of the contents
+    """
+    return FileDigest(
+        size=len(data),
+        sha256=hashlib.sha256(data).hexdigest(),
+        blake2b=hashlib.blake2b(data).hexdigest() if blake2 else None
+    )
 
-def encrypt_file(encryption_key: str, file_path: str, output_path: str = None) -> str:
-    """Symmetrically encrypts a file with AES-256 using a passphrase.
+
+def encrypt_file_with_digests(
+    encryption_key: str,
+    file_path: str,
+    output_path: str = None,
+    blake2: bool = False
+) -> Tuple[str, RefinementDigests]:
+    """Symmetrically encrypts a file like encrypt_file and digests the plaintext and the ciphertext.
+
+    The digests are computed over the buffers the encryption reads and
+    writes anyway, so neither file is read a second time.
 
     Args:
         encryption_key: Passphrase for encryption
         file_path: Path to file to encrypt
         output_path: Output path (defaults to file_path + .pgp)
+        blake2: Also compute BLAKE2b digests
 
     Returns:
-        Path to encrypted file
+        Path to encrypted file, and the digests of both files
     """
+    pgpy = _load_pgpy()
+    from pgpy.constants import CompressionAlgorithm, HashAlgorithm, SymmetricKeyAlgorithm
+
     output_path = output_path or f"{file_path}.pgp"
 
     with open(file_path, 'rb') as f:
         buffer = f.read()
+    plaintext_digest = file_digest(buffer, blake2)
 
     # Create message with ZLIB compression
     message = pgpy.PGPMessage.new(buffer, compression=CompressionAlgorithm.ZLIB)
+    del buffer
 
     # Encrypt with AES-256 and SHA512 hash
     encrypted_message = message.encrypt(
@@ -37,10 +82,25 @@ def encrypt_file(encryption_key: str, file_path: str, output_path: str = None) -
         symmetric=SymmetricKeyAlgorithm.AES256
     )
 
+    ciphertext = str(encrypted_message).encode()
     with open(output_path, 'wb') as f:
-        f.write(str(encrypted_message).encode())
+        f.write(ciphertext)
 
-    return output_path
+    return output_path, RefinementDigests(plaintext=plaintext_digest, encrypted=file_digest(ciphertext, blake2))
+
+
+def encrypt_file(encryption_key: str, file_path: str, output_path: str = None) -> str:
+    """Symmetrically encrypts a file with AES-256 using a passphrase.
+
+    Args:
+        encryption_key: Passphrase for encryption
+        file_path: Path to file to encrypt
+        output_path: Output path (defaults to file_path + .pgp)
+
+    Returns:
+        Path to encrypted file
+    """
+    return encrypt_file_with_digests(encryption_key, file_path, output_path)[0]
 
 
 def decrypt_file(encryption_key: str, file_path: str, output_path: str = None) -> str:
@@ -54,6 +114,8 @@ def decrypt_file(encryption_key: str, file_path: str, output_path: str = None) -
     Returns:
         Path to decrypted file
     """
+    pgpy = _load_pgpy()
+
     if not output_path:
         base_path = file_path.rsplit('.pgp', 1)[0]
         output_path = f"{base_path}.decrypted"
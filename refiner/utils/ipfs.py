@@ -1,7 +1,6 @@
 import json
 import logging
 import os
-import requests
 from refiner.config import settings
 
 PINATA_FILE_API_ENDPOINT = "https://api.pinata.cloud/pinning/pinFileToIPFS"
@@ -13,6 +12,8 @@ def upload_json_to_ipfs(data):
     :param data: JSON data to upload (dictionary or list)
     :return: IPFS hash
     """
+    import requests
+
     if not settings.PINATA_API_KEY or not settings.PINATA_API_SECRET:
         raise Exception("Error: Pinata IPFS API credentials not found, please check your environment variables")
 
@@ -44,6 +45,8 @@ def upload_file_to_ipfs(file_path=None):
     :param file_path: Path to the file to upload (defaults to encrypted database)
     :return: IPFS hash
     """
+    import requests
+
     if file_path is None:
         # Default to the encrypted database file
         file_path = os.path.join(settings.OUTPUT_DIR, "db.libsql.pgp")
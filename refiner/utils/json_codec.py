@@ -0,0 +1,105 @@
+import json
+from typing import Any, Optional, Union
+
+from refiner.config import settings
+
+
+def _load_orjson():
+    """
+    Import orjson if it is installed and not disabled by JSON_BACKEND.
+
+    orjson is an optional dependency: without it every function of this
+    module falls back to the standard library json module.
+    """
+    if settings.JSON_BACKEND == "json":
+        return None
+    try:
+        import orjson
+    except ImportError:
+        if settings.JSON_BACKEND == "orjson":
+            raise
+        return None
+    return orjson
+
+
+_orjson = _load_orjson()
+
+# Name of the JSON implementation in use: "orjson" or "json"
+BACKEND = "orjson" if _orjson is not None else "json"
+
+
+# Maps every digit to "0", so a run of 19 digits shows up as _LONG_NUMBER
+_DIGITS = bytes.maketrans(b"123456789", b"000000000")
+_LONG_NUMBER = b"0" * 19
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """
+    Decode a JSON document.
+
+    orjson is used unless the document may hold something it decodes
+    differently from the json module: integers beyond 64 bits, which it
+    silently turns into floats (any number of 19 or more digits is treated
+    as such), and NaN or Infinity, which it rejects.
+
+    Args:
+        data: JSON text, as str or UTF-8 bytes
+
+    Returns:
+        Decoded value
+    """
+    if _orjson is not None:
+        raw = data.encode() if isinstance(data, str) else data
+        if raw.translate(_DIGITS).find(_LONG_NUMBER) < 0:
+            try:
+                return _orjson.loads(raw)
+            except _orjson.JSONDecodeError:
+                # e.g. NaN; invalid documents raise json.JSONDecodeError below
+                pass
+    return json.loads(data)
+
+
+def dumps(value: Any, indent: Optional[int] = None, sort_keys: bool = False) -> str:
+    """
+    Encode a value as JSON text, compact unless indent is given.
+
+    Non-ASCII characters are written as UTF-8 rather than \\u escapes by
+    either backend. Compact text from orjson may format some floats
+    differently (1e16 rather than 1e+16); use canonical() where the bytes
+    matter. Indented text is always produced by the json module (orjson
+    only indents by two spaces), so files written with an indent are the
+    same bytes whichever backend is in use.
+
+    Args:
+        value: Value to encode
+        indent: Indent nested values (pretty-print) by this many spaces when set
+        sort_keys: Write object keys in sorted order
+
+    Returns:
+        JSON text
+    """
+    if _orjson is not None and indent is None:
+        option = _orjson.OPT_SORT_KEYS if sort_keys else 0
+        try:
+            return _orjson.dumps(value, option=option).decode()
+        except TypeError:
+            # e.g. integers beyond 64 bits, which only the json module encodes
+            pass
+    separators = (",", ":") if indent is None else None
+    return json.dumps(value, indent=indent, sort_keys=sort_keys, separators=separators, ensure_ascii=False)
+
+
+def canonical(value: Any) -> str:
+    """
+    Encode a value with sorted keys and no insignificant whitespace.
+
+    Always produced by the json module, so the text does not depend on the
+    backend: orjson formats some floats differently (1e16 rather than 1e+16).
+    """
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def dump(value: Any, path: str, indent: Optional[int] = None) -> None:
+    """Write a value as JSON to the file at path."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(dumps(value, indent=indent))
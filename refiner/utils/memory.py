@@ -0,0 +1,77 @@
+import gc
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs (e.g. macOS): the peak is the closest available figure
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryGovernor:
+    """
+    Keeps a refinement under an RSS budget by adapting how much it takes on at once.
+
+    Stages ask for the size of their next batch; while the process is close
+    to its budget the batch size is halved (down to min_batch_size), and once
+    memory use is well below the budget it grows back to its initial size.
+    """
+
+    # Fractions of the budget above which batches shrink, and below which they grow again
+    high_water = 0.8
+    low_water = 0.5
+
+    # Smallest batch size throttling goes down to
+    min_batch_size = 100
+
+    def __init__(self, budget_bytes: int, batch_size: int):
+        """
+        Args:
+            budget_bytes: RSS the process should stay below
+            batch_size: Initial and largest batch size
+        """
+        self.budget_bytes = budget_bytes
+        self.max_batch_size = batch_size
+        self.min_batch_size = min(self.min_batch_size, batch_size)
+        self.batch_size = batch_size
+        self.throttled = 0
+        # Full garbage collections forced so far
+        self.collections = 0
+
+    def under_pressure(self) -> bool:
+        """Whether memory use is near the budget."""
+        return current_rss() >= self.budget_bytes * self.high_water
+
+    def next_batch_size(self) -> int:
+        """
+        Size of the next batch, halved under memory pressure and grown back without it.
+
+        Before shrinking, a full garbage collection gives back what it can and
+        pressure is checked again. Collections only happen when the batch can
+        still shrink, so a process that stays near its budget at
+        min_batch_size does not pay for one per batch.
+        """
+        if self.under_pressure():
+            if self.batch_size > self.min_batch_size:
+                gc.collect()
+                self.collections += 1
+                if self.under_pressure():
+                    self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+                    self.throttled += 1
+                    logger.info(
+                        "RSS near budget of %d bytes, batch size reduced to %d", self.budget_bytes, self.batch_size
+                    )
+        elif self.batch_size < self.max_batch_size and current_rss() < self.budget_bytes * self.low_water:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+        return self.batch_size
@@ -1,5 +1,10 @@
 import hashlib
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
 
+
+@lru_cache(maxsize=65536)
 def mask_email(email: str) -> str:
     """
     Mask email addresses by hashing the local part (before @).
@@ -16,4 +21,116 @@ def mask_email(email: str) -> str:
     local_part, domain = email.split('@', 1)
     hashed_local = hashlib.md5(local_part.encode()).hexdigest()
     
-    return f"{hashed_local}@{domain}" 
\ No newline at end of file
+    return f"{hashed_local}@{domain}"
+
+
+class PIIMasker:
+    """
+    Keyed, memoized masking of PII values.
+
+    Values are replaced by a keyed BLAKE2b digest, so they cannot be reversed
+    with a dictionary of known emails or names without the salt. The salt is
+    random per refinement unless a secret is configured, so the same person
+    masks to the same token within one refinement (joins and counts still
+    work) but not across refinements. It is never derived from the
+    refinement's encryption key: whoever can decrypt the database holds that
+    key and could recompute the salt.
+
+    Repeated values (the same email on many rows and files) are hashed once:
+    every batch is de-duplicated before hashing and the digests are kept in a
+    bounded LRU cache across batches.
+    """
+
+    def __init__(self, salt: bytes, cache_size: int = 65536):
+        """
+        Args:
+            salt: Per-refinement secret (up to 64 bytes are used as the BLAKE2b key)
+            cache_size: Maximum number of memoized digests
+        """
+        self.salt = salt
+        self.cache_size = cache_size
+        self._digest = lru_cache(maxsize=cache_size)(self._digest_uncached)
+
+    def __reduce__(self):
+        # The memo cache is not picklable; worker processes start with an empty one
+        return PIIMasker, (self.salt, self.cache_size)
+
+    @classmethod
+    def for_refinement(cls, secret: Optional[str] = None, cache_size: int = 65536) -> "PIIMasker":
+        """
+        Build the masker of one refinement.
+
+        Args:
+            secret: Configured masking secret (PII_MASK_SALT), kept apart from
+                the encryption key. Without one the salt is random, so masked
+                values (and the database bytes) differ on every run.
+            cache_size: Maximum number of memoized digests
+        """
+        if secret is None:
+            return cls(os.urandom(32), cache_size)
+        salt = hashlib.sha256(b"refiner-pii-mask:" + secret.encode()).digest()
+        return cls(salt, cache_size)
+
+    def _digest_uncached(self, value: str) -> str:
+        return hashlib.blake2b(value.encode(), key=self.salt[:64], digest_size=16).hexdigest()
+
+    def mask_value(self, value: Optional[str]) -> Optional[str]:
+        """Mask a single value; empty values are kept as they are."""
+        if not value:
+            return value
+        return self._digest(value)
+
+    def mask_email(self, email: Optional[str]) -> Optional[str]:
+        """Mask the local part of an email address, keeping the domain."""
+        if not email or '@' not in email:
+            return self.mask_value(email)
+        local_part, domain = email.split('@', 1)
+        return f"{self._digest(local_part)}@{domain}"
+
+    def mask_contact_point(self, contact_point: Dict[str, Any]) -> Dict[str, Any]:
+        """Mask the value of a FHIR ContactPoint dict (emails keep their domain)."""
+        masked = dict(contact_point)
+        if masked.get("system") == "email":
+            masked["value"] = self.mask_email(masked.get("value"))
+        else:
+            masked["value"] = self.mask_value(masked.get("value"))
+        return masked
+
+    def mask_values(self, values: Iterable[Optional[str]]) -> List[Optional[str]]:
+        """
+        Mask a column of values in one pass.
+
+        Args:
+            values: Column values, duplicates allowed
+
+        Returns:
+            Masked values, in the same order
+        """
+        values = list(values)
+        masked = {value: self.mask_value(value) for value in set(values)}
+        return [masked[value] for value in values]
+
+    def mask_patients(self, patients: List[Any]) -> None:
+        """
+        Mask the name and telecom columns of a batch of PatientDB rows in place.
+
+        Args:
+            patients: Rows with family_name, given_names and contact_info attributes
+        """
+        if not patients:
+            return
+
+        for patient, family_name in zip(patients, self.mask_values(p.family_name for p in patients)):
+            patient.family_name = family_name
+
+        for patient in patients:
+            patient.given_names = [
+                {
+                    **name,
+                    "family": self.mask_value(name.get("family")),
+                    "given": [self.mask_value(given) for given in name.get("given") or []]
+                }
+                for name in patient.given_names or []
+            ]
+            if patient.contact_info:
+                patient.contact_info = [self.mask_contact_point(cp) for cp in patient.contact_info]
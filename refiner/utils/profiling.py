@@ -0,0 +1,187 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceSampler:
+    """
+    Times every N-th resource of each resource type.
+
+    The transformer asks sample() for every resource and only reads the clock
+    for the sampled ones, so the cost of unsampled resources is one counter
+    increment.
+    """
+
+    def __init__(self, every: int):
+        """
+        Args:
+            every: Time one in this many resources of each type
+        """
+        self.every = every
+        self.seen = defaultdict(int)
+        self.sampled = defaultdict(int)
+        self.total_seconds = defaultdict(float)
+        self.max_seconds = defaultdict(float)
+
+    def sample(self, resource_type: str) -> bool:
+        """Count a resource and tell whether it is to be timed."""
+        self.seen[resource_type] += 1
+        return self.seen[resource_type] % self.every == 0
+
+    def record(self, resource_type: str, seconds: float) -> None:
+        """Add the duration of a sampled resource."""
+        self.sampled[resource_type] += 1
+        self.total_seconds[resource_type] += seconds
+        self.max_seconds[resource_type] = max(self.max_seconds[resource_type], seconds)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Resources seen and sampled, and the mean and maximum duration, per resource type."""
+        return {
+            resource_type: {
+                "seen": self.seen[resource_type],
+                "sampled": sampled,
+                "mean_seconds": self.total_seconds[resource_type] / sampled,
+                "max_seconds": self.max_seconds[resource_type]
+            }
+            for resource_type, sampled in sorted(self.sampled.items())
+        }
+
+
+class Profiler:
+    """
+    Optional cProfile and tracemalloc instrumentation of the refinement stages.
+
+    For every stage run under stage(), writes into the profile directory:
+
+    - <stage>.pstats and <stage>.txt: cProfile statistics of the stage, as a
+      pstats dump and as the top functions by cumulative time
+    - <stage>.tracemalloc.txt: traced memory and peak during the stage, the
+      top allocation sites at its end, and the sites that grew the most
+
+    finish() adds transform_resource.json with the per-resource-type timings
+    of the ResourceSampler. Everything is off unless enabled; a disabled
+    Profiler only costs a flag check per stage.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        cpu: bool = False,
+        memory: bool = False,
+        top: int = 25,
+        sample_every: int = 0
+    ):
+        """
+        Args:
+            directory: Where the profiles are written (created on first use)
+            cpu: Profile stages with cProfile
+            memory: Trace allocations with tracemalloc
+            top: Number of functions / allocation sites listed in the text reports
+            sample_every: Time one in this many resources of each type (0 disables sampling)
+        """
+        self.directory = directory
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.resource_sampler = ResourceSampler(sample_every) if sample_every > 0 else None
+        self._profiling = False
+        self._started_tracing = False
+
+    def _path(self, name: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        # Stage names such as "transformed:shard-000" become file names
+        return os.path.join(self.directory, name.replace(":", "-"))
+
+    def start(self) -> None:
+        """Start tracing allocations, if memory profiling is enabled."""
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Profile the code run inside the block as one stage.
+
+        A stage started inside another one is only covered by the outer
+        stage's CPU profile, as cProfile cannot nest.
+
+        Args:
+            name: Stage name, used for the file names
+        """
+        if not (self.cpu or self.memory):
+            yield
+            return
+
+        profile = None
+        if self.cpu and not self._profiling:
+            profile = cProfile.Profile()
+            self._profiling = True
+
+        before = None
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+        started = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+                self._write_cpu_profile(name, profile)
+            if before is not None:
+                self._write_memory_profile(name, before, time.perf_counter() - started)
+
+    def _write_cpu_profile(self, name: str, profile: cProfile.Profile) -> None:
+        profile.dump_stats(self._path(f"{name}.pstats"))
+        with open(self._path(f"{name}.txt"), "w") as f:
+            pstats.Stats(profile, stream=f).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        logger.info("CPU profile of stage %s written to %s", name, self._path(f"{name}.pstats"))
+
+    def _write_memory_profile(self, name: str, before: tracemalloc.Snapshot, seconds: float) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        lines = [
+            f"Stage {name}: {seconds:.3f}s, traced {current / 2**20:.1f} MiB at the end, "
+            f"peak {peak / 2**20:.1f} MiB",
+            "",
+            f"Top {self.top} allocation sites at the end of the stage:"
+        ]
+        lines.extend(str(stat) for stat in after.statistics("lineno")[:self.top])
+        lines.extend(["", f"Top {self.top} allocation sites by growth during the stage:"])
+        lines.extend(str(stat) for stat in after.compare_to(before, "lineno")[:self.top])
+        with open(self._path(f"{name}.tracemalloc.txt"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        logger.info("Memory profile of stage %s: peak %.1f MiB", name, peak / 2**20)
+
+    def finish(self) -> Optional[str]:
+        """
+        Stop tracing and write the resource timings.
+
+        Returns:
+            Path of transform_resource.json, if resources were sampled
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        if self.resource_sampler is None or not self.resource_sampler.sampled:
+            return None
+        path = self._path("transform_resource.json")
+        with open(path, "w") as f:
+            json.dump(self.resource_sampler.summary(), f, indent=2)
+        logger.info("Resource transform timings written to %s", path)
+        return path
@@ -0,0 +1,104 @@
+import logging
+import time
+from collections import Counter
+from typing import Optional
+
+# How many events are recorded between two looks at the clock
+_CLOCK_CHECK_EVERY = 1024
+
+
+class ProgressLog:
+    """
+    Per-resource-type event counters with periodic progress summaries.
+
+    Hot paths call record() instead of logging one line per resource, so the
+    logging cost stays flat no matter how many rows are processed. A summary
+    line is emitted at most every `interval` seconds and once more at the end
+    of the stage. When `sample_every` is set, every N-th event is also logged
+    at DEBUG level. Failures are logged individually only for the first
+    `error_log_limit` of each resource type, and counted after that.
+    """
+
+    # Failures logged one by one per resource type before they are only counted
+    error_log_limit = 5
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        stage: str,
+        interval: float = 10.0,
+        sample_every: int = 0
+    ):
+        """
+        Args:
+            logger: Logger the summaries are written to
+            stage: Name of the stage, prefixed to every line
+            interval: Minimum seconds between two progress summaries (LOG_PROGRESS_INTERVAL)
+            sample_every: Log every N-th event at DEBUG level, 0 for none (LOG_SAMPLE_EVERY)
+        """
+        self.logger = logger
+        self.stage = stage
+        self.interval = interval
+        self.sample_every = sample_every
+        self.counts = Counter()
+        self.events = 0
+        self._errors_logged = Counter()
+        self._last_summary = time.monotonic()
+
+    def record(self, resource_type: str, event: str, resource_id: Optional[str] = None) -> None:
+        """
+        Count one event for a resource type.
+
+        Args:
+            resource_type: Resource type or table name, e.g. "Patient"
+            event: What happened, e.g. "transformed", "duplicate", "existing"
+            resource_id: Only used for sampled debug lines
+        """
+        self.counts[(resource_type, event)] += 1
+        self.events += 1
+
+        if self.sample_every and self.events % self.sample_every == 0:
+            self.logger.debug("[%s] sample: %s %s %s", self.stage, event, resource_type, resource_id)
+
+        if self.events % _CLOCK_CHECK_EVERY == 0:
+            now = time.monotonic()
+            if now - self._last_summary >= self.interval:
+                self._last_summary = now
+                self.log_summary()
+
+    def record_error(self, resource_type: str, error: Exception, resource_id: Optional[str] = None) -> None:
+        """
+        Count a failed resource, logging the error only for the first few failures of its type.
+
+        Args:
+            resource_type: Resource type, e.g. "Patient"
+            error: What went wrong
+            resource_id: ID of the failed resource, if it has one
+        """
+        self.record(resource_type, "failed", resource_id)
+        logged = self._errors_logged[resource_type]
+        if logged >= self.error_log_limit:
+            return
+        self._errors_logged[resource_type] += 1
+        self.logger.error("[%s] Error transforming %s %s: %s", self.stage, resource_type, resource_id, error)
+        if logged + 1 == self.error_log_limit:
+            self.logger.error(
+                "[%s] Further %s failures are only counted in the progress summaries", self.stage, resource_type
+            )
+
+    def count(self, event: str, resource_type: Optional[str] = None) -> int:
+        """Number of events recorded, optionally restricted to one resource type."""
+        return sum(
+            value for (counted_type, counted_event), value in self.counts.items()
+            if counted_event == event and (resource_type is None or counted_type == resource_type)
+        )
+
+    def log_summary(self, final: bool = False) -> None:
+        """Log one line with the counters of every resource type seen so far."""
+        if not self.counts:
+            return
+        summary = ", ".join(
+            f"{resource_type} {event}={value}"
+            for (resource_type, event), value in sorted(self.counts.items())
+        )
+        self.logger.info("[%s] %s %d events: %s", self.stage, "done," if final else "progress,", self.events, summary)
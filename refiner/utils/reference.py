@@ -0,0 +1,130 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Prefixes of references that only mean something inside the Bundle (or resource) they appear in
+_LOCAL_REFERENCE_PREFIXES = ("urn:uuid:", "urn:oid:", "#")
+
+
+def parse_literal_reference(reference: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a relative or absolute literal reference into resource type and ID.
+
+    "Patient/123", "https://example.org/fhir/Patient/123" and
+    "Patient/123/_history/2" all give ("Patient", "123").
+
+    Args:
+        reference: FHIR Reference.reference value
+
+    Returns:
+        (resource type, id), or None if the reference is not a literal one
+        (urn:uuid:/urn:oid: identifiers and contained "#" references)
+    """
+    if not reference or reference.startswith(_LOCAL_REFERENCE_PREFIXES):
+        return None
+    parts = reference.split("/_history/")[0].rstrip("/").split("/")
+    if len(parts) < 2 or not parts[-1]:
+        return None
+    return parts[-2], parts[-1]
+
+
+class ReferenceIndex:
+    """
+    Index of Bundle entry fullUrls to the resources they identify.
+
+    Transaction Bundles reference their entries by fullUrl, typically
+    "urn:uuid:..." identifiers that do not contain the resource ID. The index
+    is filled in a single pass over each Bundle's entries, after which every
+    reference resolves with one dictionary lookup.
+    """
+
+    def __init__(self):
+        self._targets: Dict[str, Tuple[str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._targets)
+
+    def for_worker(self) -> "ReferenceIndex":
+        """The index a process_parallel worker uses; an in-memory index is copied into the worker as it is."""
+        return self
+
+    def add(self, full_url: str, resource_type: str, resource_id: str) -> None:
+        self._targets[full_url] = (resource_type, resource_id)
+
+    def entries(self, start: int = 0) -> List[Tuple[str, str, str]]:
+        """
+        (fullUrl, resource type, id) of the indexed entries, in the order they were first added.
+
+        Args:
+            start: Skip this many entries, e.g. len() of the index at an earlier point
+        """
+        return [
+            (full_url, resource_type, resource_id)
+            for full_url, (resource_type, resource_id) in list(self._targets.items())[start:]
+        ]
+
+    def update(self, entries: List[Tuple[str, str, str]]) -> None:
+        """Add (fullUrl, resource type, id) entries, e.g. those indexed by a worker process."""
+        for full_url, resource_type, resource_id in entries:
+            self.add(full_url, resource_type, resource_id)
+
+    def index_bundle(self, bundle: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Index the fullUrls of a Bundle and return its entry resources.
+
+        An entry resource without an ID (as sent in transaction Bundles) is
+        given the UUID of its "urn:uuid:" fullUrl as ID; the returned resource
+        is then a shallow copy, the Bundle itself is not modified.
+
+        Args:
+            bundle: Raw FHIR Bundle
+
+        Returns:
+            The resources of the Bundle's entries, in entry order
+        """
+        return list(self.index_entries(bundle.get("entry") or []))
+
+    def index_entries(self, entries: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Index the fullUrls of Bundle entries as they are consumed and yield their resources.
+
+        Works like index_bundle, for entries read one at a time (see sniff.iter_bundle_entries).
+
+        Args:
+            entries: Raw Bundle entries
+
+        Returns:
+            The resources of the entries, in entry order
+        """
+        for entry in entries:
+            resource = entry.get("resource") if isinstance(entry, dict) else None
+            if not isinstance(resource, dict):
+                continue
+
+            full_url = entry.get("fullUrl")
+            if full_url:
+                if not resource.get("id") and full_url.startswith("urn:uuid:"):
+                    resource = {**resource, "id": full_url[len("urn:uuid:"):]}
+                if resource.get("resourceType") and resource.get("id"):
+                    self.add(full_url, resource["resourceType"], resource["id"])
+            yield resource
+
+    def _lookup(self, full_url: str) -> Optional[Tuple[str, str]]:
+        """(resource type, id) indexed for a fullUrl."""
+        return self._targets.get(full_url)
+
+    def resolve(self, reference: Optional[str]) -> Optional[Tuple[str, str]]:
+        """
+        Resolve a reference to the resource type and ID it points at.
+
+        Args:
+            reference: FHIR Reference.reference value
+
+        Returns:
+            (resource type, id), or None if the reference cannot be resolved
+            (yet: its Bundle entry may not have been indexed)
+        """
+        if not reference:
+            return None
+        target = self._lookup(reference)
+        if target is not None:
+            return target
+        return parse_literal_reference(reference)
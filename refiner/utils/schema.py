@@ -0,0 +1,151 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import JSON, Boolean, DateTime, Float, Integer, String, Table
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import ONETOMANY
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+# Schema type names of SQLAlchemy column types, most specific first
+_TYPE_NAMES = (
+    (JSON, "JSON"),
+    (DateTime, "DATETIME"),
+    (Boolean, "BOOLEAN"),
+    (Integer, "INTEGER"),
+    (Float, "REAL"),
+    (String, "TEXT"),
+)
+
+# Generated schemas by fingerprint of the models they were generated from
+_schema_cache: Dict[str, Dict[str, Any]] = {}
+# Fingerprints by the bases (and extra tables) they were computed for; model
+# classes do not change once defined, so each set is only hashed once per process
+_fingerprints: Dict[Tuple[Tuple[int, ...], str], str] = {}
+
+
+def _type_name(column) -> str:
+    for type_class, name in _TYPE_NAMES:
+        if isinstance(column.type, type_class):
+            return name
+    return column.type.compile(dialect=sqlite.dialect())
+
+
+def _column_definition(column) -> Dict[str, Any]:
+    definition = {"name": column.name, "type": _type_name(column)}
+    if column.primary_key:
+        definition["primary_key"] = True
+    definition["nullable"] = column.nullable
+    if column.unique:
+        definition["unique"] = True
+    for foreign_key in column.foreign_keys:
+        definition["foreign_key"] = foreign_key.target_fullname
+    if column.comment:
+        definition["description"] = column.comment
+    return definition
+
+
+def _table_definition(table: Table) -> Dict[str, Any]:
+    definition = {"name": table.name}
+    if table.comment:
+        definition["description"] = table.comment
+    definition["columns"] = [_column_definition(column) for column in table.columns]
+    indexes = sorted(table.indexes, key=lambda index: index.name or "")
+    if indexes:
+        definition["indexes"] = [
+            {"name": index.name, "columns": [column.name for column in index.columns], "unique": bool(index.unique)}
+            for index in indexes
+        ]
+    return definition
+
+
+def _relationship_definitions(base) -> List[Dict[str, Any]]:
+    """One-to-many relationships of the mapped classes, named <source table>_<attribute>."""
+    relationships = []
+    for mapper in sorted(base.registry.mappers, key=lambda mapper: mapper.local_table.name):
+        for relationship in mapper.relationships:
+            if relationship.direction is not ONETOMANY:
+                continue
+            for local_column, remote_column in relationship.local_remote_pairs:
+                relationships.append({
+                    "name": f"{mapper.local_table.name}_{relationship.key}",
+                    "source_table": local_column.table.name,
+                    "target_table": remote_column.table.name,
+                    "source_column": local_column.name,
+                    "target_column": remote_column.name,
+                    "type": "one-to-many"
+                })
+    return relationships
+
+
+def generate_schema(bases: Sequence[Any], extra_tables: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Generate the tables and relationships of the off-chain schema from SQLAlchemy models.
+
+    Args:
+        bases: Declarative bases whose tables are included, in this order
+            (tables of each base in dependency order)
+        extra_tables: Table definitions without a model, e.g. virtual tables,
+            appended as they are
+
+    Returns:
+        Dictionary with "tables" and "relationships"
+    """
+    tables = []
+    relationships = []
+    for base in bases:
+        tables.extend(_table_definition(table) for table in base.metadata.sorted_tables)
+        relationships.extend(_relationship_definitions(base))
+    tables.extend(extra_tables or [])
+    return {"tables": tables, "relationships": relationships}
+
+
+def models_fingerprint(bases: Sequence[Any], extra_tables: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    Hash of everything the generated schema depends on.
+
+    Covers the CREATE TABLE statement of every table (columns, types,
+    constraints and foreign keys), its CREATE INDEX statements and comments,
+    the mapped relationships and the extra table definitions.
+    """
+    dialect = sqlite.dialect()
+    digest = hashlib.sha256()
+    for base in bases:
+        for table in base.metadata.sorted_tables:
+            digest.update(str(CreateTable(table).compile(dialect=dialect)).encode())
+            # Comments are not part of SQLite DDL
+            digest.update(repr([table.comment] + [column.comment for column in table.columns]).encode())
+            for index in sorted(table.indexes, key=lambda index: index.name or ""):
+                digest.update(str(CreateIndex(index).compile(dialect=dialect)).encode())
+        for mapper in base.registry.mappers:
+            for relationship in mapper.relationships:
+                digest.update(f"{mapper.local_table.name}.{relationship.key}:{relationship.direction.name}".encode())
+    digest.update(json.dumps(extra_tables or [], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def cached_schema(bases: Sequence[Any], extra_tables: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    generate_schema(), computed once per distinct set of model definitions.
+
+    The schema is cached under models_fingerprint(), so transformers (and
+    jobs of a warm worker) built on the same models share one schema.
+
+    Args:
+        bases: See generate_schema
+        extra_tables: See generate_schema
+
+    Returns:
+        The schema; its "tables" and "relationships" lists are copies callers
+        may extend, the table definitions in them are shared and must not be
+        modified
+    """
+    key = (tuple(id(base) for base in bases), json.dumps(extra_tables or [], sort_keys=True))
+    fingerprint = _fingerprints.get(key)
+    if fingerprint is None:
+        fingerprint = _fingerprints[key] = models_fingerprint(bases, extra_tables)
+
+    schema = _schema_cache.get(fingerprint)
+    if schema is None:
+        schema = _schema_cache[fingerprint] = generate_schema(bases, extra_tables)
+    return {"tables": list(schema["tables"]), "relationships": list(schema["relationships"])}
@@ -0,0 +1,18 @@
+import zlib
+
+
+def shard_index(key: str, shards: int) -> int:
+    """
+    Map a partition key (a patient ID) to one of `shards` output shards.
+
+    Uses CRC-32 rather than hash(), which is randomised per process, so the
+    same patient always lands in the same shard across runs and workers.
+
+    Args:
+        key: Partition key
+        shards: Number of shards
+
+    Returns:
+        Shard index in [0, shards)
+    """
+    return zlib.crc32(key.encode()) % shards
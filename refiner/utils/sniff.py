@@ -0,0 +1,348 @@
+import json
+import re
+from typing import IO, Any, Callable, Collection, Dict, Iterator, Optional
+
+from refiner.utils import json_codec
+
+_decoder = json.JSONDecoder()
+
+# Every "resourceType": "..." pair in a document, at any depth
+_RESOURCE_TYPE = re.compile(r'"resourceType"\s*:\s*"([^"\\]*)"')
+# resourceType as the first member of the top-level object (FHIR JSON puts it first)
+_LEADING_RESOURCE_TYPE = re.compile(r'\s*\{\s*"resourceType"\s*:\s*"([^"\\]*)"')
+# resourceType of an entry written as {"fullUrl": ..., "resource": {"resourceType": ...
+_ENTRY_RESOURCE_TYPE = re.compile(
+    r'\{\s*(?:"fullUrl"\s*:\s*"[^"\\]*"\s*,\s*)?"resource"\s*:\s*\{\s*"resourceType"\s*:\s*"([^"\\]*)"'
+)
+# Characters that start a string or open/close a container
+_STRUCTURAL = re.compile(r'["{}\[\]]')
+_WHITESPACE = re.compile(r'\s*')
+
+# Characters read from a file at a time by iter_bundle_entries
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _string_end(text: str, pos: int) -> int:
+    """End of the JSON string starting with the quote at pos."""
+    # str.find runs at memchr speed, far faster than a regex over long base64 strings
+    end = text.find('"', pos + 1)
+    while end != -1:
+        backslashes = 0
+        while text[end - 1 - backslashes] == '\\':
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return end + 1
+        end = text.find('"', end + 1)
+    raise ValueError(f"Unterminated string at position {pos}")
+
+
+def _scan_entry(text: str, pos: int):
+    """
+    Find the end of the Bundle entry object at pos and the resourceType of its resource.
+
+    Only strings and brackets are looked at, and strings are stepped over with
+    str.find, so the large base64 strings of attachments cost little and
+    nothing is decoded.
+
+    Returns:
+        (end position, resourceType of entry.resource or None)
+    """
+    depth = 0
+    member = None
+    resource_type = None
+    while True:
+        match = _STRUCTURAL.search(text, pos)
+        if match is None:
+            raise ValueError(f"Unterminated Bundle entry at position {pos}")
+        start = match.start()
+        char = text[start]
+        if char == '"':
+            pos = _string_end(text, start)
+            # Only short strings directly in the entry or its resource can be interesting keys
+            if depth > 2 or pos - start > 32:
+                continue
+            colon = _skip_whitespace(text, pos)
+            if text[colon:colon + 1] != ':':
+                continue
+            token = text[start:pos]
+            if depth == 1:
+                member = token
+            elif member == '"resource"' and token == '"resourceType"' and resource_type is None:
+                value = _RESOURCE_TYPE.match(text, start)
+                resource_type = value.group(1) if value else None
+        elif char in '{[':
+            depth += 1
+            pos = start + 1
+        else:
+            depth -= 1
+            pos = start + 1
+            if depth == 0:
+                return pos, resource_type
+
+
+def _load_entries(text: str, pos: int, supported: Collection[str], on_skip: Callable[[str], None]):
+    """Decode the Bundle entry array at pos, leaving out entries of unsupported resource types."""
+    entries = []
+    pos = _skip_whitespace(text, pos + 1)
+    while text[pos] != ']':
+        # Entries in the usual layout give their resource type away in a single
+        # regex match; any other layout is scanned to find it
+        leading = _ENTRY_RESOURCE_TYPE.match(text, pos)
+        resource_type = leading.group(1) if leading is not None else None
+        if resource_type == "Bundle":
+            # Nested Bundles are always descended into, and filtered the same way
+            entry, pos = _load_object(text, pos, supported, on_skip, bundle_member="resource")
+            entries.append(entry)
+        elif resource_type is not None and resource_type in supported:
+            entry, pos = _decoder.raw_decode(text, pos)
+            entries.append(entry)
+        else:
+            end, resource_type = _scan_entry(text, pos)
+            if resource_type == "Bundle":
+                entries.append(_load_object(text, pos, supported, on_skip, bundle_member="resource")[0])
+            elif resource_type is None or resource_type in supported:
+                entries.append(json_codec.loads(text[pos:end]))
+            else:
+                on_skip(resource_type)
+            pos = end
+        pos = _skip_whitespace(text, pos)
+        if text[pos] == ',':
+            pos = _skip_whitespace(text, pos + 1)
+    return entries, pos + 1
+
+
+def _load_object(
+    text: str,
+    pos: int,
+    supported: Collection[str],
+    on_skip: Callable[[str], None],
+    bundle_member: Optional[str] = None
+):
+    """
+    Decode the Bundle or Bundle entry object at pos member by member.
+
+    The entry array of a Bundle goes through _load_entries; every other
+    member is decoded as it is, except bundle_member.
+
+    Args:
+        bundle_member: Member holding a Bundle to decode the same way
+            ("resource" of an entry whose resource is a Bundle)
+
+    Returns:
+        (decoded object, position after it)
+    """
+    decoded = {}
+    pos = _skip_whitespace(text, pos) + 1
+    while True:
+        pos = _skip_whitespace(text, pos)
+        if text[pos] == '}':
+            return decoded, pos + 1
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = _skip_whitespace(text, pos) + 1  # ':'
+        pos = _skip_whitespace(text, pos)
+
+        if key == "entry" and text[pos] == '[':
+            decoded[key], pos = _load_entries(text, pos, supported, on_skip)
+        elif key == bundle_member and text[pos] == '{':
+            decoded[key], pos = _load_object(text, pos, supported, on_skip)
+        else:
+            decoded[key], pos = _decoder.raw_decode(text, pos)
+
+        pos = _skip_whitespace(text, pos)
+        if text[pos] == ',':
+            pos += 1
+
+
+def load_resources(
+    text: str,
+    supported: Collection[str],
+    on_skip: Optional[Callable[[str], None]] = None
+) -> Any:
+    """
+    Decode a FHIR JSON document without materialising resources that are not supported.
+
+    Documents whose resource types are all supported are decoded in a single
+    call of the JSON backend. Otherwise a resource of an unsupported type (Binary,
+    DocumentReference, ...) is recognised by its resourceType and skipped in
+    the raw text: a whole document if it is the top-level resource, or its
+    entry if it is part of a Bundle (at any depth of nested Bundles).
+
+    This only avoids materialising skipped resources: the document itself is
+    passed in, and held, as one string.
+
+    Args:
+        text: JSON document
+        supported: Resource types that are kept ("Bundle" is always read)
+        on_skip: Called with the resource type of every skipped resource
+
+    Returns:
+        The decoded document (Bundles without the skipped entries), or None
+        if the document itself is an unsupported resource
+    """
+    on_skip = on_skip or (lambda resource_type: None)
+    resource_types = set(_RESOURCE_TYPE.findall(text))
+    if resource_types <= set(supported) | {"Bundle"}:
+        return json_codec.loads(text)
+
+    leading = _LEADING_RESOURCE_TYPE.match(text)
+    if leading is None:
+        return json_codec.loads(text)
+    if leading.group(1) == "Bundle":
+        return _load_object(text, 0, supported, on_skip)[0]
+    if leading.group(1) not in supported:
+        on_skip(leading.group(1))
+        return None
+    return json_codec.loads(text)
+
+
+class _StreamWindow:
+    """
+    Window over a text file that the streaming Bundle reader walks through.
+
+    Only the unread part of the window is kept when more text is read in, so
+    memory follows the largest entry rather than the file.
+    """
+
+    def __init__(self, f: IO[str], chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """Read more text, at least as much as is unread so rescans stay linear; False at end of file."""
+        chunk = self.f.read(max(self.chunk_size, len(self.text) - self.pos))
+        if not chunk:
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ('' at end of file)."""
+        while True:
+            self.pos = _skip_whitespace(self.text, self.pos)
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in Bundle")
+        self.pos += 1
+
+    def decode(self) -> Any:
+        """Decode the JSON value at the next non-whitespace position."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the window may continue in the next chunk:
+            # a value is only complete once something follows it
+            if _skip_whitespace(self.text, end) < len(self.text) or not self.fill():
+                self.pos = end
+                return value
+
+    def scan_entry(self):
+        """End of the Bundle entry at the current position and the resourceType of its resource (see _scan_entry)."""
+        while True:
+            try:
+                return _scan_entry(self.text, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+
+
+def _stream_entries(
+    window: _StreamWindow,
+    supported: Collection[str],
+    on_skip: Callable[[str], None]
+) -> Iterator[Dict[str, Any]]:
+    window.expect("{")
+    while True:
+        char = window.peek()
+        if char == "}":
+            return
+        if char == ",":
+            window.pos += 1
+            continue
+        if char == "":
+            raise ValueError("Unterminated Bundle")
+
+        key = window.decode()
+        window.expect(":")
+        if key != "entry" or window.peek() != "[":
+            # Other Bundle members are not needed to collect the resources
+            window.decode()
+            continue
+
+        window.pos += 1
+        while True:
+            char = window.peek()
+            if char == "]":
+                window.pos += 1
+                break
+            if char == ",":
+                window.pos += 1
+                continue
+            if char == "":
+                raise ValueError("Unterminated Bundle entry array")
+
+            leading = _ENTRY_RESOURCE_TYPE.match(window.text, window.pos)
+            if leading is not None and leading.group(1) != "Bundle" and leading.group(1) in supported:
+                yield window.decode()
+                continue
+
+            # Read after the scan, which may have moved the window
+            end, resource_type = window.scan_entry()
+            text, start, window.pos = window.text, window.pos, end
+            if resource_type == "Bundle":
+                # A nested Bundle is decoded as one entry, filtered the same way
+                yield _load_object(text, start, supported, on_skip, bundle_member="resource")[0]
+            elif resource_type is None or resource_type in supported:
+                yield json_codec.loads(text[start:end])
+            else:
+                on_skip(resource_type)
+
+
+def iter_bundle_entries(
+    f: IO[str],
+    supported: Collection[str],
+    on_skip: Optional[Callable[[str], None]] = None,
+    chunk_size: int = _STREAM_CHUNK_SIZE
+) -> Optional[Iterator[Dict[str, Any]]]:
+    """
+    Decode the entries of a Bundle file one at a time, without reading the whole file.
+
+    Entries are filtered like in load_resources. Only the entry being
+    decoded, and the unread rest of the current chunk, are held in memory;
+    a nested Bundle is one entry, so it is held as a whole.
+
+    Args:
+        f: Text file positioned at its start
+        supported: Resource types that are kept ("Bundle" is always read)
+        on_skip: Called with the resource type of every skipped resource
+        chunk_size: Characters read at a time
+
+    Returns:
+        Iterator over the decoded entries, or None (with f back at its start)
+        if the document is not a Bundle with resourceType as its first member
+    """
+    on_skip = on_skip or (lambda resource_type: None)
+    window = _StreamWindow(f, chunk_size)
+    while len(window.text) < 256 and window.fill():
+        pass
+    leading = _LEADING_RESOURCE_TYPE.match(window.text)
+    if leading is None or leading.group(1) != "Bundle":
+        f.seek(0)
+        return None
+    return _stream_entries(window, supported, on_skip)
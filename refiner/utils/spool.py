@@ -0,0 +1,173 @@
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from refiner.utils import json_codec
+from refiner.utils.reference import ReferenceIndex
+
+# Rows fetched from the spool per round trip
+_FETCH_SIZE = 1000
+
+
+class ResourceSpool:
+    """
+    Pending resources and their deduplication keys, kept in a temporary SQLite file.
+
+    Used instead of in-memory lists and sets when a refinement runs under a
+    memory budget: resources are written out as they are read and read back
+    in input order when they are transformed, so only the current batch is
+    held in memory. The Bundle fullUrls read along with them are indexed in
+    the same file (see references).
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Args:
+            directory: Where the temporary file is created (the system temp dir by default)
+        """
+        fd, self.path = tempfile.mkstemp(prefix="refiner-spool-", suffix=".sqlite", dir=directory)
+        os.close(fd)
+        self.connection = sqlite3.connect(self.path)
+        # Scratch data: no fsync and a small page cache. The journal stays (on disk), as
+        # input_file() rolls back the resources of a file that fails to read.
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("PRAGMA cache_size = -2048")
+        self.connection.execute(
+            "CREATE TABLE resource ("
+            "seq INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, "
+            "file TEXT NOT NULL, ordinal INTEGER NOT NULL, body TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE reference ("
+            "seq INTEGER PRIMARY KEY, full_url TEXT NOT NULL UNIQUE, type TEXT NOT NULL, id TEXT NOT NULL)"
+        )
+        self.count = 0
+        # fullUrl index of the spooled Bundles
+        self.references = SpooledReferenceIndex(self.path, self.connection)
+
+    def add(self, key: str, filename: str, ordinal: int, resource: Dict[str, Any]) -> bool:
+        """
+        Spool a resource unless one with the same key was spooled before.
+
+        Args:
+            key: Deduplication key ("ResourceType/id")
+            filename: Input file the resource comes from
+            ordinal: Position of the resource among the spooled resources of its file
+            resource: Raw FHIR resource data
+
+        Returns:
+            Whether the resource was new
+        """
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO resource (key, file, ordinal, body) VALUES (?, ?, ?, ?)",
+            (key, filename, ordinal, json_codec.dumps(resource))
+        )
+        if cursor.rowcount == 1:
+            self.count += 1
+            return True
+        return False
+
+    @contextmanager
+    def input_file(self) -> Iterator[None]:
+        """
+        Spool the resources and fullUrls of one input file as a unit.
+
+        If the block raises, e.g. because the file turns out to be malformed
+        halfway through, everything it spooled is removed again.
+        """
+        count = self.count
+        self.connection.execute("SAVEPOINT input_file")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK TO input_file")
+            self.connection.execute("RELEASE input_file")
+            self.count = count
+            raise
+        self.connection.execute("RELEASE input_file")
+
+    def flush(self) -> None:
+        """Commit what was spooled and hand SQLite's cache memory back."""
+        self.connection.commit()
+        self.connection.execute("PRAGMA shrink_memory")
+
+    def __iter__(self) -> Iterator[Tuple[str, int, Dict[str, Any]]]:
+        """(filename, ordinal, resource) of every spooled resource, in the order they were added."""
+        self.connection.commit()
+        cursor = self.connection.execute("SELECT file, ordinal, body FROM resource ORDER BY seq")
+        while True:
+            rows = cursor.fetchmany(_FETCH_SIZE)
+            if not rows:
+                return
+            for filename, ordinal, body in rows:
+                yield filename, ordinal, json_codec.loads(body)
+
+    def close(self) -> None:
+        """Close and delete the spool."""
+        self.connection.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SpooledReferenceIndex(ReferenceIndex):
+    """
+    ReferenceIndex kept in the reference table of a ResourceSpool instead of in memory.
+
+    A process_parallel worker opens the spool read-only (see for_worker);
+    fullUrls it indexes itself, from nested Bundles, are kept in memory
+    there as in ReferenceIndex and handed back through entries().
+    """
+
+    def __init__(self, path: str, connection: Optional[sqlite3.Connection] = None):
+        """
+        Args:
+            path: Spool file
+            connection: Writable connection of the spool; the file is opened
+                read-only when None
+        """
+        super().__init__()
+        self.path = path
+        self._writable = connection is not None
+        if connection is None:
+            connection = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+        self.connection = connection
+
+    def __reduce__(self):
+        # A connection cannot be pickled; the receiving process opens the file itself
+        return SpooledReferenceIndex, (self.path,)
+
+    def for_worker(self) -> "SpooledReferenceIndex":
+        # A forked worker must not use the connection it inherited
+        return SpooledReferenceIndex(self.path) if self._writable else self
+
+    def _stored(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM reference").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._stored() + len(self._targets)
+
+    def add(self, full_url: str, resource_type: str, resource_id: str) -> None:
+        if not self._writable:
+            super().add(full_url, resource_type, resource_id)
+            return
+        self.connection.execute(
+            "INSERT INTO reference (full_url, type, id) VALUES (?, ?, ?) "
+            "ON CONFLICT (full_url) DO UPDATE SET type = excluded.type, id = excluded.id",
+            (full_url, resource_type, resource_id)
+        )
+
+    def entries(self, start: int = 0) -> List[Tuple[str, str, str]]:
+        stored = self.connection.execute(
+            "SELECT full_url, type, id FROM reference ORDER BY seq LIMIT -1 OFFSET ?", (start,)
+        ).fetchall()
+        return stored + super().entries(max(0, start - self._stored()))
+
+    def _lookup(self, full_url: str) -> Optional[Tuple[str, str]]:
+        target = self._targets.get(full_url)
+        if target is not None:
+            return target
+        row = self.connection.execute("SELECT type, id FROM reference WHERE full_url = ?", (full_url,)).fetchone()
+        return tuple(row) if row is not None else None
@@ -0,0 +1,158 @@
+import csv
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+
+# Codes looked up per query, below SQLite's bound-parameter limit
+_LOOKUP_CHUNK = 500
+
+_SQLITE_HEADER = b"SQLite format 3\x00"
+
+
+def build_terminology_index(source_path: str, index_path: str) -> int:
+    """
+    Build a terminology index file from a tab-separated concept list.
+
+    Each line of the source holds code, display and (optionally) ingredient,
+    separated by tabs; lines starting with '#' are ignored. A code listed
+    twice keeps its first entry.
+
+    Args:
+        source_path: Tab-separated concept file
+        index_path: SQLite file to write (replaced if it exists)
+
+    Returns:
+        Number of concepts in the index
+    """
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    connection = sqlite3.connect(index_path)
+    try:
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        # Clustered on the code, so a lookup touches a single B-tree
+        connection.execute(
+            "CREATE TABLE concept (code TEXT PRIMARY KEY, display TEXT NOT NULL, ingredient TEXT) WITHOUT ROWID"
+        )
+        with open(source_path, newline="", encoding="utf-8") as f:
+            rows = (
+                (row[0].strip(), row[1].strip(), (row[2].strip() or None) if len(row) > 2 else None)
+                for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+                if len(row) >= 2 and row[0].strip() and not row[0].startswith("#")
+            )
+            connection.executemany("INSERT OR IGNORE INTO concept VALUES (?, ?, ?)", rows)
+        connection.commit()
+        count = connection.execute("SELECT COUNT(*) FROM concept").fetchone()[0]
+    finally:
+        connection.close()
+    logger.info("Built terminology index %s with %d concepts", index_path, count)
+    return count
+
+
+class TerminologyIndex:
+    """
+    Read-only, memory-mapped code -> (display, ingredient) lookups for one code system.
+
+    The index is a SQLite file opened immutable with mmap covering the whole
+    file, so lookups read the page cache directly and several worker
+    processes share the same pages. A tab-separated source file is turned
+    into a temporary index when it is opened; prebuilt indexes (see
+    build_terminology_index) are used as they are.
+
+    A connection is not passed to other processes: workers open the index
+    at path themselves (see fhir_transformer._init_worker), and a temporary
+    index must outlive them.
+    """
+
+    def __init__(self, path: str, system: str = RXNORM_SYSTEM):
+        """
+        Args:
+            path: SQLite index file, or a tab-separated concept file to index
+            system: Code system of the index; codings of other systems are not enriched
+        """
+        self.source_path = path
+        self.system = system
+        self._temporary = None
+
+        with open(path, "rb") as f:
+            is_index = f.read(len(_SQLITE_HEADER)) == _SQLITE_HEADER
+        if is_index:
+            self.path = path
+        else:
+            fd, self.path = tempfile.mkstemp(prefix="refiner-terminology-", suffix=".sqlite")
+            os.close(fd)
+            self._temporary = self.path
+            build_terminology_index(path, self.path)
+
+        uri = f"{Path(self.path).resolve().as_uri()}?mode=ro&immutable=1"
+        self.connection = sqlite3.connect(uri, uri=True)
+        self.connection.execute(f"PRAGMA mmap_size = {os.path.getsize(self.path)}")
+
+    def lookup(self, codes: Iterable[str]) -> Dict[str, Tuple[str, Optional[str]]]:
+        """
+        (display, ingredient) of every code found in the index.
+
+        Args:
+            codes: Codes to look up; duplicates are looked up once
+
+        Returns:
+            Dictionary from code to (display, ingredient) for the codes found
+        """
+        unique = list(dict.fromkeys(code for code in codes if code))
+        found = {}
+        for start in range(0, len(unique), _LOOKUP_CHUNK):
+            chunk = unique[start:start + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for code, display, ingredient in self.connection.execute(
+                f"SELECT code, display, ingredient FROM concept WHERE code IN ({placeholders})", chunk
+            ):
+                found[code] = (display, ingredient)
+        return found
+
+    def enrich(self, rows: List) -> int:
+        """
+        Fill in missing displays and the ingredients of medication rows, with one batched lookup.
+
+        Rows coded in another system are left alone; rows without a system
+        are assumed to be in this index's system.
+
+        Args:
+            rows: MedicationRow records
+
+        Returns:
+            Number of rows enriched
+        """
+        rows = [row for row in rows if row.code and (not row.system or row.system == self.system)]
+        concepts = self.lookup(row.code for row in rows)
+        enriched = 0
+        for row in rows:
+            concept = concepts.get(row.code)
+            if concept is None:
+                continue
+            display, ingredient = concept
+            if not row.display:
+                row.display = display
+            row.ingredient = ingredient
+            enriched += 1
+        return enriched
+
+    def close(self) -> None:
+        """Close the index, deleting it if it was built from a source file."""
+        self.connection.close()
+        if self._temporary and os.path.exists(self._temporary):
+            os.remove(self._temporary)
+
+
+# Prebuild an index with: python -m refiner.utils.terminology <concepts.tsv> <index.sqlite>
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_terminology_index(sys.argv[1], sys.argv[2])
@@ -0,0 +1,134 @@
+"""
+Long-lived refinement worker.
+
+Keeps one interpreter warm (imports, SQLAlchemy mappers, pgpy) and runs
+refinement jobs back to back. Jobs are JSON objects, one per line, read from
+stdin or from a Unix domain socket; one JSON result line is written back per
+job.
+
+Each job gets its own copy of the settings, so input/output directories and
+encryption keys never carry over from one job to the next.
+
+Run with: python -m refiner.worker [--socket /tmp/refiner.sock]
+"""
+import argparse
+import json
+import logging
+import os
+import socketserver
+import sys
+import traceback
+from typing import Any, Dict, IO, Optional
+
+from pydantic import BaseModel, Field
+
+from refiner.config import Settings, settings
+from refiner.jobs import run_job, write_error_output
+
+
+class Job(BaseModel):
+    """A single refinement request."""
+    id: Optional[str] = Field(None, description="Caller supplied identifier echoed back in the result")
+    input_dir: str = Field(..., description="Directory containing the input files of this job")
+    output_dir: str = Field(..., description="Directory the refinement outputs of this job are written to")
+    encryption_key: str = Field(..., description="Key to symmetrically encrypt this job's refinement")
+
+
+def job_settings(job: Job, base: Settings = settings) -> Settings:
+    """Build an isolated Settings copy for a job; the base settings are never mutated."""
+    return base.model_copy(update={
+        "INPUT_DIR": job.input_dir,
+        "OUTPUT_DIR": job.output_dir,
+        "REFINEMENT_ENCRYPTION_KEY": job.encryption_key,
+    })
+
+
+def warm_up() -> None:
+    """Load the heavy dependencies once so that no job pays for them."""
+    from sqlalchemy.orm import configure_mappers
+    from refiner.transformer.fhir_transformer import FHIRTransformer  # noqa: F401
+    from refiner.utils.encrypt import _load_pgpy
+    from refiner.utils.schema import cached_schema
+    import requests  # noqa: F401
+
+    configure_mappers()
+    # Generated once here, every job's schema is then served from the cache
+    cached_schema(FHIRTransformer.model_bases)
+    _load_pgpy()
+    logging.info("Worker warmed up")
+
+
+def handle_line(line: str) -> Dict[str, Any]:
+    """
+    Run the job described by one JSON line.
+
+    Args:
+        line: JSON encoded Job
+
+    Returns:
+        Result dict with the job id, a status and either the output or the error
+    """
+    try:
+        job = Job.model_validate_json(line)
+    except Exception as e:
+        return {"id": None, "status": "error", "error": f"Invalid job: {e}"}
+
+    try:
+        output = run_job(job_settings(job))
+        return {"id": job.id, "status": "ok", "output": output.model_dump()}
+    except Exception as e:
+        logging.error(f"Error during job {job.id}: {e}")
+        traceback.print_exc()
+        write_error_output(job.output_dir, e)
+        return {"id": job.id, "status": "error", "error": str(e)}
+
+
+def serve_stream(reader: IO[str], writer: IO[str]) -> None:
+    """Run jobs read line by line from reader until EOF, writing one result line per job."""
+    for line in reader:
+        if not line.strip():
+            continue
+        writer.write(json.dumps(handle_line(line)) + "\n")
+        writer.flush()
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for raw_line in self.rfile:
+            line = raw_line.decode()
+            if not line.strip():
+                continue
+            self.wfile.write((json.dumps(handle_line(line)) + "\n").encode())
+            self.wfile.flush()
+
+
+def serve_socket(path: str) -> None:
+    """
+    Accept jobs on a Unix domain socket.
+
+    Connections are served one at a time so jobs never run concurrently
+    within the worker process.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.UnixStreamServer(path, _JobHandler) as server:
+        logging.info(f"Worker listening on {path}")
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run refinement jobs in a warm worker process")
+    parser.add_argument("--socket", default=None, help="Unix socket path to listen on (defaults to stdin/stdout)")
+    args = parser.parse_args()
+
+    # Results go to stdout, so logs must not
+    logging.basicConfig(level=settings.LOG_LEVEL, format='%(message)s', stream=sys.stderr)
+    warm_up()
+
+    if args.socket:
+        serve_socket(args.socket)
+    else:
+        serve_stream(sys.stdin, sys.stdout)
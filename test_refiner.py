@@ -2,6 +2,7 @@ import os
 import json
 import shutil
 import pytest
+from benchmarks.regression import load_baseline
 from refiner.refine import Refiner
 from refiner.config import settings
 
@@ -215,4 +216,1088 @@ def test_refiner_schema_structure(setup_test_environment):
     column_names = [col["name"] for col in medication_table["columns"]]
     expected_columns = ["id", "patient_id", "resource_type", "code", "display", "system", "text"]
     for col in expected_columns:
-        assert col in column_names, f"Medication table should have {col} column"
\ No newline at end of file
+        assert col in column_names, f"Medication table should have {col} column"
+
+# Modules that must stay out of the cold start path until they are needed
+LAZY_MODULES = ("pgpy", "cryptography", "sqlalchemy", "requests")
+
+# Cumulative import budget for refiner.refine, in microseconds
+IMPORT_TIME_BUDGET_US = 500_000
+
+def test_refiner_import_is_lazy():
+    """Test that importing the refiner does not load heavy dependencies and stays within budget."""
+    import subprocess
+    import sys
+
+    env = dict(os.environ, REFINEMENT_ENCRYPTION_KEY=os.environ.get("REFINEMENT_ENCRYPTION_KEY", "0x1234"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import sys, refiner.refine; print(','.join(m for m in %r if m in sys.modules))" % (LAZY_MODULES,)],
+        capture_output=True, text=True, env=env, check=True
+    )
+
+    assert result.stdout.strip() == "", f"Eagerly imported: {result.stdout.strip()}"
+
+    # -X importtime lines look like: "import time:  self [us] | cumulative | imported package"
+    cumulative = next(
+        int(line.split("|")[1])
+        for line in result.stderr.splitlines()
+        if line.rstrip().endswith("| refiner.refine")
+    )
+    assert cumulative < IMPORT_TIME_BUDGET_US, f"Importing refiner.refine took {cumulative} us"
+
+def test_worker_isolates_jobs(setup_test_environment, tmp_path):
+    """Test that back-to-back worker jobs keep their own directories and keys."""
+    import io
+    from benchmarks.storage import local_storage
+    from refiner.worker import serve_stream
+
+    original_key = settings.REFINEMENT_ENCRYPTION_KEY
+    jobs = [
+        {"id": "job-1", "input_dir": "test_input", "output_dir": str(tmp_path / "out-1"), "encryption_key": "key-1"},
+        {"id": "job-2", "input_dir": "test_input", "output_dir": str(tmp_path / "out-2"), "encryption_key": "key-2"},
+        {"id": "job-3", "input_dir": str(tmp_path / "missing"), "output_dir": str(tmp_path / "out-3"), "encryption_key": "key-3"},
+    ]
+    reader = io.StringIO("".join(json.dumps(job) + "\n" for job in jobs))
+    writer = io.StringIO()
+
+    with local_storage(str(tmp_path / "ipfs")):
+        serve_stream(reader, writer)
+
+    results = [json.loads(line) for line in writer.getvalue().splitlines()]
+    assert [result["status"] for result in results] == ["ok", "ok", "error"]
+    for job in jobs:
+        assert os.path.exists(os.path.join(job["output_dir"], "output.json"))
+    assert os.path.exists(tmp_path / "out-1" / "db.libsql")
+    assert os.path.exists(tmp_path / "out-2" / "db.libsql")
+
+    # The global settings are never touched by a job
+    assert settings.OUTPUT_DIR == "test_output"
+    assert settings.REFINEMENT_ENCRYPTION_KEY == original_key
+
+def test_batch_refines_each_contribution(setup_test_environment, tmp_path):
+    """Test that a batch manifest produces one database and output.json per job plus a report."""
+    import zipfile
+    from benchmarks.storage import local_storage
+    from refiner.batch import load_manifest, run_batch
+
+    archive = tmp_path / "contribution.zip"
+    with zipfile.ZipFile(archive, "w") as zip_ref:
+        zip_ref.write("test_input/bundle.json", "bundle.json")
+
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text("\n".join(json.dumps(job) for job in [
+        {"input_dir": "test_input", "output_dir": str(tmp_path / "out-dir"), "encryption_key": "key-1"},
+        {"input_dir": str(archive), "output_dir": str(tmp_path / "out-zip"), "encryption_key": "key-2"},
+    ]))
+
+    with local_storage(str(tmp_path / "ipfs")):
+        report = run_batch(load_manifest(str(manifest)), workers=1)
+
+    assert report["jobs"] == 2
+    assert report["succeeded"] == 2, report
+    for result in report["results"]:
+        assert os.path.exists(os.path.join(result["output_dir"], "db.libsql"))
+        assert os.path.exists(os.path.join(result["output_dir"], "output.json"))
+
+def test_batch_refines_in_worker_processes(setup_test_environment, tmp_path):
+    """Test that a batch run across a process pool refines every job, uploading through the worker's storage stub."""
+    from benchmarks.storage import install_local_storage
+    from refiner.batch import load_manifest, run_batch
+
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps([
+        {"id": f"c-{i}", "input_dir": "test_input", "output_dir": str(tmp_path / f"out-{i}"), "encryption_key": f"key-{i}"}
+        for i in range(3)
+    ] + [
+        {"id": "missing", "input_dir": str(tmp_path / "missing"), "output_dir": str(tmp_path / "out-missing"),
+         "encryption_key": "key-x"}
+    ]))
+
+    ipfs_root = tmp_path / "ipfs"
+    report = run_batch(
+        load_manifest(str(manifest)), workers=2, initializer=install_local_storage, initargs=(str(ipfs_root),)
+    )
+
+    assert report["workers"] == 2
+    assert [result["id"] for result in report["results"]] == ["c-0", "c-1", "c-2", "missing"]
+    assert [result["status"] for result in report["results"]] == ["ok", "ok", "ok", "error"]
+    for result in report["results"][:3]:
+        assert os.path.exists(os.path.join(result["output_dir"], "db.libsql"))
+        # The manifest was uploaded into the stub installed in the worker, not to Pinata
+        assert (ipfs_root / result["refinement_url"].rsplit("/", 1)[-1]).exists()
+    assert os.path.exists(tmp_path / "out-missing" / "output.json")
+
+def test_progress_log_aggregates_events(caplog):
+    """Test that hot-path events are counted and summarised instead of logged one by one."""
+    import logging
+    from refiner.utils.progress import ProgressLog
+
+    logger = logging.getLogger("test_progress")
+    progress = ProgressLog(logger, "transform", interval=3600, sample_every=0)
+
+    with caplog.at_level(logging.DEBUG, logger="test_progress"):
+        for i in range(5000):
+            progress.record("Patient", "transformed", f"p-{i}")
+        progress.record("medication", "duplicate", "m-1")
+        progress.log_summary(final=True)
+
+    assert progress.count("transformed", "Patient") == 5000
+    assert progress.count("duplicate") == 1
+    assert len(caplog.records) == 1
+    assert "Patient transformed=5000" in caplog.records[0].getMessage()
+
+def test_progress_log_limits_errors_and_uses_refiner_settings(tmp_path, caplog):
+    """Test that failures are only logged up to the limit, and that ProgressLog follows the Refiner's settings."""
+    import logging
+    from refiner.utils.progress import ProgressLog
+
+    logger = logging.getLogger("test_progress")
+    progress = ProgressLog(logger, "transform", interval=3600, sample_every=0)
+
+    with caplog.at_level(logging.ERROR, logger="test_progress"):
+        for i in range(100):
+            progress.record_error("Patient", ValueError("bad name"), f"p-{i}")
+        progress.record_error("Observation", ValueError("bad code"), "o-1")
+
+    assert progress.count("failed", "Patient") == 100
+    messages = [record.getMessage() for record in caplog.records]
+    assert sum("Error transforming Patient" in m for m in messages) == ProgressLog.error_log_limit
+    assert sum("only counted" in m for m in messages) == 1
+    assert sum("Error transforming Observation" in m for m in messages) == 1
+
+    config = settings.model_copy(update={"LOG_PROGRESS_INTERVAL": 42.0, "LOG_SAMPLE_EVERY": 7})
+    transformer = Refiner(config)._create_transformer(str(tmp_path / "db.libsql"))
+    for log in (transformer.progress, transformer.save_progress):
+        assert (log.interval, log.sample_every) == (42.0, 7)
+
+def test_in_memory_build_persists_and_spills(tmp_path):
+    """Test that in-memory builds are written to db_path, and move to disk once over budget."""
+    import sqlite3
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+
+    resources = [
+        {"resourceType": "Patient", "id": f"p-{i}", "name": [{"family": "Smith", "given": ["John"]}]}
+        for i in range(50)
+    ]
+
+    db_path = str(tmp_path / "memory.libsql")
+    transformer = FHIRTransformer(db_path, in_memory=True)
+    transformer.process(resources)
+    assert not os.path.exists(db_path)
+    transformer.finalize()
+    assert sqlite3.connect(db_path).execute("SELECT COUNT(*) FROM patient").fetchone()[0] == 50
+
+    db_path = str(tmp_path / "spilled.libsql")
+    transformer = FHIRTransformer(db_path, in_memory=True, max_memory_bytes=1)
+    transformer.commit_batch_size = 10
+    transformer.process(resources)
+    assert not transformer.in_memory
+    transformer.finalize()
+    assert sqlite3.connect(db_path).execute("SELECT COUNT(*) FROM patient").fetchone()[0] == 50
+
+def test_deterministic_build_is_byte_identical(tmp_path):
+    """Test that deterministic builds of the same resources in a different order give identical files."""
+    import hashlib
+    import random
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+
+    resources = []
+    for i in range(30):
+        resources.append({
+            "resourceType": "Patient",
+            "id": f"p-{i}",
+            "name": [{"use": "official", "family": "Smith", "given": ["John", "Q"]}],
+            "telecom": [{"system": "phone", "value": f"555-{i:04d}"}]
+        })
+        resources.append({
+            "resourceType": "MedicationStatement",
+            "id": f"m-{i}",
+            "subject": {"reference": f"Patient/p-{i}"},
+            "medicationCodeableConcept": {"coding": [{"system": "rxnorm", "code": "1049502", "display": "Acetaminophen"}]}
+        })
+
+    digests = set()
+    for run, (in_memory, batch_size) in enumerate([(False, 60), (False, 60), (True, 60), (False, 13)]):
+        shuffled = list(resources)
+        random.Random(run).shuffle(shuffled)
+        db_path = str(tmp_path / f"run-{run}.libsql")
+        transformer = FHIRTransformer(db_path, in_memory=in_memory, deterministic=True)
+        transformer.commit_batch_size = 7
+        # Rows are sorted across process() calls, not only within each
+        for start in range(0, len(shuffled), batch_size):
+            transformer.process(shuffled[start:start + batch_size])
+        transformer.finalize()
+        transformer.engine.dispose()
+        with open(db_path, "rb") as f:
+            digests.add(hashlib.sha256(f.read()).hexdigest())
+
+    assert len(digests) == 1
+
+def test_sharded_output(setup_test_environment, tmp_path):
+    """Test that sharded output keeps each patient's rows together and lists every shard."""
+    import sqlite3
+    from benchmarks.storage import local_storage
+    from refiner.utils.shard import shard_index
+
+    for i in range(20):
+        with open(f"test_input/patient-{i}.json", "w") as f:
+            json.dump({"resourceType": "Patient", "id": f"p-{i}", "name": [{"family": "Doe", "given": ["Jane"]}]}, f)
+        with open(f"test_input/medication-{i}.json", "w") as f:
+            json.dump({
+                "resourceType": "MedicationStatement",
+                "id": f"m-{i}",
+                "subject": {"reference": f"Patient/p-{i}"},
+                "medicationCodeableConcept": {"coding": [{"code": "1049502", "display": "Acetaminophen"}]}
+            }, f)
+
+    config = settings.model_copy(update={"OUTPUT_SHARDS": 3})
+    with local_storage(str(tmp_path / "ipfs")):
+        output = Refiner(config).transform()
+
+    assert [shard.index for shard in output.shards] == [0, 1, 2]
+    assert sum(shard.resource_count for shard in output.shards) == 42
+
+    patients = 0
+    for shard in output.shards:
+        conn = sqlite3.connect(os.path.join("test_output", f"db.shard-{shard.index:03d}.libsql"))
+        for (patient_id,) in conn.execute("SELECT id FROM patient"):
+            assert shard_index(patient_id, 3) == shard.index
+            patients += 1
+        for (patient_id,) in conn.execute("SELECT patient_id FROM medication"):
+            assert shard_index(patient_id, 3) == shard.index
+        conn.close()
+    assert patients == 21
+
+    with open(os.path.join("test_output", "output.json")) as f:
+        assert len(json.load(f)["shards"]) == 3
+
+def test_parallel_writers_match_single_writer(tmp_path):
+    """Test that per-worker databases merged via ATTACH equal a single-writer build."""
+    import hashlib
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+
+    resources = []
+    for i in range(40):
+        resources.append({"resourceType": "Patient", "id": f"p-{i}", "name": [{"family": "Doe", "given": ["Jane"]}]})
+        resources.append({
+            "resourceType": "MedicationStatement",
+            "id": f"m-{i % 30}",  # Later duplicates must lose against the first occurrence
+            "subject": {"reference": f"Patient/p-{i}"},
+            "medicationCodeableConcept": {"coding": [{"code": "1049502", "display": "Acetaminophen"}]}
+        })
+
+    digests = []
+    for name, workers in [("serial", 1), ("parallel", 3)]:
+        db_path = str(tmp_path / f"{name}.libsql")
+        transformer = FHIRTransformer(db_path, deterministic=True)
+        transformer.parallel_min_chunk = 1
+        transformer.process_parallel(resources, workers)
+        transformer.finalize()
+        transformer.engine.dispose()
+        with open(db_path, "rb") as f:
+            digests.append(hashlib.sha256(f.read()).hexdigest())
+
+    assert digests[0] == digests[1]
+
+    import sqlite3
+    conn = sqlite3.connect(str(tmp_path / "parallel.libsql"))
+    assert conn.execute("SELECT patient_id FROM medication WHERE id = 'm-5'").fetchone()[0] == "p-5"
+    assert conn.execute("SELECT COUNT(*) FROM medication").fetchone()[0] == 30
+    conn.close()
+
+def test_aggregate_tables(tmp_path):
+    """Test that the optional rollup tables are materialised and declared in the schema."""
+    import sqlite3
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+
+    resources = [
+        {"resourceType": "Patient", "id": "p-1", "name": [{"family": "Doe", "given": ["Jane"]}]},
+        {"resourceType": "Patient", "id": "p-2", "name": [{"family": "Roe", "given": ["Rick"]}]},
+    ]
+    for i, (patient_id, code) in enumerate([("p-1", "A"), ("p-1", "A"), ("p-1", "B"), ("p-2", "A")]):
+        resources.append({
+            "resourceType": "MedicationStatement",
+            "id": f"m-{i}",
+            "subject": {"reference": f"Patient/{patient_id}"},
+            "medicationCodeableConcept": {"coding": [{"system": "rxnorm", "code": code, "display": f"Drug {code}"}]}
+        })
+
+    db_path = str(tmp_path / "aggregates.libsql")
+    transformer = FHIRTransformer(db_path, aggregates=True)
+    transformer.process(resources)
+    transformer.finalize()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute(
+        "SELECT code, medication_count, patient_count FROM medication_code_counts ORDER BY code"
+    ).fetchall() == [("A", 3, 2), ("B", 1, 1)]
+    assert conn.execute(
+        "SELECT patient_id, medication_count FROM patient_medication_counts ORDER BY patient_id"
+    ).fetchall() == [("p-1", 3), ("p-2", 1)]
+    conn.close()
+
+    tables = [table["name"] for table in transformer.get_schema()["tables"]]
+    assert "medication_code_counts" in tables and "patient_medication_counts" in tables
+
+    plain = FHIRTransformer(str(tmp_path / "plain.libsql"))
+    assert "medication_code_counts" not in [table["name"] for table in plain.get_schema()["tables"]]
+
+def test_medication_fts_index(tmp_path):
+    """Test that the FTS5 index finds medications by token and substring."""
+    import sqlite3
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+
+    resources = [
+        {
+            "resourceType": "MedicationStatement",
+            "id": f"m-{i}",
+            "subject": {"reference": "Patient/p-1"},
+            "medicationCodeableConcept": {
+                "coding": [{"system": "rxnorm", "code": code, "display": display}],
+                "text": display
+            }
+        }
+        for i, (code, display) in enumerate([
+            ("1049502", "Acetaminophen 325 MG Oral Tablet"),
+            ("197319", "Amoxicillin 500 MG Oral Capsule"),
+        ])
+    ]
+
+    db_path = str(tmp_path / "fts.libsql")
+    transformer = FHIRTransformer(db_path, in_memory=True, deterministic=True, medication_fts=True)
+    transformer.process(resources)
+    transformer.finalize()
+
+    conn = sqlite3.connect(db_path)
+    query = (
+        "SELECT medication.id, medication.code FROM medication_fts "
+        "JOIN medication ON medication.id = medication_fts.id WHERE medication_fts MATCH ?"
+    )
+    assert conn.execute(query, ("Capsule",)).fetchall() == [("m-1", "197319")]
+    assert conn.execute(query, ('"minophen"',)).fetchall() == [("m-0", "1049502")]
+
+    # The join survives a VACUUM that renumbers the medication rowids
+    conn.execute("DELETE FROM medication WHERE id = 'm-0'")
+    conn.commit()
+    conn.execute("VACUUM")
+    assert conn.execute(query, ("Capsule",)).fetchall() == [("m-1", "197319")]
+    conn.close()
+
+    assert "medication_fts" in [table["name"] for table in transformer.get_schema()["tables"]]
+
+def test_pii_masking(tmp_path):
+    """Test that patient names and telecom values are masked with a per-refinement keyed hash."""
+    import pickle
+    import sqlite3
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+    from refiner.utils.pii import PIIMasker
+
+    resources = [
+        {
+            "resourceType": "Patient",
+            "id": f"p-{i}",
+            "name": [{"use": "official", "family": "Smith", "given": ["John"]}],
+            "telecom": [
+                {"system": "email", "value": "john.smith@example.com"},
+                {"system": "phone", "value": "555-1234"}
+            ]
+        }
+        for i in range(2)
+    ]
+
+    masker = PIIMasker.for_refinement()
+    db_path = str(tmp_path / "masked.libsql")
+    transformer = FHIRTransformer(db_path, pii_masker=masker)
+    transformer.process(resources)
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT family_name, given_names, contact_info FROM patient ORDER BY id").fetchall()
+    conn.close()
+
+    assert rows[0] == rows[1]  # Same person, same tokens within a refinement
+    family_name, given_names, contact_info = rows[0]
+    assert family_name == masker.mask_value("Smith") != "Smith"
+    assert "John" not in given_names and "Smith" not in given_names
+    email, phone = json.loads(contact_info)
+    assert email["value"].endswith("@example.com") and "john.smith" not in email["value"]
+    assert phone["value"] != "555-1234"
+
+    # A random salt per refinement; a configured secret gives the same tokens on every run
+    assert PIIMasker.for_refinement().mask_value("Smith") != family_name
+    assert PIIMasker.for_refinement("salt-1").mask_value("Smith") == PIIMasker.for_refinement("salt-1").mask_value("Smith")
+    assert pickle.loads(pickle.dumps(masker)).mask_value("Smith") == family_name
+
+    # The salt is never derived from the refinement's encryption key
+    config = settings.model_copy(update={"MASK_PII": True, "REFINEMENT_ENCRYPTION_KEY": "key-1"})
+    assert Refiner(config)._pii_masker.salt != PIIMasker.for_refinement("key-1").salt
+    with pytest.raises(ValueError):
+        Refiner(config.model_copy(update={"CHECKPOINT": True}))
+    assert Refiner(config.model_copy(update={"CHECKPOINT": True, "PII_MASK_SALT": "salt-1"}))._pii_masker.salt == \
+        PIIMasker.for_refinement("salt-1").salt
+
+def test_timestamp_parsing_and_medication_dates(tmp_path):
+    """Test the FHIR date forms parse_timestamp accepts and the medication date columns."""
+    import sqlite3
+    from datetime import datetime, timezone
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+    from refiner.utils.date import parse_timestamp, parse_timestamps
+
+    assert parse_timestamp("2024-03-05") == datetime(2024, 3, 5)
+    assert parse_timestamp("2024-03-05T10:20:30Z") == datetime(2024, 3, 5, 10, 20, 30, tzinfo=timezone.utc)
+    assert parse_timestamp("2024-03") == datetime(2024, 3, 1)
+    assert parse_timestamp("2024") == datetime(2024, 1, 1)
+    assert parse_timestamps(["2024", None, "2024"]) == [datetime(2024, 1, 1), None, datetime(2024, 1, 1)]
+
+    db_path = str(tmp_path / "dates.libsql")
+    transformer = FHIRTransformer(db_path)
+    transformer.process([
+        {
+            "resourceType": "MedicationStatement",
+            "id": f"m-{i}",
+            "subject": {"reference": "Patient/p-1"},
+            "medicationCodeableConcept": {"coding": [{"code": "1049502", "display": "Acetaminophen"}]},
+            "effectiveDateTime": effective,
+            "dateAsserted": "2024-03-05T10:20:30Z"
+        }
+        for i, effective in enumerate(["2024-03-01", "not-a-date", "2024-03-05T23:30:00-05:00"])
+    ])
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT effective_date_time, date_asserted FROM medication ORDER BY id").fetchall()
+    conn.close()
+    assert rows[0][0].startswith("2024-03-01") and rows[0][1].startswith("2024-03-05 10:20:30")
+    assert rows[1][0] is None
+    # Offsets are normalised to UTC rather than dropped
+    assert rows[2][0].startswith("2024-03-06 04:30:00")
+
+def test_user_batch_matches_per_user_transform(tmp_path):
+    """Test that the columnar user batch path stores the same rows as the per-user path."""
+    import sqlite3
+    from refiner.transformer.user_transformer import UserTransformer
+
+    users = [
+        {
+            "userId": f"user-{i}",
+            "email": f"user{i}@example.com",
+            "timestamp": 1742514945802 + i,
+            "profile": {"name": f"User {i}", "locale": "en"},
+            "storage": {"percentUsed": 12.5} if i % 2 == 0 else None,
+            "metadata": {"source": "Google", "collectionDate": "2025-03-20T23:55:45.802Z", "dataType": "profile"}
+        }
+        for i in range(5)
+    ]
+
+    per_user = UserTransformer(str(tmp_path / "per-user.libsql"))
+    for user in users:
+        per_user.process(user)
+
+    batch = UserTransformer(str(tmp_path / "batch.libsql"))
+    batch.process_batch(users[:3])
+    batch.process_batch(users[3:])
+
+    queries = [
+        "SELECT * FROM users ORDER BY user_id",
+        "SELECT * FROM storage_metrics ORDER BY metric_id",
+        "SELECT * FROM auth_sources ORDER BY auth_id",
+    ]
+    per_user_conn = sqlite3.connect(str(tmp_path / "per-user.libsql"))
+    batch_conn = sqlite3.connect(str(tmp_path / "batch.libsql"))
+    for query in queries:
+        assert batch_conn.execute(query).fetchall() == per_user_conn.execute(query).fetchall()
+    per_user_conn.close()
+    batch_conn.close()
+
+def test_transform_produces_slotted_rows(tmp_path):
+    """Test that the FHIR transformer emits compact row records and writes them like before."""
+    import sqlite3
+    from refiner.models.fihr import PatientRow, MedicationRow
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+
+    resources = [
+        {"resourceType": "Patient", "id": "p1", "name": [{"family": "Smith", "given": ["John"]}]},
+        {"resourceType": "MedicationStatement", "id": "m1", "subject": {"reference": "Patient/p1"},
+         "medicationCodeableConcept": {"coding": [{"system": "rxnorm", "code": "1", "display": "Aspirin"}]}},
+        {"resourceType": "Patient", "id": "p1", "name": [{"family": "Duplicate", "given": ["Jane"]}]}
+    ]
+
+    transformer = FHIRTransformer(str(tmp_path / "db.libsql"))
+    rows = transformer.transform(resources)
+    assert [type(row) for row in rows] == [PatientRow, MedicationRow, PatientRow]
+    assert not hasattr(rows[0], "__dict__")
+    assert rows[1].resource_type == "MedicationKnowledge"
+
+    transformer.process(resources)
+    # Rows already in the database are skipped on the next run
+    transformer.process(resources)
+
+    conn = sqlite3.connect(str(tmp_path / "db.libsql"))
+    assert conn.execute("SELECT id, family_name FROM patient").fetchall() == [("p1", "Smith")]
+    assert conn.execute("SELECT id, patient_id, display FROM medication").fetchall() == [("m1", "p1", "Aspirin")]
+    conn.close()
+
+def test_checkpoint_resumes_interrupted_refinement(setup_test_environment, tmp_path, monkeypatch):
+    """Test that a rerun resumes after the last committed batch and skips completed stages."""
+    import sqlite3
+    import refiner.refine
+    from benchmarks.storage import local_storage
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+
+    with open("test_input/patients.json", "w") as f:
+        json.dump({"resourceType": "Bundle", "entry": [
+            {"resource": {"resourceType": "Patient", "id": f"p-{i}", "name": [{"family": "Doe", "given": ["Jane"]}]}}
+            for i in range(10)
+        ]}, f)
+
+    config = settings.model_copy(update={"CHECKPOINT": True})
+    monkeypatch.setattr(FHIRTransformer, "commit_batch_size", 3)
+
+    # First run dies after two committed batches of patients.json
+    processed = []
+    original_process = FHIRTransformer.process
+
+    def crash_after_two_batches(self, data):
+        if any(resource.get("id") == "p-6" for resource in data):
+            raise MemoryError("killed")
+        processed.append([resource.get("id") for resource in data])
+        original_process(self, data)
+
+    monkeypatch.setattr(FHIRTransformer, "process", crash_after_two_batches)
+    with local_storage(str(tmp_path / "ipfs")), pytest.raises(MemoryError):
+        Refiner(config).transform()
+
+    with open("test_output/checkpoint.json") as f:
+        checkpoint = json.load(f)
+    assert checkpoint["watermarks"]["patients.json"] == 6
+    assert "transformed" not in checkpoint["stages"]
+
+    # Settings that do not change the refinement keep the checkpoint
+    fingerprint = Refiner(config)._load_checkpoint().fingerprint
+    assert Refiner(config.model_copy(update={"TRANSFORM_WORKERS": 2}))._load_checkpoint().fingerprint == fingerprint
+    deterministic = config.model_copy(update={"DETERMINISTIC_OUTPUT": True})
+    assert Refiner(deterministic.model_copy(update={"TRANSFORM_WORKERS": 2}))._load_checkpoint().fingerprint != \
+        Refiner(deterministic)._load_checkpoint().fingerprint
+
+    # Second run is retried under a memory budget, continues at p-6, then dies uploading the database
+    config = config.model_copy(update={"MEMORY_BUDGET_BYTES": 2 ** 40, "SPILL_DIR": str(tmp_path)})
+    processed.clear()
+    monkeypatch.setattr(FHIRTransformer, "process", lambda self, data: (
+        processed.append([resource.get("id") for resource in data]), original_process(self, data)
+    ))
+
+    def failing_upload(path):
+        raise ConnectionError("IPFS unavailable")
+
+    with local_storage(str(tmp_path / "ipfs")):
+        monkeypatch.setattr(refiner.refine, "upload_file_to_ipfs", failing_upload)
+        with pytest.raises(ConnectionError):
+            Refiner(config).transform()
+    assert processed == [["p-6", "p-7", "p-8"], ["p-9"]]
+
+    conn = sqlite3.connect("test_output/db.libsql")
+    assert conn.execute("SELECT COUNT(*) FROM patient").fetchone()[0] == 11
+    conn.close()
+
+    with open("test_output/checkpoint.json") as f:
+        stages = json.load(f)["stages"]
+    assert {"transformed", "schema_pinned", "encrypted"} <= set(stages)
+    assert "db_pinned" not in stages
+
+    # Third run only uploads the database
+    processed.clear()
+    with local_storage(str(tmp_path / "ipfs")):
+        output = Refiner(config).transform()
+    assert processed == []
+    assert output.refinement_url
+
+def test_bundle_urn_uuid_references(tmp_path):
+    """Test that urn:uuid references of transaction Bundles resolve, also when the patient comes later."""
+    import sqlite3
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+
+    patient_url = "urn:uuid:61ebe359-bfdc-4613-8bf2-c5e300945f0a"
+    medication_bundle = {"resourceType": "Bundle", "type": "transaction", "entry": [
+        {"fullUrl": "urn:uuid:0d1b3d7e-8f1c-4b7a-9c1e-2b9f2f6c1a10", "resource": {
+            "resourceType": "MedicationStatement",
+            "id": "med-1",
+            "subject": {"reference": patient_url},
+            "medicationCodeableConcept": {"coding": [{"code": "1049502", "display": "Acetaminophen"}]}
+        }},
+        {"fullUrl": "https://example.org/fhir/MedicationStatement/med-2", "resource": {
+            "resourceType": "MedicationStatement",
+            "id": "med-2",
+            "subject": {"reference": "https://example.org/fhir/Patient/p-2/_history/3"},
+            "medicationCodeableConcept": {"coding": [{"code": "1049502", "display": "Acetaminophen"}]}
+        }}
+    ]}
+    patient_bundle = {"resourceType": "Bundle", "type": "transaction", "entry": [
+        {"fullUrl": patient_url, "resource": {"resourceType": "Patient", "name": [{"family": "Doe", "given": ["Jane"]}]}}
+    ]}
+
+    transformer = FHIRTransformer(str(tmp_path / "db.libsql"))
+    # The medication is written before the Bundle with its patient is seen
+    transformer.process(medication_bundle)
+    transformer.process(patient_bundle)
+    transformer.finalize()
+
+    patient_id = patient_url[len("urn:uuid:"):]
+    assert FHIRTransformer.patient_id_of(medication_bundle["entry"][0]["resource"], transformer.references) == patient_id
+
+    conn = sqlite3.connect(str(tmp_path / "db.libsql"))
+    assert conn.execute("SELECT id FROM patient").fetchall() == [(patient_id,)]
+    assert conn.execute("SELECT id, patient_id FROM medication ORDER BY id").fetchall() == [
+        ("med-1", patient_id), ("med-2", "p-2")
+    ]
+    conn.close()
+
+def test_unsupported_resources_are_skipped_before_decoding():
+    """Test that unsupported Bundle entries and documents are skipped in the raw text."""
+    from refiner.utils.sniff import load_resources
+
+    supported = {"Patient", "MedicationStatement"}
+    patient = {"resourceType": "Patient", "id": "p-1", "name": [{"family": "Doe", "given": ["Jane"]}]}
+    bundle = {"resourceType": "Bundle", "type": "collection", "entry": [
+        {"fullUrl": "urn:uuid:1", "resource": {"resourceType": "Binary", "id": "b-1", "data": "QUJD\\\"" * 1000}},
+        {"fullUrl": "urn:uuid:2", "resource": patient},
+        # resourceType of a contained resource comes first; the entry is still recognised as a DocumentReference
+        {"resource": {"contained": [{"resourceType": "Patient", "id": "c"}], "resourceType": "DocumentReference",
+                      "id": "d-1", "content": [{"attachment": {"data": "e30=", "title": "{[\"]}"}}]}},
+        {"request": {"method": "POST"}, "resource": {"id": "m-1", "resourceType": "MedicationStatement"}}
+    ]}
+
+    skipped = []
+    loaded = load_resources(json.dumps(bundle, indent=2), supported, skipped.append)
+    assert loaded["type"] == "collection"
+    assert [entry["resource"]["id"] for entry in loaded["entry"]] == ["p-1", "m-1"]
+    assert skipped == ["Binary", "DocumentReference"]
+
+    # Nested Bundles are kept and their entries filtered too, whichever way the entry is laid out
+    nested = {"resourceType": "Bundle", "entry": [
+        {"fullUrl": "urn:uuid:3", "resource": bundle},
+        {"search": {"mode": "include"}, "resource": {"type": "batch", "resourceType": "Bundle", "entry": [
+            {"resource": {"resourceType": "Binary", "id": "b-2"}},
+            {"resource": {"resourceType": "MedicationStatement", "id": "m-2"}}
+        ]}}
+    ]}
+    skipped.clear()
+    loaded = load_resources(json.dumps(nested), supported, skipped.append)
+    assert [entry["resource"]["id"] for entry in loaded["entry"][0]["resource"]["entry"]] == ["p-1", "m-1"]
+    assert loaded["entry"][1]["search"] == {"mode": "include"}
+    assert [entry["resource"]["id"] for entry in loaded["entry"][1]["resource"]["entry"]] == ["m-2"]
+    assert skipped == ["Binary", "DocumentReference", "Binary"]
+
+    assert load_resources(json.dumps({"resourceType": "Binary", "data": "QUJD"}), supported, skipped.append) is None
+    assert load_resources(json.dumps(patient), supported) == patient
+
+def test_json_codec_backends_agree(monkeypatch, tmp_path):
+    """Test that the optional fast JSON backend and the json module fallback encode and decode alike."""
+    import math
+    from refiner.utils import json_codec
+
+    def encoded(name):
+        json_codec.dump(value, str(tmp_path / name), indent=4)
+        with open(tmp_path / name, "rb") as f:
+            return json_codec.canonical(value), json_codec.loads(json_codec.dumps(value)), f.read()
+
+    value = {"b": [1, 2.5, 1e-07, 1e16, None, True], "a": {"name": "José", "given": ["Zoë"]}, "big": 2 ** 70 + 1}
+    fast = encoded("fast.json")
+
+    # Decoded exactly: large integers stay integers, NaN is accepted like the json module does
+    assert json_codec.loads('{"id": 12345678901234567890123}') == {"id": 12345678901234567890123}
+    assert json_codec.loads(b'{"id": -9223372036854775809}') == {"id": -9223372036854775809}
+    assert math.isnan(json_codec.loads('{"value": NaN}')["value"])
+    with pytest.raises(json.JSONDecodeError):
+        json_codec.loads('{"value": }')
+
+    monkeypatch.setattr(json_codec, "_orjson", None)
+    fallback = encoded("fallback.json")
+
+    # Canonical text and indented files are byte-identical whichever backend is installed
+    assert fast == fallback
+    assert fast[0] == (
+        '{"a":{"given":["Zoë"],"name":"José"},"b":[1,2.5,1e-07,1e+16,null,true],"big":1180591620717411303425}'
+    )
+    assert fast[2].startswith(b'{\n    "b": [\n        1,')
+    assert fast[1] == value
+
+def test_schema_generated_from_models(tmp_path):
+    """Test that the schema follows the SQLAlchemy models and is cached by their fingerprint."""
+    from sqlalchemy import Column, ForeignKey, Index, Integer, String
+    from sqlalchemy.orm import declarative_base, relationship
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+    from refiner.utils.schema import cached_schema, models_fingerprint
+
+    transformer = FHIRTransformer(str(tmp_path / "db.libsql"))
+    first, second = transformer.get_schema(), transformer.get_schema()
+    assert first == second
+    assert first["tables"][0] is second["tables"][0]
+
+    TestBase = declarative_base()
+
+    class Owner(TestBase):
+        __tablename__ = "owner"
+        __table_args__ = {"comment": "Owners"}
+        id = Column(String, primary_key=True)
+        email = Column(String, nullable=False, unique=True)
+        items = relationship("Item", back_populates="owner")
+
+    class Item(TestBase):
+        __tablename__ = "item"
+        id = Column(Integer, primary_key=True)
+        owner_id = Column(String, ForeignKey("owner.id"), nullable=False, comment="Owning owner")
+        owner = relationship("Owner", back_populates="items")
+
+    fingerprint = models_fingerprint([TestBase])
+    schema = cached_schema([TestBase])
+    owner, item = schema["tables"]
+    assert owner["description"] == "Owners"
+    assert owner["columns"][1] == {"name": "email", "type": "TEXT", "nullable": False, "unique": True}
+    assert item["columns"][1] == {
+        "name": "owner_id", "type": "TEXT", "nullable": False, "foreign_key": "owner.id", "description": "Owning owner"
+    }
+    assert schema["relationships"] == [{
+        "name": "owner_items", "source_table": "owner", "target_table": "item",
+        "source_column": "id", "target_column": "owner_id", "type": "one-to-many"
+    }]
+
+    # A model change gives a new fingerprint
+    Index("ix_item_owner", Item.__table__.c.owner_id)
+    assert models_fingerprint([TestBase]) != fingerprint
+
+def test_memory_bounded_mode_matches_default(setup_test_environment, tmp_path, monkeypatch):
+    """Test that a build under a memory budget spools and throttles but writes the same rows."""
+    import glob
+    import sqlite3
+    import tempfile
+    from benchmarks.storage import local_storage
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+    from refiner.utils import memory
+    from refiner.utils.memory import MemoryGovernor
+
+    for i in range(12):
+        with open(f"test_input/patient-{i:02d}.json", "w") as f:
+            json.dump({"resourceType": "Bundle", "entry": [
+                {"resource": {"resourceType": "Patient", "id": f"p-{j}", "name": [{"family": f"F{i}", "given": ["J"]}]}}
+                for j in range(i, i + 5)
+            ]}, f)
+
+    def table_rows(path):
+        conn = sqlite3.connect(path)
+        rows = [conn.execute(f"SELECT * FROM {table} ORDER BY id").fetchall() for table in ("patient", "medication")]
+        conn.close()
+        return rows
+
+    with local_storage(str(tmp_path / "ipfs")):
+        Refiner().transform()
+        expected = table_rows("test_output/db.libsql")
+
+        # A budget that is always exceeded: batches shrink to their minimum
+        spill_dir = str(tmp_path / "spill")
+        os.makedirs(spill_dir)
+        monkeypatch.setattr(FHIRTransformer, "commit_batch_size", 8)
+        monkeypatch.setattr(MemoryGovernor, "min_batch_size", 1)
+        collections = []
+        original_collect = memory.gc.collect
+        monkeypatch.setattr(memory.gc, "collect", lambda *args: (collections.append(1), original_collect(*args))[1])
+        config = settings.model_copy(update={"MEMORY_BUDGET_BYTES": 1, "SPILL_DIR": spill_dir})
+        refiner = Refiner(config)
+        batch_sizes = []
+        original_process = refiner._process_resources
+        monkeypatch.setattr(refiner, "_process_resources", lambda transformer, batch: (
+            batch_sizes.append(len(batch)), original_process(transformer, batch)
+        ))
+        refiner.transform()
+
+    assert table_rows("test_output/db.libsql") == expected
+    assert max(batch_sizes) <= 4 and min(batch_sizes) == 1
+    assert sum(batch_sizes) == len(expected[0]) + len(expected[1])
+    # Full collections only while the batch size can still shrink (8 -> 4 -> 2 -> 1), not once per batch
+    assert len(collections) == 3 < len(batch_sizes)
+    # The spool is removed once the database is built
+    assert glob.glob(os.path.join(spill_dir, "*")) == []
+
+def test_deterministic_output_does_not_depend_on_batching(tmp_path, monkeypatch):
+    """Test that deterministic builds are byte-identical however they are batched, and batches share one pool."""
+    import hashlib
+    import random
+    from concurrent.futures import ProcessPoolExecutor
+    from benchmarks.storage import local_storage
+    from refiner.transformer import fhir_transformer
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+    from refiner.utils.memory import MemoryGovernor
+
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    ids = list(range(60))
+    random.Random(0).shuffle(ids)
+    for i in range(3):
+        (input_dir / f"bundle-{i}.json").write_text(json.dumps({"resourceType": "Bundle", "entry": [
+            {"resource": {"resourceType": "Patient", "id": f"p-{j}", "name": [{"family": f"F{i}", "given": ["J"]}]}}
+            for j in ids[i * 15:i * 15 + 30]
+        ]}))
+
+    monkeypatch.setattr(FHIRTransformer, "commit_batch_size", 8)
+    monkeypatch.setattr(MemoryGovernor, "min_batch_size", 1)
+
+    def build(name, **overrides):
+        config = settings.model_copy(update={
+            "INPUT_DIR": str(input_dir), "OUTPUT_DIR": str(tmp_path / name), "DETERMINISTIC_OUTPUT": True, **overrides
+        })
+        with local_storage(str(tmp_path / "ipfs")):
+            Refiner(config).transform()
+        with open(tmp_path / name / "db.libsql", "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    expected = build("default")
+    assert build("in-memory", DB_BUILD_IN_MEMORY=True) == expected
+    # A budget that is always exceeded: batches shrink 8 -> 4 -> 2 -> 1
+    assert build("budget", MEMORY_BUDGET_BYTES=1, SPILL_DIR=str(tmp_path)) == expected
+    # Checkpointed builds commit batch by batch
+    assert build("checkpoint", CHECKPOINT=True) == expected
+
+    pools = []
+
+    class CountingPool(ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(kwargs["max_workers"])
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(fhir_transformer, "ProcessPoolExecutor", CountingPool)
+    monkeypatch.setattr(FHIRTransformer, "parallel_min_chunk", 1)
+    assert build("workers", CHECKPOINT=True, TRANSFORM_WORKERS=2) == expected
+    # One pool for every batch of the build
+    assert pools == [2]
+
+def test_memory_bounded_mode_streams_bundles(tmp_path, monkeypatch):
+    """Test that bounded builds stream Bundle entries into the spool, with the fullUrl index kept in the spool."""
+    import io
+    import sqlite3
+    from benchmarks.storage import local_storage
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+    from refiner.utils.sniff import iter_bundle_entries, load_resources
+    from refiner.utils.spool import SpooledReferenceIndex
+
+    supported = FHIRTransformer.supported_resource_types
+    patients = [
+        {"fullUrl": f"urn:uuid:u-{i}", "resource": {"resourceType": "Patient", "name": [{"family": "Doe", "given": ["J"]}]}}
+        for i in range(1500)
+    ]
+    statements = [
+        {"resource": {
+            "resourceType": "MedicationStatement", "id": f"m-{i}", "subject": {"reference": f"urn:uuid:u-{i}"},
+            "medicationCodeableConcept": {"coding": [{"code": "1049502", "display": "Acetaminophen"}]}
+        }}
+        for i in range(1500)
+    ]
+    bundle = {"resourceType": "Bundle", "type": "transaction", "total": 3001, "entry": [
+        *statements[:2], {"resource": {"resourceType": "Binary", "id": "b-1", "data": "QUJD" * 100}}, *patients, *statements[2:]
+    ]}
+
+    # Entries come out the same as from load_resources, wherever the chunk boundaries fall
+    text = json.dumps(bundle, indent=1)
+    expected = load_resources(text, supported)["entry"]
+    for chunk_size in (1, 7, 4096):
+        assert list(iter_bundle_entries(io.StringIO(text), supported, chunk_size=chunk_size)) == expected
+    assert iter_bundle_entries(io.StringIO(json.dumps(patients[0]["resource"])), supported) is None
+
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    (input_dir / "a.json").write_text(json.dumps(bundle))
+    # Malformed halfway through: the entries read before the error are taken out of the spool again
+    malformed = {"resourceType": "Bundle", "entry": [
+        {"resource": {"resourceType": "Patient", "id": "broken", "name": [{"family": "X", "given": ["Y"]}]}}
+    ] + patients[:1]}
+    (input_dir / "b.json").write_text(json.dumps(malformed)[:-20])
+
+    monkeypatch.setattr(FHIRTransformer, "parallel_min_chunk", 1)
+    config = settings.model_copy(update={
+        "INPUT_DIR": str(input_dir), "OUTPUT_DIR": str(tmp_path / "output"),
+        "MEMORY_BUDGET_BYTES": 2 ** 40, "SPILL_DIR": str(tmp_path), "TRANSFORM_WORKERS": 2
+    })
+    refiner = Refiner(config)
+    with local_storage(str(tmp_path / "ipfs")):
+        refiner.transform()
+    # The fullUrls were indexed in the spool, which the workers resolved their references against
+    assert isinstance(refiner.references, SpooledReferenceIndex)
+
+    conn = sqlite3.connect(str(tmp_path / "output" / "db.libsql"))
+    assert conn.execute("SELECT COUNT(*) FROM patient").fetchone()[0] == 1500
+    assert conn.execute("SELECT COUNT(*) FROM patient WHERE id = 'broken'").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM medication WHERE patient_id = 'u-' || substr(id, 3)").fetchone()[0] == 1500
+    conn.close()
+
+def test_output_records_database_digests(setup_test_environment, tmp_path):
+    """Test that output.json records the sizes and digests of the database and its encrypted file."""
+    import hashlib
+    from benchmarks.storage import local_storage
+    from refiner.config import Settings
+
+    with open("test_input/patient.json", "w") as f:
+        json.dump({"resourceType": "Patient", "id": "p-1", "name": [{"family": "Doe", "given": ["Jane"]}]}, f)
+
+    config = Settings(INPUT_DIR="test_input", OUTPUT_DIR="test_output", DIGEST_BLAKE2=True)
+    with local_storage(str(tmp_path / "ipfs")):
+        output = Refiner(config).transform()
+
+    with open(os.path.join("test_output", "output.json")) as f:
+        digests = json.load(f)["digests"]
+    assert digests == output.digests.model_dump()
+
+    for key, path in [("plaintext", "test_output/db.libsql"), ("encrypted", "test_output/db.libsql.pgp")]:
+        with open(path, "rb") as f:
+            data = f.read()
+        assert digests[key] == {
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "blake2b": hashlib.blake2b(data).hexdigest()
+        }
+
+def test_terminology_index_enriches_medications(setup_test_environment, tmp_path):
+    """Test that medication rows get displays and ingredients from a terminology index, in batches."""
+    import sqlite3
+    from benchmarks.storage import local_storage
+    from refiner.config import Settings
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+    from refiner.utils.terminology import RXNORM_SYSTEM, TerminologyIndex, build_terminology_index
+
+    concepts = tmp_path / "rxnorm.tsv"
+    concepts.write_text(
+        "# code\tdisplay\tingredient\n"
+        "1049502\tAcetaminophen 325 MG Oral Tablet\tacetaminophen\n"
+        "197361\tAmlodipine 5 MG Oral Tablet\n"
+    )
+
+    def statement(medication_id, code, display="", system=RXNORM_SYSTEM):
+        return {"resource": {
+            "resourceType": "MedicationStatement", "id": medication_id, "subject": {"reference": "Patient/p-1"},
+            "medicationCodeableConcept": {"coding": [{"system": system, "code": code, "display": display}]}
+        }}
+
+    with open("test_input/bundle.json", "w") as f:
+        json.dump({"resourceType": "Bundle", "entry": [
+            {"resource": {"resourceType": "Patient", "id": "p-1", "name": [{"family": "Doe", "given": ["Jane"]}]}},
+            statement("m-1", "1049502"),
+            statement("m-2", "197361", display="Norvasc"),
+            statement("m-3", "1049502", system="http://snomed.info/sct"),
+            statement("m-4", "999999")
+        ]}, f)
+
+    config = Settings(INPUT_DIR="test_input", OUTPUT_DIR="test_output", TERMINOLOGY_INDEX_PATH=str(concepts))
+    with local_storage(str(tmp_path / "ipfs")):
+        Refiner(config).transform()
+
+    conn = sqlite3.connect("test_output/db.libsql")
+    rows = conn.execute("SELECT id, display, ingredient FROM medication WHERE id LIKE 'm-%' ORDER BY id").fetchall()
+    conn.close()
+    assert rows == [
+        ("m-1", "Acetaminophen 325 MG Oral Tablet", "acetaminophen"),
+        ("m-2", "Norvasc", None),  # Existing displays are kept
+        ("m-3", "", None),  # Another code system
+        ("m-4", "", None)  # Not in the index
+    ]
+
+    # A prebuilt index is used in place
+    index_path = str(tmp_path / "rxnorm.sqlite")
+    assert build_terminology_index(str(concepts), index_path) == 2
+    index = TerminologyIndex(index_path)
+    assert index.path == index_path
+    assert index.lookup(["197361", "1049502", "197361", "42"]) == {
+        "197361": ("Amlodipine 5 MG Oral Tablet", None),
+        "1049502": ("Acetaminophen 325 MG Oral Tablet", "acetaminophen")
+    }
+    index.close()
+    assert os.path.exists(index_path)
+
+    # Worker processes open the temporary index of a source file themselves; it is deleted once they are done
+    index = TerminologyIndex(str(concepts))
+    transformer = FHIRTransformer(str(tmp_path / "parallel.libsql"), terminology=index)
+    transformer.parallel_min_chunk = 1
+    transformer.process_parallel([statement(f"w-{i}", "1049502")["resource"] for i in range(4)], 2)
+    transformer.engine.dispose()
+    index.close()
+    assert not os.path.exists(index.path)
+
+    conn = sqlite3.connect(str(tmp_path / "parallel.libsql"))
+    assert conn.execute("SELECT DISTINCT display, ingredient FROM medication").fetchall() == [
+        ("Acetaminophen 325 MG Oral Tablet", "acetaminophen")
+    ]
+    conn.close()
+
+@pytest.mark.skipif(not os.environ.get("REFINER_PERF_TESTS"), reason="performance tier: set REFINER_PERF_TESTS=1")
+@pytest.mark.parametrize("dataset_name", sorted(load_baseline()["datasets"]))
+def test_performance_against_baseline(dataset_name):
+    """Test that refining a fixed synthetic dataset stays within its throughput floor, memory ceiling and baseline."""
+    from benchmarks.regression import check_point, run_dataset
+
+    baseline = load_baseline()
+    tolerance = float(os.environ.get("REFINER_PERF_TOLERANCE", baseline["tolerance"]))
+    dataset = baseline["datasets"][dataset_name]
+
+    point = run_dataset(dataset, runs=int(os.environ.get("REFINER_PERF_RUNS", "1")))
+    assert check_point(point, dataset, tolerance) == []
+
+def test_profiling_artifacts_written_to_output_dir(setup_test_environment, tmp_path):
+    """Test that enabled profiling writes per-stage cProfile and tracemalloc reports and resource timings."""
+    import pstats
+    import tracemalloc
+    from benchmarks.storage import local_storage
+    from refiner.config import Settings
+
+    config = Settings(
+        INPUT_DIR="test_input", OUTPUT_DIR="test_output",
+        PROFILE_CPU=True, PROFILE_MEMORY=True, PROFILE_TOP=5, PROFILE_SAMPLE_EVERY=1
+    )
+    with local_storage(str(tmp_path / "ipfs")):
+        Refiner(config).transform()
+
+    profile_dir = os.path.join("test_output", "profile")
+    for stage in ("transformed", "schema", "encrypted", "db_pinned"):
+        assert pstats.Stats(os.path.join(profile_dir, f"{stage}.pstats")).total_calls > 0
+        assert os.path.exists(os.path.join(profile_dir, f"{stage}.txt"))
+        with open(os.path.join(profile_dir, f"{stage}.tracemalloc.txt")) as f:
+            assert f.readline().startswith(f"Stage {stage}:")
+    assert not tracemalloc.is_tracing()
+
+    with open(os.path.join(profile_dir, "transform_resource.json")) as f:
+        timings = json.load(f)
+    assert timings["Patient"]["sampled"] == timings["Patient"]["seen"] >= 1
+    assert timings["MedicationStatement"]["mean_seconds"] > 0
+
+def test_parallel_references_resolve_across_chunks(tmp_path):
+    """Test that references between resources of different worker chunks resolve, and unresolved ones are kept."""
+    import sqlite3
+    from refiner.transformer.fhir_transformer import FHIRTransformer
+
+    def statement(medication_id, reference):
+        return {
+            "resourceType": "MedicationStatement", "id": medication_id, "subject": {"reference": reference},
+            "medicationCodeableConcept": {"coding": [{"code": "1049502", "display": "Acetaminophen"}]}
+        }
+
+    def bundle(uuid, patient_id):
+        return {"resourceType": "Bundle", "type": "transaction", "entry": [{
+            "fullUrl": f"urn:uuid:{uuid}",
+            "resource": {"resourceType": "Patient", "id": patient_id, "name": [{"family": "Doe", "given": ["J"]}]}
+        }]}
+
+    # Chunks of two: each statement's patient is in the Bundle of the other chunk
+    resources = [
+        statement("m-1", "urn:uuid:b"), bundle("a", "p-a"),
+        bundle("b", "p-b"), statement("m-2", "urn:uuid:a"),
+        statement("m-3", "urn:uuid:missing")
+    ]
+
+    db_path = str(tmp_path / "db.libsql")
+    transformer = FHIRTransformer(db_path)
+    transformer.parallel_min_chunk = 1
+    transformer.process_parallel(resources, 3)
+    assert transformer.references.resolve("urn:uuid:a") == ("Patient", "p-a")
+    transformer.finalize()
+    transformer.engine.dispose()
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT id, patient_id FROM medication ORDER BY id").fetchall()
+    conn.close()
+    assert rows == [("m-1", "p-b"), ("m-2", "p-a"), ("m-3", "unknown")]
+    # The reference that does not resolve anywhere is still reported, not dropped
+    assert transformer.progress.count("unresolved reference") == 1